@@ -73,6 +73,19 @@ def create_app(config_name='default'):
     from .db_utils import init_app as init_db_utils
     init_db_utils(app)
     
+    # Pool de conexiones SQLite a las bases de datos versionadas
+    from .db_pool import init_app as init_db_pool
+    init_db_pool(app)
+    
+    # Métricas por solicitud (antes que el resto de los before_request para
+    # que la duración incluya todo el procesamiento)
+    from .metrics import init_app as init_metrics
+    init_metrics(app)
+    
+    # Caché de páginas renderizadas por versión
+    from .page_cache import init_app as init_page_cache
+    init_page_cache(app)
+    
     # Verificar el contexto de aplicación
     if has_app_context():
         logging.info("Verificación: contexto de aplicación disponible")
@@ -94,7 +107,15 @@ def create_app(config_name='default'):
                 # Si no hay versión en la sesión, no establecemos ninguna versión específica
                 # para que use la última por defecto (None o '')
                 g.version = ''
-    
+
+    # Datos del selector de versiones para todas las plantillas (en memoria,
+    # se recalculan solo cuando cambia el directorio de versiones)
+    @app.context_processor
+    def inject_versions():
+        from .version_catalog import catalog
+        versiones, latest_formatted = catalog.formatted_versions()
+        return {'versiones': versiones, 'latest_formatted': latest_formatted}
+
     # Definir el cargador de usuarios para Flask-Login
     @login_manager.user_loader
     def load_user(user_id):
@@ -128,6 +149,11 @@ def create_app(config_name='default'):
     app.register_blueprint(api_bp, url_prefix='/api')
     app.register_blueprint(auth_bp, url_prefix='/auth')
     
+    # Precarga de cachés al publicar una versión (se registra al final para
+    # ejecutarse después de que el resto de las cachés se vaciaron)
+    from .warmup import init_app as init_warmup
+    init_warmup(app)
+    
     # Crear función para forzar HTTPS en producción
     @app.before_request
     def before_request_https():
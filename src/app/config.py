@@ -17,6 +17,29 @@ class Config:
     # Deshabilitamos el tracking de modificaciones para mejorar el rendimiento
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Caché de páginas renderizadas por versión (memoria máxima y vigencia en segundos)
+    PAGE_CACHE_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 300))
+    
+    # Precargar en segundo plano las cachés de la versión más reciente al publicarla
+    WARM_CACHES_ON_PUBLISH = True
+    
+    # Las versiones publicadas se abren en solo lectura e inmutables (sin
+    # bloqueos ni detección de cambios); solo la ingesta escribe en ellas
+    SQLITE_READ_ONLY = True
+    SQLITE_IMMUTABLE = True
+    # Perfil de PRAGMA de las conexiones de lectura
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -16000))
+    SQLITE_TEMP_STORE = os.environ.get('SQLITE_TEMP_STORE', 'MEMORY')
+    
+    # Métricas de latencia y de tiempo en SQLite por solicitud (/metrics)
+    METRICS_ENABLED = True
+    # Cabecera Server-Timing en todas las respuestas (si no, solo para administradores)
+    METRICS_SERVER_TIMING = False
+    # Segundos a partir de los cuales se registra la consulta más lenta de una solicitud
+    SLOW_QUERY_THRESHOLD = float(os.environ.get('SLOW_QUERY_THRESHOLD', 0.5))
+    
     # Configuración para el entorno de producción
     @staticmethod
     def init_app(app):
@@ -33,6 +56,9 @@ class TestingConfig(Config):
     # URI para la base de datos de aranceles
     ARANCEL_DATABASE_URI = f"sqlite:////Users/mat/Code/aduana/data/arancel.sqlite3"
     WTF_CSRF_ENABLED = False
+    # Sin caché de páginas ni precarga en segundo plano en las pruebas
+    PAGE_CACHE_MAX_BYTES = 0
+    WARM_CACHES_ON_PUBLISH = False
 
 class ProductionConfig(Config):
     """Configuración para entorno de producción."""
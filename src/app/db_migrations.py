@@ -0,0 +1,188 @@
+"""
+Registro de migraciones del esquema de las bases de datos por versión.
+
+Cada base de datos guarda en ``PRAGMA user_version`` el número de la última
+migración aplicada. Las migraciones pendientes se aplican una sola vez, al
+publicar una versión o desde el gestor de versiones; al iniciar, la
+aplicación solo lee esos números (en modo solo lectura) y avisa si alguna
+versión quedó atrasada.
+
+Las migraciones se aplican sobre una copia que luego reemplaza al archivo con
+un rename, igual que al publicar, porque los procesos de la aplicación abren
+las versiones como inmutables.
+"""
+import logging
+import os
+import re
+import shutil
+import sqlite3
+from contextlib import closing
+
+from .db_pool import database_uri
+from .db_schema import (ensure_classification_columns, ensure_content_hash, ensure_fts_index,
+                        ensure_ncm_key, ensure_version_stats)
+
+# Archivos de versión dentro del directorio de versiones
+VERSION_FILE_RE = re.compile(r'^arancel_(\w+)\.sqlite3$')
+
+
+def create_note_tables(conn):
+    """Tablas de notas de sección y de capítulo."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS chapter_notes (
+            id INTEGER PRIMARY KEY,
+            chapter_number TEXT NOT NULL UNIQUE,
+            note_text TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS section_notes (
+            id INTEGER PRIMARY KEY,
+            section_number TEXT NOT NULL UNIQUE,
+            note_text TEXT NOT NULL
+        )
+    ''')
+
+
+# Migraciones en orden de aplicación: (número, descripción, función). Cada
+# función recibe una conexión de escritura y debe poder aplicarse sobre una
+# base de datos que ya tenga la estructura (las versiones anteriores al
+# registro no tienen número). Las migraciones nuevas se agregan al final.
+MIGRATIONS = (
+    (1, 'tablas de notas', create_note_tables),
+    (2, 'índice de texto completo', ensure_fts_index),
+    (3, 'clave NCM canónica', ensure_ncm_key),
+    (4, 'números de sección, capítulo y partida', ensure_classification_columns),
+    (5, 'totales de la versión', ensure_version_stats),
+    (6, 'hash del contenido', ensure_content_hash),
+)
+
+# Número de esquema de una versión con todas las migraciones aplicadas
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    """Número de la última migración aplicada a una base de datos."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def read_schema_version(db_path):
+    """
+    Lee el número de esquema de un archivo sin abrirlo para escritura.
+
+    Returns:
+        int: Número de esquema, o None si el archivo no se pudo leer
+    """
+    try:
+        with closing(sqlite3.connect(database_uri(db_path), uri=True)) as conn:
+            return get_schema_version(conn)
+    except sqlite3.Error as e:
+        logging.error(f"No se pudo leer el esquema de {db_path}: {str(e)}")
+        return None
+
+
+def stamp_schema_version(conn):
+    """Marca una base de datos construida con el esquema actual como al día."""
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def migrate(conn):
+    """
+    Aplica las migraciones pendientes sobre una conexión de escritura.
+
+    Cada migración se confirma junto con su número, de modo que una
+    interrupción deja la base de datos en la última migración completa.
+
+    Returns:
+        list: Números de las migraciones aplicadas
+    """
+    current = get_schema_version(conn)
+    applied = []
+    for number, description, migration in MIGRATIONS:
+        if number <= current:
+            continue
+        migration(conn)
+        conn.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+        logging.info(f"Migración {number} ({description}) aplicada")
+        applied.append(number)
+    return applied
+
+
+def migrate_file(db_path):
+    """
+    Aplica las migraciones pendientes de un archivo de versión.
+
+    Args:
+        db_path (str): Ruta a la base de datos de la versión
+
+    Returns:
+        list: Números de las migraciones aplicadas (vacía si estaba al día)
+    """
+    current = read_schema_version(db_path)
+    if current is not None and current >= SCHEMA_VERSION:
+        return []
+
+    tmp_path = f"{db_path}.tmp-{os.getpid()}"
+    try:
+        shutil.copy2(db_path, tmp_path)
+        with closing(sqlite3.connect(tmp_path)) as conn:
+            applied = migrate(conn)
+        os.replace(tmp_path, db_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    logging.info(f"{db_path} migrado al esquema {SCHEMA_VERSION}")
+    return applied
+
+
+def version_files(versions_dir):
+    """
+    Archivos de versión de un directorio (sin el enlace 'latest').
+
+    Returns:
+        list: Rutas ordenadas por nombre
+    """
+    versions_dir = str(versions_dir)
+    if not os.path.isdir(versions_dir):
+        return []
+    return [
+        os.path.join(versions_dir, filename)
+        for filename in sorted(os.listdir(versions_dir))
+        if VERSION_FILE_RE.match(filename) and not os.path.islink(os.path.join(versions_dir, filename))
+    ]
+
+
+def pending_versions(versions_dir):
+    """
+    Versiones cuyo esquema no está al día, leyendo solo su número de esquema.
+
+    Returns:
+        dict: Ruta -> número de esquema (None si no se pudo leer)
+    """
+    pending = {}
+    for db_path in version_files(versions_dir):
+        current = read_schema_version(db_path)
+        if current is None or current < SCHEMA_VERSION:
+            pending[db_path] = current
+    return pending
+
+
+def migrate_all(versions_dir):
+    """
+    Aplica las migraciones pendientes a todas las versiones de un directorio.
+
+    Returns:
+        dict: Ruta -> migraciones aplicadas, solo para las versiones migradas
+    """
+    results = {}
+    for db_path in pending_versions(versions_dir):
+        try:
+            applied = migrate_file(db_path)
+        except (OSError, sqlite3.Error) as e:
+            logging.error(f"Error al migrar {db_path}: {str(e)}")
+            continue
+        if applied:
+            results[db_path] = applied
+    return results
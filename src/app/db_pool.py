@@ -0,0 +1,285 @@
+"""
+Pool de conexiones SQLite para las bases de datos versionadas del arancel.
+
+Cada hilo mantiene abierta una conexión por archivo de base de datos, de modo
+que las consultas de los modelos reutilizan la conexión (y su caché de
+sentencias preparadas) en lugar de abrir y cerrar una nueva en cada llamada.
+
+Las versiones publicadas no se modifican nunca (una versión nueva reemplaza
+el archivo con un rename), así que se abren en modo solo lectura e inmutable:
+SQLite no toma bloqueos ni verifica cambios en cada lectura. Las escrituras
+quedan reservadas a la ingesta, que usa sus propias conexiones.
+"""
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from pathlib import Path
+
+from .metrics import current_query_stats
+
+# Cantidad de sentencias preparadas que sqlite3 conserva por conexión
+CACHED_STATEMENTS = 256
+
+# Perfil de PRAGMA de las conexiones de lectura (se toma de la configuración)
+DEFAULT_PRAGMAS = {
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -16000,
+    'temp_store': 'MEMORY',
+}
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    Cursor que cronometra sus consultas durante una solicitud.
+
+    El tiempo de ejecución y de lectura de filas de cada sentencia se suma al
+    acumulador de la solicitud actual (ver metrics.py); fuera de una
+    solicitud el cursor se comporta como uno común.
+    """
+
+    _stats = None
+    _sql = None
+    _elapsed = 0.0
+
+    def _timed(self, method, *args):
+        stats = self._stats
+        if stats is None:
+            return method(self, *args)
+        started = time.perf_counter()
+        try:
+            return method(self, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self._elapsed += elapsed
+            stats.add(self._sql, elapsed, self._elapsed, False)
+
+    def _execute(self, method, sql, parameters):
+        stats = self._stats = current_query_stats()
+        if stats is None:
+            return method(self, sql, parameters)
+        self._sql = sql
+        started = time.perf_counter()
+        try:
+            return method(self, sql, parameters)
+        finally:
+            self._elapsed = time.perf_counter() - started
+            stats.add(sql, self._elapsed, self._elapsed, True)
+
+    def execute(self, sql, parameters=()):
+        return self._execute(sqlite3.Cursor.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._execute(sqlite3.Cursor.executemany, sql, seq_of_parameters)
+
+    def fetchone(self):
+        return self._timed(sqlite3.Cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed(sqlite3.Cursor.fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._timed(sqlite3.Cursor.fetchall)
+
+    def __next__(self):
+        return self._timed(sqlite3.Cursor.__next__)
+
+
+class PooledConnection(sqlite3.Connection):
+    """Conexión SQLite administrada por el pool (admite referencias débiles)."""
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or TimedCursor)
+
+    # Connection.execute no pasa por cursor(): se redirige para cronometrarla
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _file_id(db_path):
+    """Identifica el archivo al que apunta una ruta (sigue enlaces simbólicos)."""
+    try:
+        stat = os.stat(db_path)
+    except OSError:
+        return None
+    return (stat.st_dev, stat.st_ino)
+
+
+def database_uri(db_path, read_only=True, immutable=True):
+    """
+    URI de SQLite para abrir una base de datos.
+
+    Args:
+        db_path (str): Ruta al archivo de base de datos
+        read_only (bool): Abrir en modo solo lectura (mode=ro)
+        immutable (bool): Declarar el archivo inmutable (sin bloqueos ni
+            detección de cambios); solo se aplica en modo solo lectura
+
+    Returns:
+        str: URI ``file:`` con la ruta absoluta codificada
+    """
+    uri = Path(os.path.abspath(str(db_path))).as_uri()
+    if not read_only:
+        return uri
+    return f"{uri}?mode=ro&immutable=1" if immutable else f"{uri}?mode=ro"
+
+
+class SQLiteConnectionPool:
+    """Mantiene una conexión abierta por hilo y por ruta de base de datos."""
+
+    def __init__(self, cached_statements=CACHED_STATEMENTS):
+        self.cached_statements = cached_statements
+        self.read_only = True
+        self.immutable = True
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Registro de todas las conexiones abiertas para poder cerrarlas al
+        # apagar la aplicación; las de hilos terminados desaparecen solas.
+        self._connections = weakref.WeakSet()
+        # Se incrementa cuando cambia el catálogo de versiones; las conexiones
+        # de una generación anterior se verifican antes de reutilizarlas
+        self.generation = 0
+
+    def _thread_connections(self):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        return connections
+
+    def configure(self, read_only=True, immutable=True, pragmas=None):
+        """
+        Define el modo de apertura y el perfil de PRAGMA de las conexiones nuevas.
+
+        Args:
+            read_only (bool): Abrir las bases de datos en solo lectura
+            immutable (bool): Abrirlas además como inmutables
+            pragmas (dict): PRAGMA a aplicar en cada conexión (nombre -> valor)
+        """
+        self.read_only = read_only
+        self.immutable = immutable
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+
+    def uri(self, db_path, immutable=True):
+        """URI con la que el pool abre (o adjunta) una base de datos."""
+        return database_uri(db_path, read_only=self.read_only, immutable=self.immutable and immutable)
+
+    def connect(self, db_path, immutable=True):
+        """
+        Abre una conexión nueva, no administrada por el pool.
+
+        Args:
+            db_path (str): Ruta al archivo de base de datos
+            immutable (bool): False para archivos que se actualizan en el
+                lugar (se abren en solo lectura, pero con bloqueos)
+        """
+        conn = sqlite3.connect(
+            self.uri(db_path, immutable),
+            factory=PooledConnection,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+            uri=True,
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            if value is not None:
+                conn.execute(f"PRAGMA {name} = {value}")
+        conn.file_id = _file_id(db_path)
+        conn.generation = self.generation
+        return conn
+
+    def get_connection(self, db_path, immutable=True):
+        """
+        Obtiene la conexión del hilo actual para una base de datos.
+
+        Args:
+            db_path (str): Ruta al archivo de base de datos
+
+        Returns:
+            sqlite3.Connection: Conexión abierta con row_factory=sqlite3.Row
+        """
+        db_path = str(db_path)
+        connections = self._thread_connections()
+        conn = connections.get(db_path)
+        if conn is not None and conn.generation != self.generation:
+            # Se publicó una versión: si la ruta apunta ahora a otro archivo
+            # (rename o cambio del enlace 'latest') se abre una conexión nueva
+            if _file_id(db_path) != conn.file_id:
+                logging.info(f"{db_path} fue reemplazado, reabriendo la conexión")
+                connections.pop(db_path)
+                self._close(conn)
+                conn = None
+            else:
+                conn.generation = self.generation
+        if conn is None:
+            conn = self.connect(db_path, immutable)
+            connections[db_path] = conn
+            with self._lock:
+                self._connections.add(conn)
+            logging.debug(f"Nueva conexión SQLite en pool para {db_path}")
+        return conn
+
+    def discard(self, db_path):
+        """Cierra y descarta la conexión del hilo actual para una base de datos."""
+        conn = self._thread_connections().pop(str(db_path), None)
+        if conn is not None:
+            self._close(conn)
+
+    def close_thread(self):
+        """Cierra todas las conexiones del hilo actual."""
+        connections = self._thread_connections()
+        for conn in list(connections.values()):
+            self._close(conn)
+        connections.clear()
+
+    def invalidate(self):
+        """Marca las conexiones abiertas para verificarlas en su próximo uso."""
+        self.generation += 1
+
+    def close_all(self):
+        """Cierra todas las conexiones abiertas por el pool en cualquier hilo."""
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for conn in connections:
+            self._close(conn)
+        self._local = threading.local()
+        logging.info(f"Pool SQLite cerrado ({len(connections)} conexiones)")
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Error al cerrar conexión SQLite: {str(e)}")
+
+
+# Pool compartido por toda la aplicación
+pool = SQLiteConnectionPool()
+
+
+def get_connection(db_path, immutable=True):
+    """Atajo para obtener una conexión del pool compartido."""
+    return pool.get_connection(db_path, immutable)
+
+
+def init_app(app):
+    """Configura el pool y registra su cierre ordenado al apagar la aplicación."""
+    pool.configure(
+        read_only=app.config.get('SQLITE_READ_ONLY', True),
+        immutable=app.config.get('SQLITE_IMMUTABLE', True),
+        pragmas={
+            'mmap_size': app.config.get('SQLITE_MMAP_SIZE', DEFAULT_PRAGMAS['mmap_size']),
+            'cache_size': app.config.get('SQLITE_CACHE_SIZE', DEFAULT_PRAGMAS['cache_size']),
+            'temp_store': app.config.get('SQLITE_TEMP_STORE', DEFAULT_PRAGMAS['temp_store']),
+        },
+    )
+    from .version_catalog import catalog
+    catalog.on_invalidate(pool.invalidate)
+    atexit.register(pool.close_all)
@@ -0,0 +1,382 @@
+"""
+Estructuras derivadas de las bases de datos versionadas del arancel.
+
+Las tablas e índices de este módulo se calculan a partir de arancel_nacional
+y se construyen al cargar una versión, de modo que las consultas de la
+aplicación no tengan que recorrer la tabla completa.
+"""
+import hashlib
+import logging
+import re
+
+# Índice de texto completo sobre las descripciones
+FTS_TABLE = 'arancel_fts'
+
+# Totales precalculados de cada versión (registros por sección y capítulo)
+STATS_TABLE = 'version_stats'
+
+# Columnas originales de arancel_nacional (sin las columnas derivadas)
+ARANCEL_COLUMNS = ('NCM', 'DESCRIPCION', 'AEC', 'CL', 'E/Z', 'I/Z', 'UVF', 'SECTION', 'CHAPTER')
+
+# Clave de db_metadata con el hash del contenido de arancel_nacional
+CONTENT_HASH_KEY = 'content_hash'
+
+# Valores de los números romanos usados para identificar las secciones
+_ROMAN_VALUES = {'I': 1, 'V': 5, 'X': 10, 'L': 50, 'C': 100}
+
+# Identificador al inicio del texto de una sección: "II - ...", "SECCIÓN II ..." o "2"
+_SECTION_ID_RE = re.compile(r'^\s*(?:SECCI[OÓ]N\s+)?([IVXLC]+|\d+)\b', re.IGNORECASE)
+
+# Número al inicio del texto de un capítulo: "09 - Café, té, ..."
+_CHAPTER_ID_RE = re.compile(r'^\s*(\d+)')
+
+
+def canonical_ncm(ncm):
+    """
+    Normaliza un código NCM a solo dígitos.
+
+    Args:
+        ncm (str): Código con o sin puntos (ej: '2004.10.00.00' o '20041000')
+
+    Returns:
+        str: Código canónico (ej: '2004100000')
+    """
+    if not ncm:
+        return ''
+    # Camino rápido para el formato habitual con puntos
+    key = str(ncm).strip().replace('.', '')
+    if key.isdigit():
+        return key
+    return ''.join(char for char in key if char.isdigit())
+
+
+def ncm_key_range(prefix):
+    """
+    Límites para buscar por prefijo sobre la columna ncm_key.
+
+    Todas las claves que empiezan con ``prefix`` cumplen
+    ``inicio <= ncm_key < fin``, lo que permite recorrer el índice por rango.
+
+    Args:
+        prefix (str): Prefijo canónico (solo dígitos)
+
+    Returns:
+        tuple: (inicio, fin)
+    """
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def parse_section_no(section):
+    """
+    Obtiene el número de sección a partir de su texto o de su número romano.
+
+    Args:
+        section (str): 'II - Productos del reino vegetal', 'II', 'SECCIÓN II' o '2'
+
+    Returns:
+        int: Número de sección, o None si no se reconoce
+    """
+    if not section:
+        return None
+    match = _SECTION_ID_RE.match(str(section))
+    if not match:
+        return None
+    ident = match.group(1).upper()
+    if ident.isdigit():
+        return int(ident) or None
+
+    decimal = 0
+    prev_value = 0
+    for char in reversed(ident):
+        value = _ROMAN_VALUES[char]
+        if value >= prev_value:
+            decimal += value
+        else:
+            decimal -= value
+        prev_value = value
+    return decimal or None
+
+
+def parse_chapter_no(chapter):
+    """
+    Obtiene el número de capítulo a partir de su texto.
+
+    Args:
+        chapter (str): '09 - Café, té, yerba mate y especias' o '9'
+
+    Returns:
+        int: Número de capítulo, o None si no se reconoce
+    """
+    if not chapter:
+        return None
+    match = _CHAPTER_ID_RE.match(str(chapter))
+    if not match:
+        return None
+    return int(match.group(1)) or None
+
+
+def _ncm_prefix_no(ncm, length):
+    key = canonical_ncm(ncm)
+    if len(key) < length:
+        return None
+    return int(key[:length])
+
+
+def table_exists(conn, table):
+    """Indica si una tabla existe en la base de datos."""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)
+    ).fetchone()
+    return row is not None
+
+
+def ensure_fts_index(conn, rebuild=False):
+    """
+    Crea el índice FTS5 de descripciones de arancel_nacional.
+
+    El tokenizador unicode61 con remove_diacritics permite que "cafe"
+    encuentre "café". El índice guarda el NCM (sin indexar) para unirlo con
+    arancel_nacional, ya que los rowid pueden cambiar con un VACUUM.
+
+    Args:
+        conn (sqlite3.Connection): Conexión de escritura a la base de datos
+        rebuild (bool): Reconstruir el índice aunque ya exista
+
+    Returns:
+        bool: True si se construyó el índice
+    """
+    if not table_exists(conn, 'arancel_nacional'):
+        return False
+    if table_exists(conn, FTS_TABLE) and not rebuild:
+        return False
+
+    conn.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+            ncm UNINDEXED,
+            descripcion,
+            tokenize = "unicode61 remove_diacritics 2"
+        )
+    ''')
+    conn.execute(f'''
+        INSERT INTO {FTS_TABLE} (ncm, descripcion)
+        SELECT NCM, COALESCE(DESCRIPCION, '') FROM arancel_nacional
+    ''')
+    conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_arancel_nacional_ncm ON arancel_nacional(NCM)")
+    logging.info(f"Índice de texto completo {FTS_TABLE} construido")
+    return True
+
+
+def ensure_ncm_key(conn):
+    """
+    Agrega y completa la columna ncm_key (NCM solo con dígitos) con su índice.
+
+    Args:
+        conn (sqlite3.Connection): Conexión de escritura a la base de datos
+
+    Returns:
+        bool: True si se modificó la base de datos
+    """
+    if not table_exists(conn, 'arancel_nacional'):
+        return False
+
+    changed = False
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(arancel_nacional)")]
+    if 'ncm_key' not in columns:
+        conn.execute("ALTER TABLE arancel_nacional ADD COLUMN ncm_key TEXT")
+        changed = True
+
+    conn.create_function('canonical_ncm', 1, canonical_ncm, deterministic=True)
+    updated = conn.execute(
+        "UPDATE arancel_nacional SET ncm_key = canonical_ncm(NCM) WHERE ncm_key IS NULL"
+    ).rowcount
+    if updated:
+        changed = True
+
+    index = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_arancel_nacional_ncm_key'"
+    ).fetchone()
+    if not index:
+        conn.execute("CREATE INDEX idx_arancel_nacional_ncm_key ON arancel_nacional(ncm_key)")
+        changed = True
+
+    if changed:
+        logging.info(f"Columna ncm_key actualizada ({updated} registros)")
+    return changed
+
+
+def ensure_classification_columns(conn):
+    """
+    Agrega y completa las columnas numéricas section_no, chapter_no y heading_no.
+
+    section_no se obtiene del texto de SECTION (número romano), mientras que
+    chapter_no y heading_no son los dos y cuatro primeros dígitos del NCM.
+    Cada columna tiene su índice, junto con ncm_key para listar en orden.
+    Requiere la columna de ensure_ncm_key.
+
+    Args:
+        conn (sqlite3.Connection): Conexión de escritura a la base de datos
+
+    Returns:
+        bool: True si se modificó la base de datos
+    """
+    if not table_exists(conn, 'arancel_nacional'):
+        return False
+
+    changed = False
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(arancel_nacional)")]
+    for column in ('section_no', 'chapter_no', 'heading_no'):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE arancel_nacional ADD COLUMN {column} INTEGER")
+            changed = True
+
+    conn.create_function('parse_section_no', 1, parse_section_no, deterministic=True)
+    conn.create_function('ncm_prefix_no', 2, _ncm_prefix_no, deterministic=True)
+    # Todas las filas con NCM numérico tienen capítulo, así que chapter_no
+    # indica qué filas faltan por completar
+    updated = conn.execute("""
+        UPDATE arancel_nacional
+        SET section_no = parse_section_no(SECTION),
+            chapter_no = ncm_prefix_no(NCM, 2),
+            heading_no = ncm_prefix_no(NCM, 4)
+        WHERE chapter_no IS NULL
+    """).rowcount
+    if updated:
+        changed = True
+
+    for column in ('section_no', 'chapter_no', 'heading_no'):
+        index = f'idx_arancel_nacional_{column}'
+        row = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type='index' AND name=?", (index,)
+        ).fetchone()
+        # Los índices terminan en ncm_key para paginar por clave dentro de cada grupo
+        if row and 'ncm_key' not in row[0]:
+            conn.execute(f"DROP INDEX {index}")
+            row = None
+        if not row:
+            conn.execute(f"CREATE INDEX {index} ON arancel_nacional({column}, ncm_key)")
+            changed = True
+
+    if changed:
+        logging.info(f"Columnas de sección y capítulo actualizadas ({updated} registros)")
+    return changed
+
+
+def ensure_version_stats(conn, rebuild=False):
+    """
+    Calcula los totales de la versión en la tabla version_stats.
+
+    Guarda una fila por alcance: el total de registros ('total'), los
+    registros de cada sección ('section') y de cada capítulo ('chapter'),
+    para que las páginas de inicio y de capítulos no agreguen la tabla
+    arancel_nacional completa en cada visita. Requiere las columnas de
+    ensure_classification_columns.
+
+    Args:
+        conn (sqlite3.Connection): Conexión de escritura a la base de datos
+        rebuild (bool): Recalcular los totales aunque ya existan
+
+    Returns:
+        bool: True si se calcularon los totales
+    """
+    if not table_exists(conn, 'arancel_nacional'):
+        return False
+    if table_exists(conn, STATS_TABLE) and not rebuild:
+        total = conn.execute(f"SELECT 1 FROM {STATS_TABLE} WHERE scope = 'total'").fetchone()
+        if total:
+            return False
+
+    conn.execute(f"DROP TABLE IF EXISTS {STATS_TABLE}")
+    conn.execute(f'''
+        CREATE TABLE {STATS_TABLE} (
+            scope TEXT NOT NULL,
+            number INTEGER NOT NULL,
+            label TEXT,
+            section_no INTEGER,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (scope, number)
+        )
+    ''')
+    conn.execute(f'''
+        INSERT INTO {STATS_TABLE} (scope, number, label, section_no, count)
+        SELECT 'total', 0, NULL, NULL, COUNT(*) FROM arancel_nacional
+    ''')
+    conn.execute(f'''
+        INSERT INTO {STATS_TABLE} (scope, number, label, section_no, count)
+        SELECT 'section', section_no, MIN(SECTION), section_no, COUNT(*)
+        FROM arancel_nacional WHERE section_no IS NOT NULL GROUP BY section_no
+    ''')
+    conn.execute(f'''
+        INSERT INTO {STATS_TABLE} (scope, number, label, section_no, count)
+        SELECT 'chapter', chapter_no, MIN(CHAPTER), MIN(section_no), COUNT(*)
+        FROM arancel_nacional WHERE chapter_no IS NOT NULL GROUP BY chapter_no
+    ''')
+    logging.info(f"Totales de la versión calculados en {STATS_TABLE}")
+    return True
+
+
+def compute_content_hash(conn):
+    """
+    Calcula el hash SHA-256 del contenido de arancel_nacional.
+
+    Solo se consideran las columnas originales, ordenadas por NCM, de modo
+    que el hash no depende de las columnas e índices derivados.
+
+    Args:
+        conn (sqlite3.Connection): Conexión a la base de datos
+
+    Returns:
+        str: Hash en hexadecimal
+    """
+    columns = ', '.join(f'"{column}"' for column in ARANCEL_COLUMNS)
+    digest = hashlib.sha256()
+    for row in conn.execute(f"SELECT {columns} FROM arancel_nacional ORDER BY NCM, rowid"):
+        digest.update(repr(tuple(row)).encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def ensure_content_hash(conn, rebuild=False):
+    """
+    Guarda en db_metadata el hash del contenido de la versión.
+
+    El hash identifica el contenido publicado y se usa para los ETag de la
+    API, por lo que debe recalcularse cada vez que cambia arancel_nacional.
+
+    Args:
+        conn (sqlite3.Connection): Conexión de escritura a la base de datos
+        rebuild (bool): Recalcular el hash aunque ya exista
+
+    Returns:
+        bool: True si se calculó el hash
+    """
+    if not table_exists(conn, 'arancel_nacional'):
+        return False
+    conn.execute("CREATE TABLE IF NOT EXISTS db_metadata (key TEXT PRIMARY KEY, value TEXT)")
+    if not rebuild:
+        row = conn.execute("SELECT value FROM db_metadata WHERE key = ?", (CONTENT_HASH_KEY,)).fetchone()
+        if row and row[0]:
+            return False
+
+    content_hash = compute_content_hash(conn)
+    conn.execute(
+        "INSERT OR REPLACE INTO db_metadata (key, value) VALUES (?, ?)",
+        (CONTENT_HASH_KEY, content_hash)
+    )
+    logging.info(f"Hash de contenido calculado: {content_hash[:12]}")
+    return True
+
+
+def fts_match_query(texto):
+    """
+    Convierte un texto libre en una expresión MATCH de FTS5.
+
+    Cada palabra se busca como prefijo y todas deben aparecer, igual que la
+    búsqueda anterior con un LIKE por palabra.
+
+    Returns:
+        str: Expresión MATCH, o cadena vacía si el texto no tiene palabras
+    """
+    palabras = re.findall(r'\w+', texto or '')
+    return ' '.join(f'"{palabra}"*' for palabra in palabras)
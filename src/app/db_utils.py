@@ -28,7 +28,7 @@ logging.info(f"LATEST_SYMLINK: {LATEST_SYMLINK}")
 def init_app(app):
     """Inicializa las funciones de utilidad de base de datos en la aplicación Flask."""
     check_versions(app)
-    check_and_create_notes_tables(app)
+    check_schema_versions(app)
     
     @app.template_filter('format_version')
     def format_version(version_str):
@@ -53,31 +53,10 @@ def close_db(e=None):
         logging.error(f"Error al cerrar sesión de base de datos: {str(e)}")
 
 def get_available_versions():
-    """Obtener todas las versiones disponibles de la base de datos."""
-    versions = []
-    
-    # Verificar que el directorio existe
-    if not DB_VERSIONS_DIR.exists():
-        logging.warning(f"El directorio {DB_VERSIONS_DIR} no existe")
-        return versions
-    
-    # Buscar archivos .sqlite3 en el directorio de versiones
-    for file in DB_VERSIONS_DIR.glob('arancel_*.sqlite3'):
-        filename = file.name
-        
-        # No incluir el enlace simbólico "latest"
-        if filename == 'arancel_latest.sqlite3' and file.is_symlink():
-            continue
-            
-        # Extraer la versión del nombre del archivo (arancel_20XX.sqlite3 -> 20XX)
-        if '_' in filename:
-            version = filename.split('_')[1].split('.')[0]
-            versions.append(version)
-    
-    # Ordenar las versiones de manera descendente
-    versions.sort(reverse=True)
-    
-    return versions
+    """Obtener todas las versiones disponibles de la base de datos (de la más reciente a la más antigua)."""
+    # Importación diferida: version_catalog depende de este módulo
+    from .version_catalog import catalog
+    return catalog.versions()
 
 def get_db_path_for_version(version=None):
     """
@@ -136,69 +115,30 @@ def get_db():
     # Siempre devolver la sesión principal de SQLAlchemy
     return db.session
 
-def check_and_create_notes_tables(app=None):
+def check_schema_versions(app=None):
     """
-    Verifica si las tablas de notas existen en todas las versiones de la base de datos
-    y las crea si es necesario.
+    Verifica que todas las versiones tengan aplicadas las migraciones de esquema.
+    
+    Solo lee el número de esquema de cada archivo (en modo solo lectura), por
+    lo que no modifica las versiones ni depende de cuántas haya. Las
+    migraciones pendientes se aplican al publicar una versión o desde el
+    gestor de versiones (opción "Aplicar migraciones de esquema").
     
     Args:
         app (Flask): Instancia de la aplicación Flask
-    """
-    import sqlite3
-    import os
-    import logging
-    from pathlib import Path
-    
-    # Si no se proporciona app, obtenerla del contexto actual
-    if app is None:
-        from flask import current_app
-        app = current_app
-    
-    # Obtener la ruta base para las bases de datos
-    base_dir = Path(app.root_path).parent.parent
-    db_dir = base_dir / 'data' / 'db_versions'
-    
-    # Obtener todas las bases de datos de versiones
-    db_files = [f for f in os.listdir(db_dir) if f.endswith('.sqlite3')]
-    
-    for db_file in db_files:
-        db_path = db_dir / db_file
         
-        try:
-            conn = sqlite3.connect(str(db_path))
-            cursor = conn.cursor()
-            
-            # Verificar si la tabla chapter_notes existe
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='chapter_notes'")
-            if not cursor.fetchone():
-                # Crear tabla de notas de capítulo
-                cursor.execute('''
-                CREATE TABLE IF NOT EXISTS chapter_notes (
-                    id INTEGER PRIMARY KEY,
-                    chapter_number TEXT NOT NULL UNIQUE,
-                    note_text TEXT NOT NULL
-                )
-                ''')
-                logging.info(f"Tabla chapter_notes creada en {db_file}")
-            
-            # Verificar si la tabla section_notes existe
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='section_notes'")
-            if not cursor.fetchone():
-                # Crear tabla de notas de sección
-                cursor.execute('''
-                CREATE TABLE IF NOT EXISTS section_notes (
-                    id INTEGER PRIMARY KEY,
-                    section_number TEXT NOT NULL UNIQUE,
-                    note_text TEXT NOT NULL
-                )
-                ''')
-                logging.info(f"Tabla section_notes creada en {db_file}")
-            
-            conn.commit()
-            conn.close()
-            
-        except Exception as e:
-            logging.error(f"Error al verificar/crear tablas de notas en {db_file}: {str(e)}")
+    Returns:
+        dict: Versiones atrasadas (ruta -> número de esquema)
+    """
+    from .db_migrations import SCHEMA_VERSION, pending_versions
+    
+    pending = pending_versions(DB_VERSIONS_DIR)
+    for db_path, current in pending.items():
+        logging.warning(
+            f"{os.path.basename(db_path)} tiene el esquema {current} (actual: {SCHEMA_VERSION}); "
+            f"ejecute las migraciones pendientes desde db_version_manager"
+        )
+    return pending
 
 def check_versions(app=None):
     """
@@ -0,0 +1,113 @@
+"""
+Exportación completa de una versión del arancel en NDJSON o CSV.
+
+Las filas se leen con un cursor en lotes y se emiten a medida que se
+generan, de modo que la memoria usada no depende del tamaño de la versión.
+"""
+import csv
+import io
+import json
+import zlib
+
+from .db_pool import pool
+from .db_schema import ARANCEL_COLUMNS, _ncm_prefix_no, parse_section_no
+
+# Filas leídas del cursor en cada lote
+EXPORT_BATCH_SIZE = 1000
+
+# Formatos admitidos y su tipo MIME
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def open_export_cursor(db_path, section_no=None, chapter_no=None):
+    """
+    Abre una conexión propia y ejecuta la consulta de exportación.
+
+    La consulta se ejecuta antes de empezar a transmitir la respuesta para
+    que los errores se informen con un código HTTP adecuado. En versiones sin
+    migrar (sin las columnas section_no y chapter_no) los filtros se calculan
+    a partir de SECTION y del NCM, con los mismos criterios que la migración.
+
+    Args:
+        db_path (str): Ruta a la base de datos de la versión
+        section_no (int): Filtrar por número de sección (opcional)
+        chapter_no (int): Filtrar por número de capítulo (opcional)
+
+    Returns:
+        tuple: (conexión, cursor)
+    """
+    columns = ', '.join(f'"{column}"' for column in ARANCEL_COLUMNS)
+    conn = pool.connect(db_path)
+    try:
+        section_expr, chapter_expr = 'section_no', 'chapter_no'
+        if section_no is not None or chapter_no is not None:
+            existing = [row[1] for row in conn.execute("PRAGMA table_info(arancel_nacional)")]
+            if 'section_no' not in existing or 'chapter_no' not in existing:
+                conn.create_function('parse_section_no', 1, parse_section_no, deterministic=True)
+                conn.create_function('ncm_prefix_no', 2, _ncm_prefix_no, deterministic=True)
+                section_expr, chapter_expr = 'parse_section_no(SECTION)', 'ncm_prefix_no(NCM, 2)'
+
+        conditions = []
+        params = []
+        if section_no is not None:
+            conditions.append(f"{section_expr} = ?")
+            params.append(section_no)
+        if chapter_no is not None:
+            conditions.append(f"{chapter_expr} = ?")
+            params.append(chapter_no)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        cursor = conn.execute(f"SELECT {columns} FROM arancel_nacional {where} ORDER BY NCM", params)
+    except Exception:
+        conn.close()
+        raise
+    return conn, cursor
+
+
+def iter_batches(conn, cursor):
+    """Recorre el cursor en lotes y cierra la conexión al terminar."""
+    try:
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def iter_ndjson(batches):
+    """Una línea JSON por registro."""
+    for rows in batches:
+        yield ''.join(
+            json.dumps(dict(zip(ARANCEL_COLUMNS, tuple(row))), ensure_ascii=False) + '\n'
+            for row in rows
+        ).encode('utf-8')
+
+
+def iter_csv(batches):
+    """CSV con encabezado y los nombres de columna originales."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(ARANCEL_COLUMNS)
+    for rows in batches:
+        writer.writerows(tuple(row) for row in rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    # Encabezado de una exportación sin filas
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_gzip(chunks):
+    """Comprime un flujo de bytes en formato gzip a medida que se genera."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,131 @@
+"""
+Validadores HTTP (ETag / Last-Modified) para las respuestas de la API.
+
+Una versión publicada no cambia, así que el ETag de una respuesta se deriva
+del hash de contenido guardado en db_metadata junto con el endpoint y sus
+parámetros. Los validadores de cada versión se leen una sola vez y se
+guardan en memoria, de modo que una petición condicional que coincide se
+responde con 304 sin consultar SQLite.
+"""
+import datetime
+import functools
+import hashlib
+import logging
+import os
+import sqlite3
+
+from flask import make_response, request
+
+from .db_pool import get_connection
+from .db_schema import CONTENT_HASH_KEY
+from .version_catalog import VersionCache, resolve_arancel_db_path
+
+
+class VersionValidators:
+    """Hash de contenido y fecha de publicación de una versión."""
+
+    def __init__(self, content_hash, last_modified):
+        self.content_hash = content_hash
+        self.last_modified = last_modified
+
+    @classmethod
+    def load(cls, db_path):
+        """Lee los validadores de db_metadata (o del archivo si no están)."""
+        metadata = {}
+        try:
+            rows = get_connection(db_path).execute("SELECT key, value FROM db_metadata").fetchall()
+            metadata = {row['key']: row['value'] for row in rows}
+        except sqlite3.OperationalError:
+            # Versión sin tabla db_metadata
+            pass
+
+        stat = os.stat(db_path)
+        content_hash = metadata.get(CONTENT_HASH_KEY)
+        if not content_hash:
+            # Sin hash calculado: identificar el contenido por el archivo
+            logging.warning(f"{db_path} no tiene {CONTENT_HASH_KEY}, usando la firma del archivo")
+            content_hash = f"{stat.st_ino}-{stat.st_mtime_ns}-{stat.st_size}"
+
+        last_modified = None
+        for key in ('updated_at', 'created_at'):
+            try:
+                last_modified = datetime.datetime.fromisoformat(metadata[key])
+                break
+            except (KeyError, TypeError, ValueError):
+                continue
+        if last_modified is None:
+            last_modified = datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc)
+        elif last_modified.tzinfo is None:
+            last_modified = last_modified.astimezone(datetime.timezone.utc)
+        # Los encabezados HTTP tienen resolución de segundos
+        last_modified = last_modified.replace(microsecond=0)
+
+        return cls(content_hash, last_modified)
+
+
+_cache = VersionCache(VersionValidators.load)
+
+
+def get_validators(db_path=None):
+    """
+    Validadores de la versión seleccionada (o de ``db_path``).
+
+    Returns:
+        VersionValidators: Validadores, o None si no se pudieron leer
+    """
+    if db_path is None:
+        db_path = resolve_arancel_db_path()
+    try:
+        return _cache.get(db_path)
+    except (OSError, sqlite3.Error) as e:
+        logging.error(f"No se pudieron leer los validadores de {db_path}: {str(e)}")
+        return None
+
+
+def compute_etag(content_hash):
+    """ETag fuerte para la petición actual: contenido + endpoint + parámetros."""
+    params = sorted(request.args.items(multi=True))
+    view_args = sorted((request.view_args or {}).items())
+    key = f"{content_hash}|{request.endpoint}|{view_args!r}|{params!r}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+
+def version_etag(view):
+    """
+    Decorador que agrega ETag y Last-Modified a una respuesta de la API.
+
+    Si la petición trae If-None-Match (o If-Modified-Since) y el contenido de
+    la versión no cambió, responde 304 sin ejecutar la vista. Las consultas
+    por fecha (as_of) se leen del índice temporal de vigencias, que no
+    depende de la versión seleccionada, y se responden sin validadores.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.args.get('as_of'):
+            return view(*args, **kwargs)
+
+        validators = get_validators()
+        if validators is None:
+            return view(*args, **kwargs)
+
+        etag = compute_etag(validators.content_hash)
+        not_modified = False
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        elif request.if_modified_since:
+            not_modified = validators.last_modified <= request.if_modified_since
+
+        if not_modified:
+            response = make_response('', 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag)
+        response.last_modified = validators.last_modified
+        # La versión puede venir de la sesión
+        response.vary.add('Cookie')
+        return response
+
+    return wrapper
@@ -0,0 +1,192 @@
+"""
+Métricas de latencia por ruta y de tiempo en SQLite por solicitud.
+
+Cada solicitud registra su duración en un histograma por ruta, método y
+código de estado. Las consultas que pasan por el pool de conexiones SQLite se
+cronometran (ejecución y lectura de filas) y se acumulan por solicitud:
+cantidad, tiempo total y consulta más lenta. Los totales se exponen en
+formato de texto de Prometheus en ``/metrics`` y el tiempo en base de datos
+de cada respuesta se informa en la cabecera ``Server-Timing``; ambos solo
+para administradores (la cabecera puede habilitarse para todos con
+METRICS_SERVER_TIMING).
+"""
+import bisect
+import logging
+import threading
+import time
+
+from flask import g, has_request_context, request
+from flask_login import current_user
+
+# Límites superiores (en segundos) de los intervalos de los histogramas
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Ruta de las solicitudes que no coinciden con ninguna regla
+UNMATCHED_ROUTE = 'sin_ruta'
+
+
+class Histogram:
+    """Histograma acumulado al estilo de Prometheus (no es seguro entre hilos)."""
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name, labels):
+        """Líneas de texto de Prometheus del histograma."""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.total:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class QueryStats:
+    """Consultas SQLite de una solicitud."""
+
+    __slots__ = ('count', 'total', 'slowest', 'slowest_sql')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_sql = None
+
+    def add(self, sql, elapsed, statement_elapsed, new_query):
+        """
+        Suma el tiempo de una ejecución o lectura de filas.
+
+        Args:
+            sql (str): Sentencia a la que corresponde el tiempo
+            elapsed (float): Segundos de esta operación
+            statement_elapsed (float): Segundos acumulados por la sentencia
+            new_query (bool): True si la operación ejecutó una sentencia nueva
+        """
+        if new_query:
+            self.count += 1
+        self.total += elapsed
+        if statement_elapsed > self.slowest:
+            self.slowest = statement_elapsed
+            self.slowest_sql = sql
+
+
+def current_query_stats():
+    """Acumulador de consultas de la solicitud actual (o None fuera de una solicitud)."""
+    if not has_request_context():
+        return None
+    return g.get('_query_stats')
+
+
+class MetricsRegistry:
+    """Métricas acumuladas del proceso."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._db_time = {}
+        self._db_slowest = {}
+        self._db_queries = {}
+
+    def observe_request(self, route, method, status, elapsed, stats):
+        with self._lock:
+            key = (route, method, str(status))
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = Histogram()
+            histogram.observe(elapsed)
+            if stats is None or not stats.count:
+                return
+            for series, value in ((self._db_time, stats.total), (self._db_slowest, stats.slowest)):
+                histogram = series.get(route)
+                if histogram is None:
+                    histogram = series[route] = Histogram()
+                histogram.observe(value)
+            self._db_queries[route] = self._db_queries.get(route, 0) + stats.count
+
+    def render(self):
+        """Métricas en formato de texto de Prometheus (versión 0.0.4)."""
+        with self._lock:
+            lines = [
+                '# HELP aduana_request_duration_seconds Duración de las solicitudes por ruta.',
+                '# TYPE aduana_request_duration_seconds histogram',
+            ]
+            for (route, method, status), histogram in sorted(self._latency.items()):
+                labels = f'route="{_escape(route)}",method="{method}",status="{status}"'
+                lines.extend(histogram.render('aduana_request_duration_seconds', labels))
+
+            lines += [
+                '# HELP aduana_db_queries_total Consultas SQLite ejecutadas por ruta.',
+                '# TYPE aduana_db_queries_total counter',
+            ]
+            for route, count in sorted(self._db_queries.items()):
+                lines.append(f'aduana_db_queries_total{{route="{_escape(route)}"}} {count}')
+
+            for name, series, help_text in (
+                ('aduana_db_time_seconds', self._db_time,
+                 'Tiempo total en SQLite por solicitud.'),
+                ('aduana_db_slowest_query_seconds', self._db_slowest,
+                 'Consulta SQLite más lenta de cada solicitud.'),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for route, histogram in sorted(series.items()):
+                    lines.extend(histogram.render(name, f'route="{_escape(route)}"'))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Métricas compartidas por toda la aplicación
+registry = MetricsRegistry()
+
+
+def init_app(app):
+    """Cronometra cada solicitud y el tiempo que pasa en SQLite."""
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    slow_threshold = app.config.get('SLOW_QUERY_THRESHOLD', 0.5)
+    server_timing_for_all = app.config.get('METRICS_SERVER_TIMING', False)
+
+    @app.before_request
+    def start_request_timer():
+        g._request_started = time.perf_counter()
+        g._query_stats = QueryStats()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get('_request_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        stats = g.get('_query_stats')
+        route = request.url_rule.rule if request.url_rule is not None else UNMATCHED_ROUTE
+        try:
+            registry.observe_request(route, request.method, response.status_code, elapsed, stats)
+        except Exception as e:
+            logging.error(f"Error al registrar las métricas de {route}: {str(e)}")
+
+        if stats is not None:
+            if server_timing_for_all or (current_user.is_authenticated and current_user.role == 'admin'):
+                response.headers['Server-Timing'] = (
+                    f'db;dur={stats.total * 1000:.1f};desc="{stats.count} consultas", '
+                    f'total;dur={elapsed * 1000:.1f}'
+                )
+            if stats.slowest >= slow_threshold:
+                logging.warning(
+                    f"Consulta lenta en {request.method} {route}: {stats.slowest * 1000:.0f} ms "
+                    f"({stats.count} consultas, {stats.total * 1000:.0f} ms en total): {stats.slowest_sql}"
+                )
+        return response
@@ -1,11 +1,19 @@
-from flask import current_app, session, g
-from sqlalchemy import Column, String, Float
+from sqlalchemy import Column, String, Float, func
 from .. import db
+from ..db_pool import get_connection
+from ..version_catalog import resolve_arancel_db_path
+from ..tariff_snapshot import get_snapshot
+from ..db_schema import (
+    FTS_TABLE, canonical_ncm, fts_match_query, ncm_key_range, parse_chapter_no, parse_section_no
+)
 import sqlite3
-import os
-from pathlib import Path
 import logging
 
+# Decimales con los que se compara la relevancia BM25: el orden y el cursor de
+# paginación usan el mismo valor redondeado, así los empates se resuelven
+# siempre por ncm_key
+SCORE_DECIMALS = 6
+
 class Arancel(db.Model):
     """Modelo para representar los items del Arancel Nacional."""
     
@@ -24,234 +32,184 @@ class Arancel(db.Model):
     
     def __repr__(self):
         return f"<Arancel NCM: {self.NCM}, Descripción: {self.DESCRIPCION[:30]}...>"
-        
+    
     @classmethod
-    def _get_arancel_db_path(cls):
-        """Obtiene la ruta a la base de datos de aranceles según la versión seleccionada."""
-        try:
-            # Intentar obtener la ruta desde la configuración
-            from flask import current_app, session, g
-            
-            # Verificar si hay una versión específica seleccionada
-            version = None
-            if hasattr(g, 'version') and g.version:
-                version = g.version
-            elif 'arancel_version' in session:
-                version = session.get('arancel_version')
-            
-            # Si tenemos una versión, usar la base de datos específica
-            if version:
-                base_dir = Path(__file__).resolve().parent.parent.parent.parent
-                version_db_path = str(base_dir / 'data' / 'db_versions' / f'arancel_{version}.sqlite3')
-                if os.path.exists(version_db_path):
-                    return version_db_path
-                else:
-                    # Si no existe la versión específica, log de advertencia
-                    if hasattr(current_app, 'logger'):
-                        current_app.logger.warning(f"Base de datos para versión {version} no encontrada: {version_db_path}")
-            
-            # Si hay una configuración específica, usarla
-            if hasattr(current_app, 'config') and 'ARANCEL_DATABASE_URI' in current_app.config:
-                db_path = current_app.config['ARANCEL_DATABASE_URI'].replace('sqlite:///', '')
-                if os.path.exists(db_path):
-                    return db_path
-        except Exception as e:
-            # Log del error
-            logging.error(f"Error al obtener la ruta de la base de datos: {str(e)}")
-        
-        # Si falla todo lo anterior, usar la base de datos predeterminada (symlink a la última versión)
-        base_dir = Path(__file__).resolve().parent.parent.parent.parent
-        latest_symlink = str(base_dir / 'data' / 'db_versions' / 'arancel_latest.sqlite3')
-        if os.path.exists(latest_symlink):
-            return latest_symlink
-        
-        # Como última opción, usar la ruta clásica
-        return str(base_dir / 'data' / 'database.sqlite3')
+    def _from_row(cls, row):
+        """Crea una instancia del modelo a partir de una fila de sqlite3."""
+        arancel = cls()
+        for key in row.keys():
+            if key == 'E/Z':  # Manejar columnas con nombres especiales
+                setattr(arancel, 'E_Z', row[key])
+            elif key == 'I/Z':
+                setattr(arancel, 'I_Z', row[key])
+            else:
+                setattr(arancel, key, row[key])
+        return arancel
     
+    def to_dict(self):
+        """Convierte el arancel en un diccionario con los nombres de columna originales."""
+        return {
+            'NCM': self.NCM,
+            'DESCRIPCION': self.DESCRIPCION,
+            'AEC': self.AEC,
+            'CL': self.CL,
+            'E/Z': self.E_Z,
+            'I/Z': self.I_Z,
+            'UVF': self.UVF,
+            'SECTION': self.SECTION,
+            'CHAPTER': self.CHAPTER
+        }
+        
     @classmethod
     def buscar_por_ncm(cls, ncm, session=None):
-        """Busca aranceles por código NCM."""
-        # Intentar primero con SQLAlchemy (para compatibilidad)
-        if session:
-            try:
-                return session.query(cls).filter(cls.NCM == ncm).first()
-            except:
-                pass
+        """Busca aranceles por código NCM (con o sin puntos)."""
+        # Resolver desde la instantánea en memoria de la versión seleccionada
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            record = snapshot.get(ncm)
+            return cls._from_row(record) if record else None
         
-        # Si falla, usar SQLite directamente
+        # Si no hay instantánea, usar SQLite directamente
+        ncm_key = canonical_ncm(ncm)
         try:
-            db_path = cls._get_arancel_db_path()
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
+            conn = get_connection(resolve_arancel_db_path())
             cursor = conn.cursor()
             
-            cursor.execute("SELECT * FROM arancel_nacional WHERE NCM = ?", (ncm,))
+            try:
+                cursor.execute("SELECT * FROM arancel_nacional WHERE ncm_key = ?", (ncm_key,))
+            except sqlite3.OperationalError:
+                # Versión sin columna ncm_key
+                cursor.execute("SELECT * FROM arancel_nacional WHERE REPLACE(NCM, '.', '') = ?", (ncm_key,))
             row = cursor.fetchone()
             
             if row:
                 # Crear una instancia del modelo con los datos
-                arancel = cls()
-                for key in row.keys():
-                    if key != 'E/Z' and key != 'I/Z':  # Manejar columnas con nombres especiales
-                        setattr(arancel, key, row[key])
-                    elif key == 'E/Z':
-                        setattr(arancel, 'E_Z', row[key])
-                    elif key == 'I/Z':
-                        setattr(arancel, 'I_Z', row[key])
-                
-                conn.close()
-                return arancel
-            
-            conn.close()
+                return cls._from_row(row)
+            return None
         except Exception as e:
             print(f"Error al buscar NCM: {e}")
         
+        # Si falla, intentar con SQLAlchemy (para compatibilidad)
+        if session:
+            try:
+                return session.query(cls).filter(cls.NCM == ncm).first()
+            except:
+                pass
+        
         return None
     
     @classmethod
     def buscar_por_ncm_parcial(cls, ncm_parcial, limit=50, session=None):
-        """Busca aranceles que comiencen con un código NCM parcial."""
-        # Si no hay entrada, retornar lista vacía
-        if not ncm_parcial or len(ncm_parcial) < 2:
-            return []
-            
-        # Preparar variantes del código para buscar con y sin puntos
-        formato_sin_puntos = ncm_parcial.replace('.', '')
+        """
+        Busca aranceles que comiencen con un código NCM parcial.
         
-        # Preparar formato con puntos si no los tiene
-        if '.' not in ncm_parcial:
-            # Convertir código sin puntos a formato con puntos (de acuerdo a la regla 2-2-2-2)
-            # Ejemplo: 20041000 -> 2004.10.00.00, 1905 -> 1905, 200410 -> 2004.10
-            formato_con_puntos = ''
-            for i, char in enumerate(ncm_parcial):
-                if i > 0 and i % 2 == 0 and i < len(ncm_parcial) and i <= 6:
-                    formato_con_puntos += '.' + char
-                else:
-                    formato_con_puntos += char
-        else:
-            formato_con_puntos = ncm_parcial
-            
-        # Intentar primero con SQLAlchemy (para compatibilidad)
-        resultados = []
-        if session:
-            try:
-                # Buscar ambos formatos: con puntos y sin puntos
-                resultados_sin_puntos = session.query(cls).filter(cls.NCM.like(f'{formato_sin_puntos}%')).limit(limit).all()
-                resultados_con_puntos = session.query(cls).filter(cls.NCM.like(f'{formato_con_puntos}%')).limit(limit).all()
-                
-                # Combinar resultados (puede haber duplicados en diferente formato)
-                resultados = resultados_sin_puntos + [r for r in resultados_con_puntos if r.NCM not in [x.NCM for x in resultados_sin_puntos]]
-                
-                if resultados:
-                    return resultados[:limit]
-            except Exception as e:
-                logging.error(f"Error en búsqueda SQLAlchemy: {e}")
+        El código se normaliza a solo dígitos, por lo que '2004.10' y '200410'
+        son equivalentes, y la búsqueda es un único recorrido por rango sobre
+        el índice de ncm_key.
+        """
+        ncm_key = canonical_ncm(ncm_parcial)
+        
+        # Si no hay entrada suficiente, retornar lista vacía
+        if len(ncm_key) < 2:
+            return []
         
-        # Si falla o no hay resultados, usar SQLite directamente
         try:
-            db_path = cls._get_arancel_db_path()
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
+            conn = get_connection(resolve_arancel_db_path())
             cursor = conn.cursor()
             
-            # Buscar primero formato sin puntos
-            cursor.execute("SELECT * FROM arancel_nacional WHERE NCM LIKE ? LIMIT ?", 
-                          (f"{formato_sin_puntos}%", limit))
-            rows_sin_puntos = cursor.fetchall()
-            
-            # Buscar formato con puntos
-            cursor.execute("SELECT * FROM arancel_nacional WHERE NCM LIKE ? LIMIT ?", 
-                          (f"{formato_con_puntos}%", limit))
-            rows_con_puntos = cursor.fetchall()
-            
-            # Usar conjunto para evitar duplicados por NCM
-            ncm_procesados = set()
-            result = []
-            
-            # Procesar resultados sin puntos
-            for row in rows_sin_puntos:
-                arancel = cls()
-                ncm = row['NCM'] if 'NCM' in row.keys() else None
-                
-                if not ncm or ncm in ncm_procesados:
-                    continue
-                    
-                ncm_procesados.add(ncm)
-                
-                for key in row.keys():
-                    if key != 'E/Z' and key != 'I/Z':  # Manejar columnas con nombres especiales
-                        setattr(arancel, key, row[key])
-                    elif key == 'E/Z':
-                        setattr(arancel, 'E_Z', row[key])
-                    elif key == 'I/Z':
-                        setattr(arancel, 'I_Z', row[key])
-                result.append(arancel)
-            
-            # Procesar resultados con puntos
-            for row in rows_con_puntos:
-                arancel = cls()
-                ncm = row['NCM'] if 'NCM' in row.keys() else None
-                
-                if not ncm or ncm in ncm_procesados:
-                    continue
-                    
-                ncm_procesados.add(ncm)
-                
-                for key in row.keys():
-                    if key != 'E/Z' and key != 'I/Z':  # Manejar columnas con nombres especiales
-                        setattr(arancel, key, row[key])
-                    elif key == 'E/Z':
-                        setattr(arancel, 'E_Z', row[key])
-                    elif key == 'I/Z':
-                        setattr(arancel, 'I_Z', row[key])
-                result.append(arancel)
+            try:
+                inicio, fin = ncm_key_range(ncm_key)
+                cursor.execute(
+                    "SELECT * FROM arancel_nacional WHERE ncm_key >= ? AND ncm_key < ? ORDER BY ncm_key LIMIT ?",
+                    (inicio, fin, limit)
+                )
+            except sqlite3.OperationalError:
+                # Versión sin columna ncm_key
+                cursor.execute(
+                    "SELECT * FROM arancel_nacional WHERE REPLACE(NCM, '.', '') LIKE ? ORDER BY NCM LIMIT ?",
+                    (f"{ncm_key}%", limit)
+                )
             
-            conn.close()
-            return result[:limit]  # Limitar los resultados al máximo solicitado
+            return [cls._from_row(row) for row in cursor.fetchall()]
         except Exception as e:
             logging.error(f"Error al buscar NCM parcial: {e}")
-            print(f"Error al buscar NCM parcial: {e}")
+            
+            # Si falla, intentar con SQLAlchemy
+            if session:
+                try:
+                    return session.query(cls).filter(
+                        func.replace(cls.NCM, '.', '').like(f'{ncm_key}%')
+                    ).limit(limit).all()
+                except Exception as e:
+                    logging.error(f"Error en búsqueda SQLAlchemy: {e}")
         
-        return resultados
+        return []
     
     @classmethod
-    def buscar_por_descripcion(cls, texto, limit=50, session=None):
-        """Busca aranceles que contengan texto en su descripción."""
-        # Usar SQLite directamente (más eficiente para búsquedas de texto)
+    def buscar_por_descripcion(cls, texto, limit=50, session=None, offset=0, after=None):
+        """
+        Busca aranceles cuya descripción contenga las palabras del texto.
+        
+        Usa el índice FTS5 de la versión (sin distinguir acentos) y ordena los
+        resultados por relevancia BM25. Si la versión no tiene índice, recurre
+        a la búsqueda con LIKE.
+        
+        Args:
+            texto (str): Texto a buscar
+            limit (int): Máximo de resultados
+            session (Session): Sesión de SQLAlchemy a utilizar (opcional)
+            offset (int): Cantidad de resultados a saltar (paginación)
+            after (tuple): (score, ncm_key) del último resultado de la página
+                anterior, para paginar por clave en lugar de por offset
+            
+        Returns:
+            list: Lista de instancias de Arancel (con el atributo ``score``
+            cuando se usa el índice de texto completo)
+        """
+        match = fts_match_query(texto)
+        if not match:
+            return []
+        
         try:
-            db_path = cls._get_arancel_db_path()
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
+            conn = get_connection(resolve_arancel_db_path())
             cursor = conn.cursor()
             
-            # Dividir la búsqueda en palabras y buscar todas
-            palabras = texto.split()
-            query = "SELECT * FROM arancel_nacional WHERE 1=1"
-            params = []
-            
-            for palabra in palabras:
-                query += " AND DESCRIPCION LIKE ?"
-                params.append(f"%{palabra}%")
-            
-            query += f" LIMIT {limit}"
-            
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
-            
-            result = []
-            for row in rows:
-                arancel = cls()
-                for key in row.keys():
-                    if key != 'E/Z' and key != 'I/Z':  # Manejar columnas con nombres especiales
-                        setattr(arancel, key, row[key])
-                    elif key == 'E/Z':
-                        setattr(arancel, 'E_Z', row[key])
-                    elif key == 'I/Z':
-                        setattr(arancel, 'I_Z', row[key])
-                result.append(arancel)
+            try:
+                score = f"round(bm25({FTS_TABLE}), {SCORE_DECIMALS})"
+                keyset = ""
+                params = [match]
+                if after:
+                    # Resultados posteriores en el orden (relevancia, ncm_key)
+                    after_score = round(after[0], SCORE_DECIMALS)
+                    keyset = f"AND ({score} > ? OR ({score} = ? AND a.ncm_key > ?))"
+                    params.extend([after_score, after_score, after[1]])
+                params.extend([limit, offset])
+                cursor.execute(f"""
+                    SELECT a.*, {score} AS score FROM {FTS_TABLE}
+                    JOIN arancel_nacional a ON a.NCM = {FTS_TABLE}.ncm
+                    WHERE {FTS_TABLE} MATCH ? {keyset}
+                    ORDER BY score, a.ncm_key
+                    LIMIT ? OFFSET ?
+                """, params)
+            except sqlite3.OperationalError as e:
+                # Versión sin índice de texto completo: búsqueda por palabras con LIKE
+                logging.warning(f"Búsqueda FTS no disponible, usando LIKE: {e}")
+                palabras = texto.split()
+                query = "SELECT * FROM arancel_nacional WHERE 1=1"
+                params = []
+                
+                for palabra in palabras:
+                    query += " AND DESCRIPCION LIKE ?"
+                    params.append(f"%{palabra}%")
+                
+                if after:
+                    query += " AND REPLACE(NCM, '.', '') > ?"
+                    params.append(after[1])
+                query += " ORDER BY REPLACE(NCM, '.', '') LIMIT ? OFFSET ?"
+                params.extend([limit, offset])
+                cursor.execute(query, params)
             
-            conn.close()
-            return result
+            return [cls._from_row(row) for row in cursor.fetchall()]
         except Exception as e:
             print(f"Error al buscar por descripción: {e}")
             
@@ -261,99 +219,120 @@ class Arancel(db.Model):
                     query = session.query(cls)
                     for palabra in texto.split():
                         query = query.filter(cls.DESCRIPCION.like(f'%{palabra}%'))
-                    return query.limit(limit).all()
+                    return query.offset(offset).limit(limit).all()
                 except:
                     pass
         
         return []
     
     @classmethod
-    def listar_por_seccion(cls, seccion, limit=500, session=None):
-        """Lista aranceles por sección."""
+    def listar(cls, limit=50, after=None):
+        """
+        Lista todos los aranceles de la versión en orden de NCM.
+        
+        Args:
+            limit (int): Máximo de resultados
+            after (str): ncm_key del último resultado de la página anterior
+        """
         try:
-            db_path = cls._get_arancel_db_path()
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
+            conn = get_connection(resolve_arancel_db_path())
             cursor = conn.cursor()
             
-            # Asegurar que la sección tenga dos dígitos
-            seccion_formateada = seccion.zfill(2)
-            cursor.execute(
-                "SELECT * FROM arancel_nacional WHERE SECTION LIKE ? LIMIT ?", 
-                (f"%{seccion_formateada} - %", limit)
-            )
-            rows = cursor.fetchall()
-            
-            result = []
-            for row in rows:
-                arancel = cls()
-                for key in row.keys():
-                    if key != 'E/Z' and key != 'I/Z':  # Manejar columnas con nombres especiales
-                        setattr(arancel, key, row[key])
-                    elif key == 'E/Z':
-                        setattr(arancel, 'E_Z', row[key])
-                    elif key == 'I/Z':
-                        setattr(arancel, 'I_Z', row[key])
-                result.append(arancel)
+            try:
+                cursor.execute(
+                    "SELECT * FROM arancel_nacional WHERE ncm_key > ? ORDER BY ncm_key LIMIT ?",
+                    (after or '', limit)
+                )
+            except sqlite3.OperationalError:
+                # Versión sin columna ncm_key
+                cursor.execute(
+                    "SELECT * FROM arancel_nacional WHERE REPLACE(NCM, '.', '') > ? "
+                    "ORDER BY REPLACE(NCM, '.', '') LIMIT ?",
+                    (after or '', limit)
+                )
+            return [cls._from_row(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"Error al listar aranceles: {e}")
+        
+        return []
+    
+    @classmethod
+    def listar_por_seccion(cls, seccion, limit=500, session=None, after=None):
+        """
+        Lista aranceles por sección, en orden de NCM.
+        
+        Args:
+            seccion (str): Número de sección ('2'), número romano ('II') o el
+                texto completo de la sección ('II - Productos del reino vegetal')
+            after (str): ncm_key del último resultado de la página anterior
+        """
+        section_no = parse_section_no(seccion)
+        if section_no is None:
+            return []
+        
+        try:
+            conn = get_connection(resolve_arancel_db_path())
+            cursor = conn.cursor()
             
-            conn.close()
-            return result
+            try:
+                cursor.execute(
+                    "SELECT * FROM arancel_nacional WHERE section_no = ? AND ncm_key > ? ORDER BY ncm_key LIMIT ?",
+                    (section_no, after or '', limit)
+                )
+                return [cls._from_row(row) for row in cursor.fetchall()]
+            except sqlite3.OperationalError:
+                # Versión sin columna section_no: filtrar por el texto de la sección
+                cursor.execute("SELECT * FROM arancel_nacional ORDER BY NCM")
+                resultados = [
+                    row for row in cursor.fetchall()
+                    if parse_section_no(row['SECTION']) == section_no and canonical_ncm(row['NCM']) > (after or '')
+                ]
+                return [cls._from_row(row) for row in resultados[:limit]]
         except Exception as e:
             print(f"Error al listar por sección: {e}")
-            
-            # Si falla, intentar con SQLAlchemy
-            if session:
-                try:
-                    seccion_formateada = seccion.zfill(2)
-                    return session.query(cls).filter(
-                        cls.SECTION.like(f'%{seccion_formateada} - %')
-                    ).limit(limit).all()
-                except:
-                    pass
         
         return []
     
     @classmethod
-    def listar_por_capitulo(cls, capitulo, limit=500, session=None):
-        """Lista aranceles por capítulo."""
+    def listar_por_capitulo(cls, capitulo, limit=500, session=None, after=None):
+        """
+        Lista aranceles por capítulo, en orden de NCM.
+        
+        Args:
+            capitulo (str): Número de capítulo ('9', '09') o el texto completo
+                del capítulo ('09 - Café, té, yerba mate y especias')
+            after (str): ncm_key del último resultado de la página anterior
+        """
+        chapter_no = parse_chapter_no(capitulo)
+        if chapter_no is None:
+            return []
+        
         try:
-            db_path = cls._get_arancel_db_path()
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
+            conn = get_connection(resolve_arancel_db_path())
             cursor = conn.cursor()
             
-            # Asegurar que el capítulo tenga dos dígitos
-            capitulo_formateado = capitulo.zfill(2)
-            cursor.execute(
-                "SELECT * FROM arancel_nacional WHERE CHAPTER LIKE ? LIMIT ?", 
-                (f"%{capitulo_formateado} - %", limit)
-            )
-            rows = cursor.fetchall()
-            
-            result = []
-            for row in rows:
-                arancel = cls()
-                for key in row.keys():
-                    if key != 'E/Z' and key != 'I/Z':  # Manejar columnas con nombres especiales
-                        setattr(arancel, key, row[key])
-                    elif key == 'E/Z':
-                        setattr(arancel, 'E_Z', row[key])
-                    elif key == 'I/Z':
-                        setattr(arancel, 'I_Z', row[key])
-                result.append(arancel)
-            
-            conn.close()
-            return result
+            try:
+                cursor.execute(
+                    "SELECT * FROM arancel_nacional WHERE chapter_no = ? AND ncm_key > ? ORDER BY ncm_key LIMIT ?",
+                    (chapter_no, after or '', limit)
+                )
+            except sqlite3.OperationalError:
+                # Versión sin columna chapter_no: el capítulo son los dos primeros dígitos del NCM
+                cursor.execute(
+                    "SELECT * FROM arancel_nacional WHERE NCM LIKE ? AND REPLACE(NCM, '.', '') > ? "
+                    "ORDER BY REPLACE(NCM, '.', '') LIMIT ?",
+                    (f"{chapter_no:02d}%", after or '', limit)
+                )
+            return [cls._from_row(row) for row in cursor.fetchall()]
         except Exception as e:
             print(f"Error al listar por capítulo: {e}")
             
             # Si falla, intentar con SQLAlchemy
             if session:
                 try:
-                    capitulo_formateado = capitulo.zfill(2)
                     return session.query(cls).filter(
-                        cls.CHAPTER.like(f'%{capitulo_formateado} - %')
-                    ).limit(limit).all()
+                        cls.NCM.like(f'{chapter_no:02d}%')
+                    ).order_by(cls.NCM).limit(limit).all()
                 except:
                     pass
         
@@ -1,8 +1,7 @@
 from sqlalchemy import Column, Integer, String, Text
 from .. import db
-import os
-import sqlite3
-from pathlib import Path
+from ..note_cache import get_version_notes
+from ..db_schema import canonical_ncm
 
 class ChapterNote(db.Model):
     """Modelo para las notas de capítulo del Arancel Nacional."""
@@ -13,51 +12,6 @@ class ChapterNote(db.Model):
     chapter_number = db.Column(db.String(2), nullable=False, unique=True, index=True)
     note_text = db.Column(db.Text, nullable=False)
     
-    @classmethod
-    def _get_arancel_db_path(cls):
-        """Obtiene la ruta a la base de datos de aranceles según la versión seleccionada."""
-        try:
-            # Intentar obtener la ruta desde la configuración
-            from flask import current_app, session, g
-            import logging
-            
-            # Verificar si hay una versión específica seleccionada
-            version = None
-            if hasattr(g, 'version') and g.version:
-                version = g.version
-            elif 'arancel_version' in session:
-                version = session.get('arancel_version')
-            
-            # Si tenemos una versión, usar la base de datos específica
-            if version:
-                base_dir = Path(__file__).resolve().parent.parent.parent.parent
-                version_db_path = str(base_dir / 'data' / 'db_versions' / f'arancel_{version}.sqlite3')
-                if os.path.exists(version_db_path):
-                    return version_db_path
-                else:
-                    # Si no existe la versión específica, log de advertencia
-                    if hasattr(current_app, 'logger'):
-                        current_app.logger.warning(f"Base de datos para versión {version} no encontrada: {version_db_path}")
-            
-            # Si hay una configuración específica, usarla
-            if hasattr(current_app, 'config') and 'ARANCEL_DATABASE_URI' in current_app.config:
-                db_path = current_app.config['ARANCEL_DATABASE_URI'].replace('sqlite:///', '')
-                if os.path.exists(db_path):
-                    return db_path
-        except Exception as e:
-            # Log del error
-            import logging
-            logging.error(f"Error al obtener la ruta de la base de datos: {str(e)}")
-        
-        # Si falla todo lo anterior, usar la base de datos predeterminada (symlink a la última versión)
-        base_dir = Path(__file__).resolve().parent.parent.parent.parent
-        latest_symlink = str(base_dir / 'data' / 'db_versions' / 'arancel_latest.sqlite3')
-        if os.path.exists(latest_symlink):
-            return latest_symlink
-        
-        # Como última opción, usar la ruta clásica
-        return str(base_dir / 'data' / 'database.sqlite3')
-    
     @classmethod
     def get_note_by_chapter(cls, chapter_number, session=None):
         """
@@ -80,28 +34,10 @@ class ChapterNote(db.Model):
                 import logging
                 logging.error(f"Error en ChapterNote.get_note_by_chapter con SQLAlchemy: {e}")
         
-        # Si falla o no hay resultados, usar SQLite directamente
-        try:
-            db_path = cls._get_arancel_db_path()
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            # Verificar si la tabla existe
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='chapter_notes'")
-            if not cursor.fetchone():
-                conn.close()
-                return None
-                
-            cursor.execute("SELECT note_text FROM chapter_notes WHERE chapter_number = ?", (chapter_number,))
-            row = cursor.fetchone()
-            conn.close()
-            
-            if row:
-                return row['note_text']
-        except Exception as e:
-            import logging
-            logging.error(f"Error en ChapterNote.get_note_by_chapter con SQLite: {e}")
+        # Si falla o no hay resultados, usar las notas de la versión en memoria
+        notes = get_version_notes()
+        if notes is not None:
+            return notes.chapter_note(chapter_number)
             
         return None
     
@@ -121,9 +57,8 @@ class ChapterNote(db.Model):
         if not ncm or len(ncm) < 2:
             return None
             
-        # Eliminar puntos del NCM si los tiene
-        ncm_clean = ncm.replace('.', '')
-        chapter_number = ncm_clean[:2]
+        # Los dos primeros dígitos del NCM normalizado
+        chapter_number = canonical_ncm(ncm)[:2]
         return cls.get_note_by_chapter(chapter_number, session=session)
         
     @classmethod
@@ -147,26 +82,9 @@ class ChapterNote(db.Model):
                 import logging
                 logging.error(f"Error en ChapterNote.get_all_notes con SQLAlchemy: {e}")
         
-        # Si falla o no hay resultados, usar SQLite directamente
-        try:
-            db_path = cls._get_arancel_db_path()
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            # Verificar si la tabla existe
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='chapter_notes'")
-            if not cursor.fetchone():
-                conn.close()
-                return {}
-                
-            cursor.execute("SELECT chapter_number, note_text FROM chapter_notes")
-            rows = cursor.fetchall()
-            conn.close()
-            
-            return {row['chapter_number']: row['note_text'] for row in rows}
-        except Exception as e:
-            import logging
-            logging.error(f"Error en ChapterNote.get_all_notes con SQLite: {e}")
+        # Si falla o no hay resultados, usar las notas de la versión en memoria
+        notes = get_version_notes()
+        if notes is not None:
+            return dict(notes.chapter_notes)
             
         return {}
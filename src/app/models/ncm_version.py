@@ -4,9 +4,23 @@
 Modelo para gestionar las versiones de los NCM a lo largo del tiempo.
 Permite almacenar y comparar cambios entre diferentes versiones del Arancel.
 """
+import logging
 from datetime import datetime
+from sqlalchemy import bindparam, inspect, text
 from .. import db
 
+# Índice único sobre el que se combinan las cargas masivas
+UNIQUE_KEY_INDEX = 'uq_ncm_versions_ncm_code_version_date'
+
+# Columnas que llegan en cada registro cargado desde un Excel
+UPSERT_COLUMNS = ('ncm_code', 'version_date', 'source_file', 'description', 'aec', 'ez', 'iz', 'uvf', 'cl')
+
+# Columnas opcionales: si el Excel no trae valor se conserva el guardado
+OPTIONAL_COLUMNS = ('aec', 'ez', 'iz', 'uvf', 'cl')
+
+# Tabla temporal donde se preparan los registros de cada lote
+STAGE_TABLE = 'ncm_versions_stage'
+
 class NCMVersion(db.Model):
     """
     Modelo que almacena información sobre las diferentes versiones de un NCM.
@@ -14,7 +28,10 @@ class NCMVersion(db.Model):
     del NCM en ese momento específico.
     """
     __tablename__ = 'ncm_versions'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        db.Index(UNIQUE_KEY_INDEX, 'ncm_code', 'version_date', unique=True),
+        {'extend_existing': True}
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     ncm_code = db.Column(db.String(12), index=True, nullable=False)
@@ -99,3 +116,140 @@ class NCMVersion(db.Model):
         session = session or db.session
         latest = session.query(db.func.max(cls.version_date)).scalar()
         return latest
+    
+    @classmethod
+    def ensure_unique_key(cls, session=None):
+        """
+        Crea una sola vez el índice único (ncm_code, version_date) en tablas creadas sin él.
+        
+        Si el índice ya existe no se hace nada. Si la tabla tiene registros
+        repetidos no se borra ninguno: se rechaza la migración informando los
+        pares repetidos, que deben resolverse a mano antes de volver a cargar.
+        
+        Args:
+            session: Sesión de base de datos opcional
+            
+        Returns:
+            True si se creó el índice, False si ya existía
+            
+        Raises:
+            ValueError: Si hay pares (ncm_code, version_date) repetidos
+        """
+        session = session or db.session
+        indexes = inspect(session.get_bind()).get_indexes(cls.__tablename__)
+        if any(index['name'] == UNIQUE_KEY_INDEX for index in indexes):
+            return False
+        
+        duplicates = session.execute(text('''
+            SELECT ncm_code, version_date, COUNT(*) FROM ncm_versions
+            GROUP BY ncm_code, version_date HAVING COUNT(*) > 1
+            ORDER BY ncm_code, version_date
+        ''')).fetchall()
+        if duplicates:
+            examples = ', '.join(f"{ncm_code} ({version_date}, {count} registros)"
+                                 for ncm_code, version_date, count in duplicates[:5])
+            raise ValueError(
+                f"No se puede crear {UNIQUE_KEY_INDEX}: ncm_versions tiene {len(duplicates)} "
+                f"pares (ncm_code, version_date) repetidos, por ejemplo {examples}"
+            )
+        
+        session.execute(text(
+            f"CREATE UNIQUE INDEX {UNIQUE_KEY_INDEX} ON ncm_versions (ncm_code, version_date)"
+        ))
+        session.commit()
+        logging.info(f"Índice único {UNIQUE_KEY_INDEX} creado en ncm_versions")
+        return True
+    
+    @classmethod
+    def bulk_upsert(cls, records, session=None, batch_size=5000):
+        """
+        Inserta o actualiza muchas versiones con operaciones por conjuntos.
+        
+        Cada lote se copia a una tabla temporal y se combina con un único
+        INSERT ... ON CONFLICT (ncm_code, version_date) DO UPDATE, en lugar de
+        consultar cada registro antes de agregarlo. Igual que la carga fila por
+        fila, los campos opcionales sin valor no pisan el valor guardado.
+        
+        Args:
+            records: Lista de diccionarios con las columnas de UPSERT_COLUMNS
+            session: Sesión de base de datos opcional
+            batch_size: Registros por lote
+            
+        Returns:
+            Diccionario con la cantidad de registros insertados, actualizados y sin cambios
+        """
+        session = session or db.session
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        
+        # Ante registros repetidos en la carga gana el último
+        unique = {}
+        for record in records:
+            unique[(record['ncm_code'], record['version_date'])] = record
+        rows = [{column: record.get(column) for column in UPSERT_COLUMNS} for record in unique.values()]
+        if not rows:
+            return counts
+        
+        same = 'IS' if session.get_bind().dialect.name == 'sqlite' else 'IS NOT DISTINCT FROM'
+        unchanged = ' AND '.join(
+            [f"s.{column} {same} v.{column}" for column in ('source_file', 'description')]
+            + [f"(s.{column} IS NULL OR s.{column} {same} v.{column})" for column in OPTIONAL_COLUMNS]
+        )
+        assignments = ', '.join(
+            [f"{column} = excluded.{column}" for column in ('source_file', 'description')]
+            + [f"{column} = COALESCE(excluded.{column}, ncm_versions.{column})" for column in OPTIONAL_COLUMNS]
+        )
+        changed = ' OR '.join(
+            [f"NOT (excluded.{column} {same} ncm_versions.{column})" for column in ('source_file', 'description')]
+            + [f"(excluded.{column} IS NOT NULL AND NOT (excluded.{column} {same} ncm_versions.{column}))"
+               for column in OPTIONAL_COLUMNS]
+        )
+        columns = ', '.join(UPSERT_COLUMNS)
+        
+        create_stage = text(f'''
+            CREATE TEMPORARY TABLE {STAGE_TABLE} (
+                ncm_code VARCHAR(12) NOT NULL,
+                version_date DATE NOT NULL,
+                source_file VARCHAR(255) NOT NULL,
+                description TEXT,
+                aec FLOAT, ez FLOAT, iz FLOAT, uvf FLOAT,
+                cl VARCHAR(50)
+            )
+        ''')
+        stage_insert = text(
+            f"INSERT INTO {STAGE_TABLE} ({columns}) VALUES ({', '.join(':' + column for column in UPSERT_COLUMNS)})"
+        ).bindparams(bindparam('version_date', type_=db.Date))
+        merge = text(f'''
+            INSERT INTO ncm_versions ({columns}, active, created_at)
+            SELECT {columns}, :active, :created_at FROM {STAGE_TABLE} WHERE true
+            ON CONFLICT (ncm_code, version_date) DO UPDATE SET {assignments}
+            WHERE {changed}
+        ''').bindparams(bindparam('active', type_=db.Boolean), bindparam('created_at', type_=db.DateTime))
+        
+        # La tabla temporal existe solo en la conexión de la transacción
+        # actual, así que todos los lotes se combinan en una sola transacción
+        try:
+            session.execute(text(f"DROP TABLE IF EXISTS {STAGE_TABLE}"))
+            session.execute(create_stage)
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                session.execute(text(f"DELETE FROM {STAGE_TABLE}"))
+                session.execute(stage_insert, batch)
+                
+                # Clasificar el lote antes de combinarlo
+                existing, same_rows = session.execute(text(f'''
+                    SELECT COUNT(v.id), COALESCE(SUM(CASE WHEN {unchanged} THEN 1 ELSE 0 END), 0)
+                    FROM {STAGE_TABLE} s
+                    JOIN ncm_versions v ON v.ncm_code = s.ncm_code AND v.version_date = s.version_date
+                ''')).one()
+                counts['inserted'] += len(batch) - existing
+                counts['updated'] += existing - same_rows
+                counts['unchanged'] += same_rows
+                
+                session.execute(merge, {'active': True, 'created_at': datetime.utcnow()})
+            session.execute(text(f"DROP TABLE {STAGE_TABLE}"))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        
+        return counts
@@ -1,9 +1,11 @@
 from sqlalchemy import Column, Integer, String, Text
 from .. import db
-import re
-import os
+from ..db_pool import get_connection
+from ..version_catalog import resolve_arancel_db_path
+from ..note_cache import get_version_notes
+from ..tariff_snapshot import get_snapshot
+from ..db_schema import canonical_ncm, parse_section_no
 import sqlite3
-from pathlib import Path
 
 class SectionNote(db.Model):
     """Modelo para las notas de sección del Arancel Nacional."""
@@ -14,51 +16,6 @@ class SectionNote(db.Model):
     section_number = db.Column(db.String(2), nullable=False, unique=True, index=True)
     note_text = db.Column(db.Text, nullable=False)
     
-    @classmethod
-    def _get_arancel_db_path(cls):
-        """Obtiene la ruta a la base de datos de aranceles según la versión seleccionada."""
-        try:
-            # Intentar obtener la ruta desde la configuración
-            from flask import current_app, session, g
-            import logging
-            
-            # Verificar si hay una versión específica seleccionada
-            version = None
-            if hasattr(g, 'version') and g.version:
-                version = g.version
-            elif 'arancel_version' in session:
-                version = session.get('arancel_version')
-            
-            # Si tenemos una versión, usar la base de datos específica
-            if version:
-                base_dir = Path(__file__).resolve().parent.parent.parent.parent
-                version_db_path = str(base_dir / 'data' / 'db_versions' / f'arancel_{version}.sqlite3')
-                if os.path.exists(version_db_path):
-                    return version_db_path
-                else:
-                    # Si no existe la versión específica, log de advertencia
-                    if hasattr(current_app, 'logger'):
-                        current_app.logger.warning(f"Base de datos para versión {version} no encontrada: {version_db_path}")
-            
-            # Si hay una configuración específica, usarla
-            if hasattr(current_app, 'config') and 'ARANCEL_DATABASE_URI' in current_app.config:
-                db_path = current_app.config['ARANCEL_DATABASE_URI'].replace('sqlite:///', '')
-                if os.path.exists(db_path):
-                    return db_path
-        except Exception as e:
-            # Log del error
-            import logging
-            logging.error(f"Error al obtener la ruta de la base de datos: {str(e)}")
-        
-        # Si falla todo lo anterior, usar la base de datos predeterminada (symlink a la última versión)
-        base_dir = Path(__file__).resolve().parent.parent.parent.parent
-        latest_symlink = str(base_dir / 'data' / 'db_versions' / 'arancel_latest.sqlite3')
-        if os.path.exists(latest_symlink):
-            return latest_symlink
-        
-        # Como última opción, usar la ruta clásica
-        return str(base_dir / 'data' / 'database.sqlite3')
-    
     @classmethod
     def get_note_by_section(cls, section_number, session=None):
         """
@@ -76,11 +33,9 @@ class SectionNote(db.Model):
             
         # Si el section_number es un número romano o tiene formato "X - Descripción"
         if not section_number.isdigit():
-            # Verificar si contiene un número romano
-            roman_match = re.match(r'^([IVX]+)(?:\s*-\s*.*)?$', section_number)
-            if roman_match:
-                roman = roman_match.group(1)
-                section_number = cls.convert_roman_to_decimal(roman)
+            section_no = parse_section_no(section_number)
+            if section_no:
+                section_number = f"{section_no:02d}"
         
         # Intentar primero con SQLAlchemy (para compatibilidad)
         if session:
@@ -92,28 +47,10 @@ class SectionNote(db.Model):
                 import logging
                 logging.error(f"Error en SectionNote.get_note_by_section con SQLAlchemy: {e}")
         
-        # Si falla o no hay resultados, usar SQLite directamente
-        try:
-            db_path = cls._get_arancel_db_path()
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            # Verificar si la tabla existe
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='section_notes'")
-            if not cursor.fetchone():
-                conn.close()
-                return None
-                
-            cursor.execute("SELECT note_text FROM section_notes WHERE section_number = ?", (section_number,))
-            row = cursor.fetchone()
-            conn.close()
-            
-            if row:
-                return row['note_text']
-        except Exception as e:
-            import logging
-            logging.error(f"Error en SectionNote.get_note_by_section con SQLite: {e}")
+        # Si falla o no hay resultados, usar las notas de la versión en memoria
+        notes = get_version_notes()
+        if notes is not None:
+            return notes.section_note(section_number)
             
         return None
     
@@ -135,39 +72,28 @@ class SectionNote(db.Model):
             return cls.get_note_by_section(section_number, session=session)
         
         # Si no se proporcionó el número de sección, intentamos obtenerlo
-        from ..models.arancel import Arancel
-        
-        # Intentar primero con SQLAlchemy (para compatibilidad)
-        if session:
-            try:
-                arancel = session.query(Arancel).filter(Arancel.NCM == ncm).first()
-                if arancel and arancel.SECTION:
-                    return cls.get_note_by_section(arancel.SECTION, session=session)
-            except Exception as e:
-                import logging
-                logging.error(f"Error en SectionNote.get_note_by_ncm con SQLAlchemy: {e}")
+        # desde la instantánea en memoria de la versión
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            record = snapshot.get(ncm)
+            if record and record.SECTION:
+                return cls.get_note_by_section(record.SECTION, session=session)
+            return None
         
-        # Si falla o no hay resultados, usar SQLite directamente
+        # Si no hay instantánea, usar SQLite directamente
         try:
-            db_path = cls._get_arancel_db_path()
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
+            conn = get_connection(resolve_arancel_db_path())
             cursor = conn.cursor()
             
-            # Limpiar NCM de puntos para la búsqueda
-            ncm_clean = ncm.replace('.', '')
-            
-            # Buscar primero sin puntos
-            cursor.execute("SELECT SECTION FROM arancel_nacional WHERE NCM = ?", (ncm_clean,))
+            # Buscar por el NCM normalizado (solo dígitos)
+            ncm_key = canonical_ncm(ncm)
+            try:
+                cursor.execute("SELECT SECTION FROM arancel_nacional WHERE ncm_key = ?", (ncm_key,))
+            except sqlite3.OperationalError:
+                # Versión sin columna ncm_key
+                cursor.execute("SELECT SECTION FROM arancel_nacional WHERE REPLACE(NCM, '.', '') = ?", (ncm_key,))
             row = cursor.fetchone()
             
-            # Si no hay resultado, buscar con el formato original
-            if not row:
-                cursor.execute("SELECT SECTION FROM arancel_nacional WHERE NCM = ?", (ncm,))
-                row = cursor.fetchone()
-            
-            conn.close()
-            
             if row and row['SECTION']:
                 return cls.get_note_by_section(row['SECTION'], session=session)
         except Exception as e:
@@ -197,27 +123,10 @@ class SectionNote(db.Model):
                 import logging
                 logging.error(f"Error en SectionNote.get_all_notes con SQLAlchemy: {e}")
         
-        # Si falla o no hay resultados, usar SQLite directamente
-        try:
-            db_path = cls._get_arancel_db_path()
-            conn = sqlite3.connect(db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            # Verificar si la tabla existe
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='section_notes'")
-            if not cursor.fetchone():
-                conn.close()
-                return {}
-                
-            cursor.execute("SELECT section_number, note_text FROM section_notes")
-            rows = cursor.fetchall()
-            conn.close()
-            
-            return {row['section_number']: row['note_text'] for row in rows}
-        except Exception as e:
-            import logging
-            logging.error(f"Error en SectionNote.get_all_notes con SQLite: {e}")
+        # Si falla o no hay resultados, usar las notas de la versión en memoria
+        notes = get_version_notes()
+        if notes is not None:
+            return dict(notes.section_notes)
             
         return {}
     
@@ -0,0 +1,74 @@
+"""
+Notas de sección y de capítulo de cada versión, cargadas en memoria.
+
+Cada versión tiene pocas notas y no cambian una vez publicada, así que se
+leen todas con una consulta por tabla y se guardan hasta que cambia el
+catálogo de versiones. Los listados pueden saber qué secciones y capítulos
+tienen nota sin consultar la base de datos por cada uno.
+"""
+import logging
+import sqlite3
+
+from .db_pool import get_connection
+from .version_catalog import VersionCache, resolve_arancel_db_path
+
+
+class VersionNotes:
+    """Notas de una versión, por número de sección y de capítulo ('01', '02', ...)."""
+
+    def __init__(self, section_notes, chapter_notes):
+        self.section_notes = section_notes
+        self.chapter_notes = chapter_notes
+
+    @property
+    def sections_with_notes(self):
+        """Números de sección que tienen nota."""
+        return self.section_notes.keys()
+
+    @property
+    def chapters_with_notes(self):
+        """Números de capítulo que tienen nota."""
+        return self.chapter_notes.keys()
+
+    def section_note(self, section_number):
+        return self.section_notes.get(section_number)
+
+    def chapter_note(self, chapter_number):
+        return self.chapter_notes.get(chapter_number)
+
+    @classmethod
+    def load(cls, db_path):
+        """Lee todas las notas de una base de datos (una consulta por tabla)."""
+        conn = get_connection(db_path)
+        return cls(
+            _load_notes(conn, 'section_notes', 'section_number'),
+            _load_notes(conn, 'chapter_notes', 'chapter_number'),
+        )
+
+
+def _load_notes(conn, table, number_column):
+    try:
+        rows = conn.execute(f"SELECT {number_column}, note_text FROM {table}").fetchall()
+    except sqlite3.OperationalError:
+        # Versión sin tabla de notas
+        return {}
+    return {row[number_column]: row['note_text'] for row in rows}
+
+
+_cache = VersionCache(VersionNotes.load)
+
+
+def get_version_notes(db_path=None):
+    """
+    Notas de la versión seleccionada (o de ``db_path``).
+
+    Returns:
+        VersionNotes: Notas, o None si la base de datos no se pudo leer
+    """
+    if db_path is None:
+        db_path = resolve_arancel_db_path()
+    try:
+        return _cache.get(db_path)
+    except sqlite3.Error as e:
+        logging.error(f"No se pudieron leer las notas de {db_path}: {str(e)}")
+        return None
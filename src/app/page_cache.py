@@ -0,0 +1,144 @@
+"""
+Caché LRU de páginas HTML que solo dependen de la versión seleccionada.
+
+Las páginas de secciones, capítulos y detalle de un NCM no cambian mientras
+no se publique otra versión, así que el HTML renderizado se guarda en
+memoria con clave (ruta, versión, parámetros, usuario). La caché tiene un
+límite de memoria, un tiempo de vida por entrada y se vacía cuando cambia el
+catálogo de versiones.
+"""
+import functools
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, make_response, request, session
+from flask_login import current_user
+
+from .version_catalog import catalog, get_selected_version, resolve_arancel_db_path
+
+# Memoria máxima ocupada por las páginas guardadas (en bytes)
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+# Segundos que una página guardada se considera vigente
+DEFAULT_TTL = 300
+
+
+class PageCache:
+    """Caché LRU de respuestas con límite de memoria y tiempo de vida."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.ttl > 0
+
+    def get(self, key):
+        """
+        Devuelve la entrada guardada para una clave si sigue vigente.
+
+        Returns:
+            tuple: (contenido, tipo MIME) o None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, body, mimetype = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return body, mimetype
+
+    def set(self, key, body, mimetype):
+        """Guarda una página, descartando las menos usadas si se supera el límite."""
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, body, mimetype)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        """Descarta todas las páginas guardadas."""
+        with self._lock:
+            dropped = len(self._entries)
+            self._entries.clear()
+            self.size = 0
+        if dropped:
+            logging.info(f"Caché de páginas vaciada ({dropped} páginas)")
+
+    def _remove(self, key):
+        _, body, _ = self._entries.pop(key)
+        self.size -= len(body)
+
+
+# Caché compartida por toda la aplicación
+page_cache = PageCache()
+catalog.on_invalidate(page_cache.clear)
+
+
+def _user_key():
+    """Parte de la clave que depende del usuario (la barra superior muestra sus datos)."""
+    if not current_user.is_authenticated:
+        return None
+    return (current_user.get_id(), current_user.role)
+
+
+def _cache_key():
+    # La versión seleccionada forma parte de la clave además de la ruta: la
+    # página muestra su nombre aunque coincida con la más reciente
+    return (
+        request.endpoint,
+        get_selected_version() or None,
+        resolve_arancel_db_path(),
+        tuple(sorted((request.view_args or {}).items())),
+        tuple(sorted(request.args.items(multi=True))),
+        _user_key(),
+    )
+
+
+def cached_page(view):
+    """
+    Decorador que sirve la página desde la caché o la guarda tras renderizarla.
+
+    No se usa la caché cuando hay mensajes flash pendientes (se mostrarían en
+    la página guardada) ni para usuarios gratuitos, cuya barra superior
+    muestra el tiempo restante de sesión. Debe aplicarse después de
+    login_required para que la autenticación se verifique siempre.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if (not page_cache.enabled or request.method != 'GET' or '_flashes' in session
+                or (current_user.is_authenticated and current_user.is_free)):
+            return view(*args, **kwargs)
+
+        key = _cache_key()
+        cached = page_cache.get(key)
+        if cached is not None:
+            body, mimetype = cached
+            return Response(body, mimetype=mimetype)
+
+        response = make_response(view(*args, **kwargs))
+        # Guardar solo páginas completas sin mensajes flash
+        if response.status_code == 200 and not response.direct_passthrough and '_flashes' not in session:
+            page_cache.set(key, response.get_data(), response.mimetype)
+        return response
+
+    return wrapper
+
+
+def init_app(app):
+    """Configura el tamaño y el tiempo de vida de la caché de páginas."""
+    page_cache.max_bytes = app.config.get('PAGE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+    page_cache.ttl = app.config.get('PAGE_CACHE_TTL', DEFAULT_TTL)
@@ -1,88 +1,363 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, url_for
 from ..models import Arancel
 from ..models.ncm_version import NCMVersion
 from .. import db
+from ..http_cache import version_etag
+from ..db_schema import canonical_ncm
 from datetime import datetime
+import base64
+import json
+import re
 
 api_bp = Blueprint('api', __name__)
 
+# Largo máximo de la descripción en las sugerencias de autocompletado
+AUTOCOMPLETE_DESC_LENGTH = 80
+
+# Cantidad máxima de códigos en una consulta por lote
+BATCH_MAX_CODES = 20000
+
+# Código NCM válido: dígitos, opcionalmente separados por puntos
+NCM_CODE_RE = re.compile(r'^\s*\d+(?:\.\d+)*\s*$')
+
+def _encode_cursor(tipo, query, ultimo):
+    """Cursor opaco que apunta al último resultado de una página."""
+    payload = {'t': tipo, 'q': query, 'k': canonical_ncm(ultimo.NCM)}
+    if getattr(ultimo, 'score', None) is not None:
+        payload['s'] = ultimo.score
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _decode_cursor(token, tipo, query):
+    """
+    Decodifica un cursor y verifica que corresponda a la misma consulta.
+    
+    Raises:
+        ValueError: Si el cursor es inválido o de otra consulta
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        key = payload['k']
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError('Cursor inválido') from e
+    if payload.get('t') != tipo or payload.get('q') != query or not isinstance(key, str):
+        raise ValueError('El cursor no corresponde a esta consulta')
+    return payload
+
 @api_bp.route('/aranceles', methods=['GET'])
 def listar_aranceles():
-    """Endpoint para listar aranceles con filtros opcionales."""
+    """
+    Endpoint para listar aranceles con filtros opcionales.
+    
+    La paginación es por clave: cada respuesta incluye un cursor opaco y el
+    enlace ``next`` a la página siguiente (None en la última página). Con
+    ``as_of=AAAA-MM-DD`` la búsqueda se hace sobre la versión vigente en esa
+    fecha.
+    """
     # Parámetros de consulta
     query = request.args.get('q', '')
     tipo = request.args.get('tipo', 'descripcion')
-    limit = min(int(request.args.get('limit', 50)), 100)  # Máximo 100 registros
+    limit = max(min(request.args.get('limit', 50, type=int), 100), 1)  # Máximo 100 registros
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    
+    # Buscar en la versión vigente en una fecha
+    as_of = request.args.get('as_of')
+    if as_of:
+        from flask import g
+        from ..tariff_history import parse_as_of
+        from ..version_catalog import catalog
+        try:
+            as_of = parse_as_of(as_of)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        g.version = catalog.version_for_date(as_of)
+        if not g.version:
+            return jsonify({'error': f'No hay una versión vigente al {as_of}'}), 404
+    
+    cursor = request.args.get('cursor')
+    after = None
+    if cursor:
+        try:
+            after = _decode_cursor(cursor, tipo if query else '', query)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
     
     resultados = []
     
+    # Se pide un registro más para saber si hay otra página
     if query:
         if tipo == 'ncm':
             arancel = Arancel.buscar_por_ncm(query)
-            if arancel:
+            if arancel and not after:
                 resultados = [arancel]
         elif tipo == 'descripcion':
-            resultados = Arancel.buscar_por_descripcion(query, limit)
+            # Los cursores de búsquedas sin índice de texto completo no tienen relevancia
+            keyset = (after.get('s', float('-inf')), after['k']) if after else None
+            resultados = Arancel.buscar_por_descripcion(query, limit + 1, offset=offset, after=keyset)
         elif tipo == 'seccion':
-            resultados = Arancel.listar_por_seccion(query, limit)
+            resultados = Arancel.listar_por_seccion(query, limit + 1, after=after['k'] if after else None)
         elif tipo == 'capitulo':
-            resultados = Arancel.listar_por_capitulo(query, limit)
+            resultados = Arancel.listar_por_capitulo(query, limit + 1, after=after['k'] if after else None)
     else:
-        # Si no hay consulta, devolver los primeros registros
-        resultados = Arancel.query.limit(limit).all()
+        # Si no hay consulta, recorrer la versión completa en orden de NCM
+        resultados = Arancel.listar(limit + 1, after=after['k'] if after else None)
     
-    return jsonify({
+    siguiente = None
+    next_cursor = None
+    if len(resultados) > limit:
+        resultados = resultados[:limit]
+        next_cursor = _encode_cursor(tipo if query else '', query, resultados[-1])
+        # Conservar el resto de los parámetros (consulta, versión, límite)
+        params = request.args.to_dict()
+        params.update(limit=limit, cursor=next_cursor)
+        params.pop('offset', None)
+        siguiente = url_for('api.listar_aranceles', **params)
+    
+    respuesta = {
         'total': len(resultados),
-        'resultados': [item.to_dict() for item in resultados]
-    })
+        'resultados': [item.to_dict() for item in resultados],
+        'cursor': next_cursor,
+        'next': siguiente
+    }
+    if as_of:
+        respuesta.update(as_of=as_of, version=g.version)
+    return jsonify(respuesta)
 
 @api_bp.route('/aranceles/<string:ncm>', methods=['GET'])
+@version_etag
 def obtener_arancel(ncm):
-    """Endpoint para obtener un arancel específico por NCM utilizando conexión directa a SQLite."""
+    """
+    Endpoint para obtener un arancel específico por NCM desde la instantánea en memoria.
+    
+    Query params:
+        as_of: Fecha AAAA-MM-DD para obtener la tarifa vigente en esa fecha (opcional)
+    """
     try:
-        import sqlite3
-        from ..models.arancel import Arancel
-        from flask import current_app, g, session, abort
+        from ..tariff_snapshot import get_snapshot
+        from ..tariff_history import get_history_connection, lookup, parse_as_of
         import logging
         
-        # Obtener la ruta de la base de datos actual
-        db_path = Arancel._get_arancel_db_path()
+        # Tarifa vigente en una fecha, desde el índice temporal de vigencias
+        as_of = request.args.get('as_of')
+        if as_of:
+            try:
+                as_of = parse_as_of(as_of)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            history = get_history_connection()
+            if history is None:
+                return jsonify({'error': 'El índice de vigencias no está disponible'}), 503
+            record = lookup(history, ncm, as_of)
+            if not record:
+                return jsonify({'error': f'NCM {ncm} no vigente al {as_of}'}), 404
+            return jsonify(record)
         
-        # Conectar directamente a la base de datos SQLite
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        # Instantánea de la versión actual (se carga una sola vez por versión)
+        snapshot = get_snapshot()
+        if snapshot is None:
+            return jsonify({'error': 'No se pudo leer la versión del arancel'}), 500
         
-        # Buscar el NCM específico
-        cursor.execute("SELECT * FROM arancel_nacional WHERE NCM = ?", (ncm,))
-        row = cursor.fetchone()
+        # Buscar el NCM específico (con o sin puntos)
+        record = snapshot.get(ncm)
         
-        if not row:
-            conn.close()
+        if not record:
             return jsonify({'error': f'NCM {ncm} no encontrado'}), 404
-            
-        # Convertir el resultado a un diccionario para JSON
-        arancel_dict = {}
-        for key in row.keys():
-            arancel_dict[key] = row[key]
-        
-        # Cerrar la conexión
-        conn.close()
         
-        return jsonify(arancel_dict)
+        return jsonify(record.to_dict())
     except Exception as e:
         logging.error(f"Error en API obtener_arancel: {str(e)}")
         return jsonify({'error': f'Error al obtener el arancel: {str(e)}'}), 500
 
+@api_bp.route('/aranceles/batch', methods=['POST'])
+def obtener_aranceles_lote():
+    """
+    Endpoint para obtener muchos aranceles en una sola llamada.
+    
+    Cuerpo JSON:
+        ncms: Lista de códigos NCM (con o sin puntos), o de objetos
+            {"ncm": ..., "as_of": "AAAA-MM-DD"} para consultar la tarifa
+            vigente en la fecha de cada declaración
+        version: Versión en formato AAAAMM (opcional, por defecto la seleccionada)
+        as_of: Fecha AAAA-MM-DD para todos los códigos (opcional)
+    """
+    from ..tariff_snapshot import get_snapshot
+    from ..tariff_history import get_history_connection, lookup, parse_as_of
+    from ..version_catalog import catalog, resolve_arancel_db_path
+    from ..db_schema import canonical_ncm
+    
+    datos = request.get_json(silent=True)
+    codigos = datos.get('ncms') if isinstance(datos, dict) else None
+    if not isinstance(codigos, list):
+        return jsonify({'error': 'Se requiere una lista "ncms" con los códigos a consultar'}), 400
+    if len(codigos) > BATCH_MAX_CODES:
+        return jsonify({'error': f'Se admiten como máximo {BATCH_MAX_CODES} códigos por llamada'}), 400
+    
+    as_of = datos.get('as_of')
+    if as_of:
+        try:
+            as_of = parse_as_of(as_of)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    version = datos.get('version')
+    if version:
+        db_path = catalog.get_path(str(version))
+        if not db_path:
+            return jsonify({'error': f'Versión {version} no encontrada'}), 404
+    else:
+        db_path = resolve_arancel_db_path()
+    
+    # Los códigos sin fecha se resuelven sobre el índice en memoria de la
+    # versión y los códigos con fecha sobre el índice temporal de vigencias
+    snapshot = None
+    history = None
+    
+    resultados = []
+    no_encontrados = []
+    invalidos = []
+    vistos = set()
+    for item in codigos:
+        codigo, fecha = item, as_of
+        if isinstance(item, dict):
+            codigo = item.get('ncm')
+            try:
+                fecha = parse_as_of(item['as_of']) if item.get('as_of') else as_of
+            except ValueError:
+                invalidos.append(item)
+                continue
+        if not isinstance(codigo, str) or not NCM_CODE_RE.match(codigo):
+            invalidos.append(item)
+            continue
+        clave = canonical_ncm(codigo)
+        if (clave, fecha) in vistos:
+            continue
+        vistos.add((clave, fecha))
+        
+        if fecha:
+            if history is None:
+                history = get_history_connection()
+                if history is None:
+                    return jsonify({'error': 'El índice de vigencias no está disponible'}), 503
+            record = lookup(history, clave, fecha)
+            if record:
+                record['as_of'] = fecha
+                resultados.append(record)
+            else:
+                no_encontrados.append(item)
+            continue
+        
+        if snapshot is None:
+            snapshot = get_snapshot(db_path)
+            if snapshot is None:
+                return jsonify({'error': 'No se pudo leer la versión del arancel'}), 500
+        record = snapshot.get(clave)
+        if record:
+            resultados.append(record.to_dict())
+        else:
+            no_encontrados.append(item)
+    
+    return jsonify({
+        'version': version or None,
+        'as_of': as_of or None,
+        'total': len(resultados),
+        'resultados': resultados,
+        'no_encontrados': no_encontrados,
+        'invalidos': invalidos
+    })
+
+@api_bp.route('/export', methods=['GET'])
+def exportar_version():
+    """
+    Endpoint para descargar una versión completa del arancel.
+    
+    Query params:
+        version: Versión en formato AAAAMM (opcional, por defecto la seleccionada)
+        format: ndjson (por defecto) o csv
+        gzip: 1 para comprimir la respuesta
+        seccion: Filtrar por sección (número o número romano)
+        capitulo: Filtrar por capítulo
+    """
+    from flask import Response
+    from ..export import EXPORT_FORMATS, open_export_cursor, iter_batches, iter_csv, iter_gzip, iter_ndjson
+    from ..version_catalog import catalog, resolve_arancel_db_path
+    from ..db_schema import parse_chapter_no, parse_section_no
+    import sqlite3
+    import logging
+    
+    formato = request.args.get('format', 'ndjson')
+    if formato not in EXPORT_FORMATS:
+        return jsonify({'error': f'Formato no admitido: {formato}. Use ndjson o csv'}), 400
+    
+    version = request.args.get('version')
+    if version and not catalog.get_path(version):
+        return jsonify({'error': f'Versión {version} no encontrada'}), 404
+    db_path = resolve_arancel_db_path()
+    
+    section_no = chapter_no = None
+    if request.args.get('seccion'):
+        section_no = parse_section_no(request.args['seccion'])
+        if section_no is None:
+            return jsonify({'error': 'Sección inválida'}), 400
+    if request.args.get('capitulo'):
+        chapter_no = parse_chapter_no(request.args['capitulo'])
+        if chapter_no is None:
+            return jsonify({'error': 'Capítulo inválido'}), 400
+    
+    try:
+        conn, cursor = open_export_cursor(db_path, section_no, chapter_no)
+    except sqlite3.Error as e:
+        logging.error(f"Error al exportar {db_path}: {str(e)}")
+        return jsonify({'error': 'Error al exportar la versión'}), 500
+    
+    batches = iter_batches(conn, cursor)
+    chunks = iter_csv(batches) if formato == 'csv' else iter_ndjson(batches)
+    
+    filename = f"arancel_{version or 'latest'}.{formato}"
+    headers = {}
+    if request.args.get('gzip', '').lower() in ('1', 'true', 'si', 'yes'):
+        chunks = iter_gzip(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    
+    return Response(chunks, mimetype=EXPORT_FORMATS[formato], headers=headers)
+
+@api_bp.route('/autocomplete/ncm', methods=['GET'])
+def autocompletar_ncm():
+    """Endpoint de autocompletado de códigos NCM a partir de un prefijo."""
+    from ..tariff_snapshot import get_snapshot
+    
+    prefix = request.args.get('prefix', '')
+    limit = min(request.args.get('limit', 10, type=int) or 10, 50)  # Máximo 50 sugerencias
+    
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return jsonify({'error': 'No se pudo leer la versión del arancel'}), 500
+    
+    sugerencias = []
+    for record in snapshot.prefix_search(prefix, max(limit, 1)):
+        descripcion = record.DESCRIPCION or ''
+        if len(descripcion) > AUTOCOMPLETE_DESC_LENGTH:
+            descripcion = descripcion[:AUTOCOMPLETE_DESC_LENGTH].rstrip() + '…'
+        sugerencias.append({'NCM': record.NCM, 'DESCRIPCION': descripcion})
+    
+    return jsonify({
+        'prefix': prefix,
+        'total': len(sugerencias),
+        'sugerencias': sugerencias
+    })
+
 @api_bp.route('/secciones', methods=['GET'])
+@version_etag
 def listar_secciones():
-    """Endpoint para listar todas las secciones disponibles."""
-    from .. import db
-    secciones_query = db.session.query(Arancel.SECTION).distinct().filter(
-        Arancel.SECTION != ''
-    ).order_by(Arancel.SECTION)
+    """Endpoint para listar todas las secciones disponibles en la versión actual."""
+    from ..version_stats import get_version_stats
+    
+    stats = get_version_stats()
+    if stats is None:
+        return jsonify({'error': 'No se pudo leer la versión del arancel'}), 500
     
-    secciones = [seccion[0] for seccion in secciones_query]
+    secciones = [section['SECTION'] for section in stats.sections if section['SECTION']]
     
     return jsonify({
         'total': len(secciones),
@@ -90,22 +365,26 @@ def listar_secciones():
     })
 
 @api_bp.route('/capitulos', methods=['GET'])
+@version_etag
 def listar_capitulos():
-    """Endpoint para listar todos los capítulos disponibles."""
-    from .. import db
+    """Endpoint para listar todos los capítulos disponibles en la versión actual."""
+    from ..version_stats import get_version_stats
     seccion = request.args.get('seccion', '')
     
+    stats = get_version_stats()
+    if stats is None:
+        return jsonify({'error': 'No se pudo leer la versión del arancel'}), 500
+    
+    capitulos_stats = stats.chapters
     if seccion:
-        capitulos_query = db.session.query(Arancel.CHAPTER).distinct().filter(
-            Arancel.SECTION.ilike(f'%{seccion}%'),
-            Arancel.CHAPTER != ''
-        ).order_by(Arancel.CHAPTER)
-    else:
-        capitulos_query = db.session.query(Arancel.CHAPTER).distinct().filter(
-            Arancel.CHAPTER != ''
-        ).order_by(Arancel.CHAPTER)
+        # Secciones cuyo texto contiene el filtro (sin distinguir mayúsculas)
+        secciones = {
+            section['section_no'] for section in stats.sections
+            if seccion.lower() in (section['SECTION'] or '').lower()
+        }
+        capitulos_stats = [chapter for chapter in capitulos_stats if chapter['section_no'] in secciones]
     
-    capitulos = [capitulo[0] for capitulo in capitulos_query]
+    capitulos = [chapter['CHAPTER'] for chapter in capitulos_stats if chapter['CHAPTER']]
     
     return jsonify({
         'total': len(capitulos),
@@ -145,3 +424,49 @@ def compare_ncm_versions(ncm_code):
         return jsonify(changes)
     except Exception as e:
         return jsonify({'error': f'Error al comparar versiones: {str(e)}'}), 500
+
+@api_bp.route('/diff', methods=['GET'])
+def diff_versiones():
+    """
+    Endpoint con todas las diferencias entre dos versiones del arancel.
+    
+    Query params:
+        from: Versión anterior en formato AAAAMM
+        to: Versión nueva en formato AAAAMM
+        
+    Returns:
+        JSON con los NCM agregados, eliminados y los campos modificados
+    """
+    from ..db_pool import pool
+    from ..version_catalog import catalog
+    from ..version_diff import attach_previous, compute_diff, load_diff, summarize_diff
+    import sqlite3
+    import logging
+    
+    from_version = request.args.get('from')
+    to_version = request.args.get('to')
+    if not from_version or not to_version:
+        return jsonify({'error': 'Se requieren los parámetros from y to'}), 400
+    
+    from_path = catalog.get_path(from_version)
+    to_path = catalog.get_path(to_version)
+    for version, path in ((from_version, from_path), (to_version, to_path)):
+        if not path:
+            return jsonify({'error': f'Versión {version} no encontrada'}), 404
+    
+    try:
+        # Diferencias guardadas al publicar la versión nueva
+        conn = pool.connect(to_path)
+        try:
+            rows = load_diff(conn, from_version)
+            if rows is None:
+                # Versiones no consecutivas: calcular en el momento
+                attach_previous(conn, pool.uri(from_path))
+                rows = compute_diff(conn)
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logging.error(f"Error al comparar las versiones {from_version} y {to_version}: {str(e)}")
+        return jsonify({'error': f'Error al comparar versiones: {str(e)}'}), 500
+    
+    return jsonify({'from': from_version, 'to': to_version, **summarize_diff(rows)})
@@ -1,8 +1,14 @@
 from flask import Blueprint, render_template, request, flash, redirect, url_for, g, abort, jsonify, session, has_app_context
 from ..models import Arancel, ChapterNote, SectionNote
 from .. import db
-from ..db_utils import get_available_versions
-from sqlalchemy import or_, func, distinct
+from ..db_pool import get_connection
+from ..version_catalog import catalog, resolve_arancel_db_path
+from ..tariff_snapshot import get_snapshot
+from ..version_stats import get_version_stats
+from ..note_cache import get_version_notes
+from ..page_cache import cached_page
+from ..db_schema import canonical_ncm, parse_chapter_no, parse_section_no
+from sqlalchemy import or_
 import re
 from flask_login import current_user, login_required
 from .auth import check_session_expiry
@@ -15,46 +21,8 @@ main_bp = Blueprint('main', __name__)
 
 # Función auxiliar para obtener las versiones formateadas para el selector
 def get_formatted_versions():
-    """Obtiene las versiones disponibles formateadas para el selector."""
-    versions_data = []
-    versions = get_available_versions()
-    
-    for version in versions:
-        # Formato más legible: 202502 -> Feb 2025
-        if len(version) == 6:  # formato AAAAMM
-            try:
-                year = version[0:4]
-                month = version[4:6]
-                month_names = {
-                    "01": "Ene", "02": "Feb", "03": "Mar", "04": "Abr",
-                    "05": "May", "06": "Jun", "07": "Jul", "08": "Ago",
-                    "09": "Sep", "10": "Oct", "11": "Nov", "12": "Dic"
-                }
-                formatted = f"{month_names.get(month, month)} {year}"
-                versions_data.append({
-                    'code': version,
-                    'formatted': formatted,
-                    'is_latest': version == versions[0]  # La primera versión es la más reciente
-                })
-            except:
-                versions_data.append({
-                    'code': version,
-                    'formatted': version,
-                    'is_latest': version == versions[0]
-                })
-        else:
-            versions_data.append({
-                'code': version,
-                'formatted': version,
-                'is_latest': version == versions[0]
-            })
-    
-    # Obtener la fecha formateada de la versión más reciente
-    latest_formatted = "Actual"
-    if versions_data:
-        latest_formatted = versions_data[0]['formatted']
-        
-    return versions_data, latest_formatted
+    """Obtiene las versiones disponibles formateadas para el selector (desde el catálogo en memoria)."""
+    return catalog.formatted_versions()
 
 @main_bp.route('/')
 def index():
@@ -71,29 +39,13 @@ def index():
             return "Error: No hay contexto de aplicación", 500
             
         # Obtenemos estadísticas para mostrar en la página principal
-        # No usamos with db.session.begin() para evitar problemas con transacciones
-        try:
-            # Contar registros totales
-            total_registros = db.session.query(func.count(Arancel.NCM)).scalar()
-            
-            # Contar secciones únicas directamente de la base de datos
-            total_secciones = db.session.query(func.count(distinct(Arancel.SECTION))).scalar()
-            
-            # Contar capítulos únicos de la base de datos
-            chapters = db.session.query(Arancel.CHAPTER).distinct().all()
-            chapter_numbers = set()
-            
-            for chapter_tuple in chapters:
-                chapter_str = chapter_tuple[0]
-                # Extraer el número de capítulo (formato típico: "XX - Descripción")
-                if chapter_str:
-                    match = re.match(r'^(\d+)', chapter_str)
-                    if match:
-                        chapter_numbers.add(int(match.group(1)))
-            
-            total_capitulos = len(chapter_numbers)
-        except Exception as e:
-            logging.error(f"Error al consultar estadísticas: {str(e)}")
+        # (precalculadas por versión y guardadas en memoria)
+        stats = get_version_stats()
+        if stats is not None:
+            total_registros = stats.total
+            total_secciones = stats.total_secciones
+            total_capitulos = stats.total_capitulos
+        else:
             total_registros = 0
             total_secciones = 0
             total_capitulos = 0
@@ -120,6 +72,7 @@ def buscar():
     resultados = []
     query = request.args.get('q', '')
     tipo_busqueda = request.args.get('tipo', 'descripcion')
+    offset = max(request.args.get('offset', 0, type=int), 0)
     chapter_note = None  # Variable para almacenar la nota del capítulo
     section_note = None  # Variable para almacenar la nota de la sección
     total_resultados = 0
@@ -153,10 +106,11 @@ def buscar():
                             section_note = SectionNote.get_note_by_ncm(resultados[0].NCM, resultados[0].SECTION, session=db.session)
                             logging.debug(f"DEBUG - NCM Parcial: section={resultados[0].SECTION}, chapter={resultados[0].CHAPTER}, section_note={section_note is not None}, chapter_note={chapter_note is not None}")
 
-                    if not resultados and query.isdigit():
-                        # Si no hay resultados y el query es numérico, intentar con ceros a la izquierda
-                        padded_query = query.zfill(4)  # Rellenar con ceros a la izquierda hasta 4 dígitos
-                        if padded_query != query:
+                    ncm_query = canonical_ncm(query)
+                    if not resultados and ncm_query:
+                        # Si no hay resultados, intentar con ceros a la izquierda sobre el NCM normalizado
+                        padded_query = ncm_query.zfill(4)  # Rellenar con ceros a la izquierda hasta 4 dígitos
+                        if padded_query != ncm_query:
                             logging.info(f"No se encontraron resultados, intentando con ceros a la izquierda: {padded_query}")
                             arancel = Arancel.buscar_por_ncm(padded_query, session=db.session)
                             if arancel:
@@ -181,18 +135,18 @@ def buscar():
                         # Intentar obtener la nota de capítulo
                         if chapter_note is None and hasattr(first_result, 'CHAPTER') and first_result.CHAPTER:
                             # Extraer número de capítulo
-                            chapter_match = re.match(r'^(\d+)', first_result.CHAPTER)
-                            if chapter_match:
-                                chapter_number = chapter_match.group(1).zfill(2)
+                            chapter_no = parse_chapter_no(first_result.CHAPTER)
+                            if chapter_no:
+                                chapter_number = f"{chapter_no:02d}"
                                 chapter_note = ChapterNote.get_note_by_chapter(chapter_number, session=db.session)
                                 logging.info(f"Intento manual de obtener nota de capítulo {chapter_number}: {chapter_note is not None}")
                         
                         # Intentar obtener la nota de sección
                         if section_note is None and hasattr(first_result, 'SECTION') and first_result.SECTION:
                             # Extraer número de sección (puede ser romano)
-                            section_match = re.match(r'^([IVX]+|[0-9]+)', first_result.SECTION)
-                            if section_match:
-                                section_id = section_match.group(1)
+                            section_no = parse_section_no(first_result.SECTION)
+                            if section_no:
+                                section_id = f"{section_no:02d}"
                                 section_note = SectionNote.get_note_by_section(section_id, session=db.session)
                                 logging.info(f"Intento manual de obtener nota de sección {section_id}: {section_note is not None}")
                 except Exception as e:
@@ -202,7 +156,7 @@ def buscar():
             elif tipo_busqueda == 'descripcion':
                 # Búsqueda por texto en descripción
                 try:
-                    resultados = Arancel.buscar_por_descripcion(query, session=db.session)
+                    resultados = Arancel.buscar_por_descripcion(query, session=db.session, offset=offset)
                     # Para búsquedas por descripción también podemos mostrar notas si hay resultados
                     if resultados:
                         chapter_note = ChapterNote.get_note_by_ncm(resultados[0].NCM, session=db.session)
@@ -218,7 +172,7 @@ def buscar():
                     # Si hay resultados, obtenemos las notas
                     if resultados:
                         chapter_note = ChapterNote.get_note_by_ncm(resultados[0].NCM, session=db.session)
-                        section_note = SectionNote.get_note_by_section(query.zfill(2) if query.isdigit() else query, session=db.session)
+                        section_note = SectionNote.get_note_by_section(f"{parse_section_no(query):02d}", session=db.session)
                         logging.debug(f"DEBUG - Sección: section={query}, chapter={resultados[0].CHAPTER if resultados else None}, section_note={section_note is not None}, chapter_note={chapter_note is not None}")
                 except Exception as e:
                     logging.error(f"ERROR en búsqueda por sección: {e}")
@@ -231,7 +185,7 @@ def buscar():
                     # Si hay resultados, obtenemos las notas
                     if resultados:
                         section_number = resultados[0].SECTION
-                        chapter_number = resultados[0].CHAPTER[:2] if resultados[0].CHAPTER else None
+                        chapter_number = f"{parse_chapter_no(query):02d}"
                         chapter_note = ChapterNote.get_note_by_chapter(chapter_number, session=db.session)
                         section_note = SectionNote.get_note_by_section(section_number, session=db.session)
                         logging.debug(f"DEBUG - Capítulo: section={section_number}, chapter={chapter_number}, section_note={section_note is not None}, chapter_note={chapter_note is not None}")
@@ -256,8 +210,9 @@ def buscar():
                           latest_formatted=latest_formatted)
 
 @main_bp.route('/arancel/<string:ncm>')
+@cached_page
 def ver_arancel(ncm):
-    """Ruta para ver los detalles de un arancel específico usando conexión directa a SQLite."""
+    """Ruta para ver los detalles de un arancel específico (instantánea en memoria de la versión)."""
     # Obtener las versiones disponibles para el selector
     versiones_selector, latest_formatted = get_formatted_versions()
     
@@ -266,12 +221,10 @@ def ver_arancel(ncm):
             logging.error("No hay contexto de aplicación en ruta ver_arancel")
             return "Error: No hay contexto de aplicación", 500
         
-        # Usar el método de Arancel para obtener la ruta a la base de datos actual
-        from ..models.arancel import Arancel
+        # Obtener la ruta a la base de datos de la versión actual
         from flask import abort
-        import sqlite3
         
-        db_path = Arancel._get_arancel_db_path()
+        db_path = resolve_arancel_db_path()
         
         # Obtener versión seleccionada para mostrar en UI
         version_actual = None
@@ -296,23 +249,19 @@ def ver_arancel(ncm):
         else:
             version_formateada = "Última versión" if not version_actual else version_actual
             
-        # Conectar directamente a la base de datos SQLite
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        # Buscar el NCM específico en la instantánea en memoria de la versión
+        snapshot = get_snapshot(db_path)
+        record = snapshot.get(ncm) if snapshot is not None else None
         
-        # Buscar el NCM específico
-        cursor.execute("SELECT * FROM arancel_nacional WHERE NCM = ?", (ncm,))
-        row = cursor.fetchone()
-        
-        if not row:
-            conn.close()
+        if not record:
             abort(404)
             
         # Convertir el resultado a un diccionario
-        arancel = {}
-        for key in row.keys():
-            arancel[key] = row[key]
+        arancel = record.to_dict()
+        
+        # Conexión del pool para las consultas de notas e histórico
+        conn = get_connection(db_path)
+        cursor = conn.cursor()
         
         # Buscar notas relacionadas con este NCM (capítulo o sección)
         notas = {}
@@ -415,8 +364,6 @@ def ver_arancel(ncm):
                     })
         except Exception as e:
             logging.warning(f"No se pudo obtener el historial de versiones: {str(e)}")
-            
-        conn.close()
         
         # Renderizar el template con todos los datos
         return render_template('arancel.html', 
@@ -432,6 +379,7 @@ def ver_arancel(ncm):
 
 @main_bp.route('/secciones')
 @login_required
+@cached_page
 def secciones():
     """Ruta para ver todas las secciones disponibles en la versión actual de la base de datos."""
     # Obtener las versiones disponibles para el selector
@@ -442,8 +390,8 @@ def secciones():
             logging.error("No hay contexto de aplicación en ruta secciones")
             return "Error: No hay contexto de aplicación", 500
             
-        # Usar el método de Arancel para obtener la ruta a la base de datos actual
-        db_path = Arancel._get_arancel_db_path()
+        # Obtener la ruta a la base de datos de la versión actual
+        db_path = resolve_arancel_db_path()
         
         # Obtener versión seleccionada para mostrar en UI
         version_actual = None
@@ -468,30 +416,39 @@ def secciones():
         else:
             version_formateada = "Última versión" if not version_actual else version_actual
             
-        # Conectar directamente a la base de datos SQLite
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
+        # Conexión del pool a la base de datos SQLite
+        conn = get_connection(db_path)
         cursor = conn.cursor()
         
-        # Obtener secciones únicas ordenadas
-        cursor.execute("SELECT DISTINCT SECTION FROM arancel_nacional WHERE SECTION != '' ORDER BY SECTION")
-        secciones_list = [row['SECTION'] for row in cursor.fetchall()]
-        conn.close()
+        # Obtener secciones únicas en orden numérico
+        try:
+            cursor.execute(
+                "SELECT SECTION, section_no FROM arancel_nacional WHERE SECTION != '' "
+                "GROUP BY section_no, SECTION ORDER BY section_no, SECTION"
+            )
+            secciones_list = [(row['SECTION'], row['section_no']) for row in cursor.fetchall()]
+        except sqlite3.OperationalError:
+            # Versión sin columna section_no
+            cursor.execute("SELECT DISTINCT SECTION FROM arancel_nacional WHERE SECTION != ''")
+            secciones_list = sorted(
+                ((row['SECTION'], parse_section_no(row['SECTION'])) for row in cursor.fetchall()),
+                key=lambda item: (item[1] is None, item[1] or 0, item[0])
+            )
         
         logging.info(f"Se encontraron {len(secciones_list)} secciones en la versión {version_actual or 'latest'}")
         
-        # Obtener las notas de sección (para mostrar información adicional)
+        # Secciones con nota (todas las notas de la versión se leen una sola vez)
+        notes = get_version_notes(db_path)
+        secciones_con_nota = notes.sections_with_notes if notes is not None else set()
         secciones_con_notas = []
         
-        for seccion in secciones_list:
-            # Extraer número de sección (puede ser romano)
+        for seccion, section_no in secciones_list:
+            # Número romano tal como aparece en el texto de la sección
             section_match = re.match(r'^([IVX]+|[0-9]+)', seccion)
             section_id = section_match.group(1) if section_match else None
             
-            # Obtener nota si existe
-            nota = None
-            if section_id:
-                nota = SectionNote.get_note_by_section(section_id)
+            # Verificar si hay nota para esta sección
+            tiene_nota = bool(section_no) and f"{section_no:02d}" in secciones_con_nota
                 
             # Extraer título de la sección
             titulo = seccion
@@ -502,7 +459,7 @@ def secciones():
                 'seccion': seccion,
                 'numero': section_id,
                 'titulo': titulo,
-                'tiene_nota': nota is not None
+                'tiene_nota': tiene_nota
             })
         
         return render_template('secciones.html', 
@@ -521,6 +478,7 @@ def secciones():
 
 @main_bp.route('/capitulos')
 @login_required
+@cached_page
 def capitulos():
     """Ruta para ver todos los capítulos disponibles en la versión actual de la base de datos."""
     # Obtener las versiones disponibles para el selector
@@ -538,8 +496,8 @@ def capitulos():
             logging.error("No hay contexto de aplicación en ruta capitulos")
             return "Error: No hay contexto de aplicación", 500
         
-        # Usar el método de Arancel para obtener la ruta a la base de datos actual
-        db_path = Arancel._get_arancel_db_path()
+        # Obtener la ruta a la base de datos de la versión actual
+        db_path = resolve_arancel_db_path()
         
         # Obtener versión seleccionada para mostrar en UI
         version_actual = None
@@ -564,63 +522,49 @@ def capitulos():
         else:
             version_formateada = "Última versión" if not version_actual else version_actual
             
-        # Conectar directamente a la base de datos SQLite
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        # Totales precalculados de la versión
+        stats = get_version_stats(db_path)
+        if stats is None:
+            return "Error al leer los capítulos de la versión", 500
         
         # Si se proporciona una sección, filtramos los capítulos por esa sección
+        seccion_nombre = ""
         if seccion:
-            cursor.execute(
-                "SELECT CHAPTER, COUNT(NCM) as count FROM arancel_nacional WHERE SECTION = ? GROUP BY CHAPTER ORDER BY CHAPTER", 
-                (seccion,)
-            )
+            section_no = parse_section_no(seccion)
+            capitulos_stats = stats.chapters_for_section(section_no)
+            # Obtener el nombre de la sección para mostrarlo en la UI
+            for section in stats.sections:
+                if section['section_no'] == section_no:
+                    seccion_nombre = section['SECTION']
         else:
-            cursor.execute(
-                "SELECT CHAPTER, COUNT(NCM) as count FROM arancel_nacional GROUP BY CHAPTER ORDER BY CHAPTER"
-            )
-        
-        rows = cursor.fetchall()
+            capitulos_stats = stats.chapters
+        rows = [(chapter['chapter_no'], chapter['CHAPTER'], chapter['count']) for chapter in capitulos_stats]
         
-        # Si se proporcionó una sección, obtener su nombre para mostrarlo en la UI
-        seccion_nombre = ""
-        if seccion:
-            cursor.execute("SELECT DISTINCT SECTION FROM arancel_nacional WHERE SECTION = ? LIMIT 1", (seccion,))
-            seccion_row = cursor.fetchone()
-            if seccion_row:
-                seccion_nombre = seccion_row['SECTION']
-                
-        conn.close()
+        # Capítulos con nota (todas las notas de la versión se leen una sola vez)
+        notes = get_version_notes(db_path)
+        capitulos_con_nota = notes.chapters_with_notes if notes is not None else set()
         
-        # Procesar los resultados para extraer el número de capítulo
+        # Armar la lista de capítulos con su número
         capitulos_list = []
-        for row in rows:
-            capitulo = row['CHAPTER']
-            count = row['count']
-            
-            if capitulo:
-                match = re.match(r'^(\d+)', capitulo)
-                if match:
-                    numero = int(match.group(1))
-                    
-                    # Verificar si hay notas para este capítulo
-                    numero_str = f"{numero:02d}"
-                    nota = ChapterNote.get_note_by_chapter(numero_str)
-                    
-                    # Extraer título
-                    titulo = capitulo
-                    if " - " in capitulo:
-                        titulo = capitulo.split(" - ", 1)[1]
-                    
-                    # Añadir a la lista como un diccionario
-                    capitulos_list.append({
-                        'numero': numero,
-                        'numero_str': numero_str,
-                        'titulo': titulo,
-                        'capitulo': capitulo,
-                        'count': count,
-                        'tiene_nota': nota is not None
-                    })
+        for numero, capitulo, count in rows:
+            if capitulo and numero:
+                # Verificar si hay notas para este capítulo
+                numero_str = f"{numero:02d}"
+                
+                # Extraer título
+                titulo = capitulo
+                if " - " in capitulo:
+                    titulo = capitulo.split(" - ", 1)[1]
+                
+                # Añadir a la lista como un diccionario
+                capitulos_list.append({
+                    'numero': numero,
+                    'numero_str': numero_str,
+                    'titulo': titulo,
+                    'capitulo': capitulo,
+                    'count': count,
+                    'tiene_nota': numero_str in capitulos_con_nota
+                })
         
         logging.info(f"Se encontraron {len(capitulos_list)} capítulos para la sección {seccion if seccion else 'todas'}")
         
@@ -673,3 +617,14 @@ def reset_version():
         
     flash('Se ha restablecido la versión del arancel a la más reciente.', 'success')
     return redirect(url_for('main.index'))
+
+@main_bp.route('/metrics')
+@login_required
+def metrics():
+    """Métricas de latencia y de tiempo en SQLite en formato Prometheus. Solo para administradores."""
+    from ..metrics import registry
+    
+    if current_user.role != 'admin':
+        abort(403)
+    
+    return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
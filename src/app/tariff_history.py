@@ -0,0 +1,264 @@
+"""
+Índice temporal con la vigencia de cada NCM a través de todas las versiones.
+
+Cada versión AAAAMM rige desde el primer día de su mes hasta la publicación
+de la siguiente. El índice guarda, para cada NCM, intervalos
+[vigente_desde, vigente_hasta) en los que su contenido no cambió, de modo que
+la tarifa vigente en cualquier fecha se obtiene con una sola consulta sobre la
+clave primaria (ncm_key, valid_from). Se construye en un archivo aparte al
+publicar una versión, agregando solo las versiones nuevas.
+"""
+import datetime
+import logging
+import os
+import sqlite3
+from contextlib import closing
+
+from .db_pool import get_connection
+from .db_schema import ARANCEL_COLUMNS, CONTENT_HASH_KEY, canonical_ncm, table_exists
+from .version_store import version_file
+
+# Archivo del índice temporal dentro del directorio de versiones (no debe
+# coincidir con el patrón arancel_*.sqlite3 de las versiones)
+HISTORY_DB_NAME = 'historial_arancel.sqlite3'
+
+# Intervalos de vigencia de cada NCM
+HISTORY_TABLE = 'ncm_vigencia'
+
+# Versiones incorporadas al índice, con el hash de su contenido
+HISTORY_VERSIONS_TABLE = 'vigencia_versiones'
+
+_COLUMNS_SQL = ', '.join(f'"{column}"' for column in ARANCEL_COLUMNS)
+
+
+def version_start_date(version):
+    """Fecha desde la que rige una versión: 202502 -> '2025-02-01'."""
+    return f"{version[:4]}-{version[4:6]}-01"
+
+
+def parse_as_of(value):
+    """
+    Valida una fecha de consulta.
+
+    Args:
+        value (str|datetime.date): Fecha en formato AAAA-MM-DD
+
+    Returns:
+        str: Fecha en formato AAAA-MM-DD
+
+    Raises:
+        ValueError: Si la fecha no es válida
+    """
+    if isinstance(value, datetime.date):
+        return value.strftime('%Y-%m-%d')
+    try:
+        return datetime.date.fromisoformat(str(value).strip()).isoformat()
+    except ValueError:
+        raise ValueError(f'Fecha inválida: {value}. Use el formato AAAA-MM-DD')
+
+
+def ensure_history_schema(conn):
+    """Crea las tablas del índice temporal si no existen."""
+    columns = ', '.join(f'"{column}" TEXT' for column in ARANCEL_COLUMNS)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {HISTORY_TABLE} (
+            ncm_key TEXT NOT NULL,
+            valid_from TEXT NOT NULL,
+            valid_to TEXT,
+            version TEXT NOT NULL,
+            {columns},
+            PRIMARY KEY (ncm_key, valid_from)
+        ) WITHOUT ROWID
+    ''')
+    # Intervalos abiertos (vigentes en la última versión incorporada)
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_{HISTORY_TABLE}_open ON {HISTORY_TABLE}(ncm_key) "
+        f"WHERE valid_to IS NULL"
+    )
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {HISTORY_VERSIONS_TABLE} (
+            version TEXT PRIMARY KEY,
+            content_hash TEXT
+        )
+    ''')
+
+
+def _content_hash(db_path):
+    """Hash de contenido guardado en db_metadata de una versión (o None)."""
+    with closing(sqlite3.connect(db_path)) as conn:
+        if not table_exists(conn, 'db_metadata'):
+            return None
+        row = conn.execute("SELECT value FROM db_metadata WHERE key = ?", (CONTENT_HASH_KEY,)).fetchone()
+    return row[0] if row else None
+
+
+def _apply_version(conn, version, db_path):
+    """
+    Incorpora una versión, más reciente que todas las ya incorporadas.
+
+    Cierra los intervalos de los NCM que cambiaron o desaparecieron y abre
+    intervalos nuevos para los NCM nuevos o modificados.
+    """
+    start = version_start_date(version)
+    conn.execute("ATTACH DATABASE ? AS nueva", (str(db_path),))
+    try:
+        conn.execute("DROP TABLE IF EXISTS temp.entrantes")
+        conn.execute(f'''
+            CREATE TEMP TABLE entrantes (
+                ncm_key TEXT PRIMARY KEY,
+                {', '.join(f'"{column}"' for column in ARANCEL_COLUMNS)}
+            )
+        ''')
+        # Ante NCM repetidos se conserva la primera aparición, igual que la instantánea
+        conn.execute(f'''
+            INSERT OR IGNORE INTO temp.entrantes
+            SELECT canonical_ncm(NCM), {_COLUMNS_SQL} FROM nueva.arancel_nacional ORDER BY rowid
+        ''')
+
+        unchanged = ' AND '.join(f'e."{column}" IS h."{column}"' for column in ARANCEL_COLUMNS)
+        closed = conn.execute(f'''
+            UPDATE {HISTORY_TABLE} AS h SET valid_to = ?
+            WHERE valid_to IS NULL AND NOT EXISTS (
+                SELECT 1 FROM temp.entrantes e WHERE e.ncm_key = h.ncm_key AND {unchanged}
+            )
+        ''', (start,)).rowcount
+        opened = conn.execute(f'''
+            INSERT INTO {HISTORY_TABLE} (ncm_key, valid_from, valid_to, version, {_COLUMNS_SQL})
+            SELECT e.ncm_key, ?, NULL, ?, {', '.join(f'e."{column}"' for column in ARANCEL_COLUMNS)}
+            FROM temp.entrantes e
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {HISTORY_TABLE} h WHERE h.ncm_key = e.ncm_key AND h.valid_to IS NULL
+            )
+        ''', (start, version)).rowcount
+        conn.execute("DROP TABLE temp.entrantes")
+        conn.execute(
+            f"INSERT OR REPLACE INTO {HISTORY_VERSIONS_TABLE} (version, content_hash) VALUES (?, ?)",
+            (version, _content_hash(db_path))
+        )
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("DETACH DATABASE nueva")
+    logging.info(f"Versión {version} incorporada al índice temporal: {closed} cerrados, {opened} nuevos")
+
+
+def _connect_history(history_path):
+    conn = sqlite3.connect(history_path)
+    conn.create_function('canonical_ncm', 1, canonical_ncm, deterministic=True)
+    ensure_history_schema(conn)
+    return conn
+
+
+def _apply_versions(conn, versions, pending, store_path):
+    for version in pending:
+        with version_file(version, versions[version], store_path) as db_path:
+            _apply_version(conn, version, db_path)
+
+
+def build_history(history_path, versions, rebuild=False, store_path=None):
+    """
+    Actualiza el índice temporal con las versiones disponibles.
+
+    Si las versiones nuevas son posteriores a todas las ya incorporadas solo
+    se agregan esas; si se eliminó, insertó o republicó una versión
+    intermedia, el índice se reconstruye desde cero. La reconstrucción se
+    hace en otro archivo que reemplaza al índice con un rename, de modo que
+    las consultas en curso nunca ven un índice vacío o a medio construir.
+
+    Args:
+        history_path (str): Ruta del archivo del índice temporal
+        versions (dict): Versión AAAAMM -> ruta de su base de datos
+        rebuild (bool): Reconstruir aunque no haya cambios
+        store_path (str): Almacén consolidado del que se leen las versiones
+            sin archivo (opcional)
+
+    Returns:
+        int: Cantidad de versiones incorporadas
+    """
+    ordered = sorted(versions)
+    with closing(_connect_history(history_path)) as conn:
+        applied = dict(conn.execute(
+            f"SELECT version, content_hash FROM {HISTORY_VERSIONS_TABLE} ORDER BY version"
+        ).fetchall())
+
+        pending = [version for version in ordered if version not in applied]
+        # Las versiones guardadas solo en el almacén consolidado no tienen
+        # archivo: se confía en el hash registrado al incorporarlas
+        consistent = (
+            all(version in versions for version in applied)
+            and all(_content_hash(versions[version]) == applied[version]
+                    for version in applied if os.path.exists(versions[version]))
+            and (not applied or not pending or min(pending) > max(applied))
+        )
+        if not rebuild and consistent:
+            _apply_versions(conn, versions, pending, store_path)
+            return len(pending)
+
+    logging.info("Reconstruyendo el índice temporal de vigencias")
+    tmp_path = f"{history_path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        with closing(_connect_history(tmp_path)) as conn:
+            _apply_versions(conn, versions, ordered, store_path)
+        os.replace(tmp_path, history_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(ordered)
+
+
+def get_history_path():
+    """Ruta del índice temporal dentro del directorio de versiones."""
+    from .db_utils import DB_VERSIONS_DIR
+    return os.path.join(str(DB_VERSIONS_DIR), HISTORY_DB_NAME)
+
+
+def get_history_connection():
+    """
+    Conexión del hilo actual al índice temporal.
+
+    Returns:
+        sqlite3.Connection: Conexión, o None si el índice no fue construido
+    """
+    history_path = get_history_path()
+    if not os.path.exists(history_path):
+        logging.warning(f"El índice temporal {history_path} no existe")
+        return None
+    # El índice se actualiza en el lugar al publicar: no es inmutable
+    conn = get_connection(history_path, immutable=False)
+    if not table_exists(conn, HISTORY_TABLE):
+        return None
+    return conn
+
+
+def lookup(conn, ncm, as_of):
+    """
+    Tarifa de un NCM vigente en una fecha.
+
+    Args:
+        conn (sqlite3.Connection): Conexión al índice temporal
+        ncm (str): Código NCM con o sin puntos
+        as_of (str): Fecha en formato AAAA-MM-DD
+
+    Returns:
+        dict: Columnas del arancel más version, vigente_desde y vigente_hasta,
+        o None si el NCM no estaba vigente en esa fecha
+    """
+    row = conn.execute(f'''
+        SELECT {_COLUMNS_SQL}, version, valid_from, valid_to FROM {HISTORY_TABLE}
+        WHERE ncm_key = ? AND valid_from <= ?
+        ORDER BY valid_from DESC LIMIT 1
+    ''', (canonical_ncm(ncm), as_of)).fetchone()
+    if row is None:
+        return None
+    values = tuple(row)
+    valid_to = values[-1]
+    if valid_to is not None and valid_to <= as_of:
+        return None
+    record = dict(zip(ARANCEL_COLUMNS, values))
+    record.update(version=values[-3], vigente_desde=values[-2], vigente_hasta=valid_to)
+    return record
@@ -0,0 +1,183 @@
+"""
+Instantáneas en memoria de la tabla arancel_nacional por versión.
+
+Una versión publicada no cambia, así que cada base de datos se lee completa
+una sola vez y las búsquedas exactas por NCM se resuelven con un índice hash
+sobre el código canónico (solo dígitos), sin acceso a disco. Cuando el
+catálogo de versiones cambia, las instantáneas cuyo archivo fue reemplazado
+se descartan y se reconstruyen en la siguiente consulta.
+"""
+import bisect
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import closing
+
+from .db_pool import pool
+from .db_schema import ARANCEL_COLUMNS, canonical_ncm
+from .version_catalog import catalog, resolve_arancel_db_path
+
+# Columnas de arancel_nacional, en el orden en que se exponen
+COLUMNS = ARANCEL_COLUMNS
+
+# Nombre de atributo para cada columna (E/Z e I/Z no son identificadores válidos)
+_ATTRS = tuple(column.replace('/', '_') for column in COLUMNS)
+
+
+class TariffRecord:
+    """Fila inmutable de arancel_nacional."""
+
+    __slots__ = _ATTRS
+
+    def __init__(self, values):
+        for attr, value in zip(_ATTRS, values):
+            setattr(self, attr, value)
+
+    def keys(self):
+        """Nombres de columna, para usar el registro como una fila de sqlite3."""
+        return COLUMNS
+
+    def __getitem__(self, column):
+        return getattr(self, column.replace('/', '_'))
+
+    def to_dict(self):
+        """Diccionario con los nombres de columna originales."""
+        return {column: getattr(self, attr) for column, attr in zip(COLUMNS, _ATTRS)}
+
+
+class TariffSnapshot:
+    """Contenido completo de una versión con índice por NCM canónico."""
+
+    def __init__(self, db_path, records, signature=None):
+        self.db_path = db_path
+        self.signature = signature
+        self.records = tuple(records)
+        self.index = {}
+        for position, record in enumerate(self.records):
+            # Conservar la primera aparición, igual que un SELECT ... fetchone()
+            self.index.setdefault(canonical_ncm(record.NCM), position)
+        # Claves canónicas ordenadas (con su posición) para buscar por prefijo
+        ordered = sorted(self.index.items())
+        self.sorted_keys = [key for key, _ in ordered]
+        self._sorted_positions = [position for _, position in ordered]
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, ncm):
+        """
+        Busca un NCM exacto (con o sin puntos).
+
+        Returns:
+            TariffRecord: Registro encontrado o None
+        """
+        position = self.index.get(canonical_ncm(ncm))
+        if position is None:
+            return None
+        return self.records[position]
+
+    def prefix_search(self, prefix, limit=10):
+        """
+        Registros cuyo NCM canónico empieza con ``prefix``, en orden de código.
+
+        Args:
+            prefix (str): Código parcial (con o sin puntos)
+            limit (int): Cantidad máxima de registros
+
+        Returns:
+            list: Lista de TariffRecord
+        """
+        key = canonical_ncm(prefix)
+        if not key:
+            return []
+        start = bisect.bisect_left(self.sorted_keys, key)
+        records = []
+        for i in range(start, min(start + limit, len(self.sorted_keys))):
+            if not self.sorted_keys[i].startswith(key):
+                break
+            records.append(self.records[self._sorted_positions[i]])
+        return records
+
+    @classmethod
+    def load(cls, db_path):
+        """Lee la tabla arancel_nacional completa de una base de datos."""
+        signature = _file_signature(db_path)
+        columns = ', '.join(f'"{column}"' for column in COLUMNS)
+        # Conexión propia para leer siempre el archivo actual de la ruta
+        with closing(pool.connect(db_path)) as conn:
+            rows = conn.execute(f"SELECT {columns} FROM arancel_nacional").fetchall()
+        snapshot = cls(db_path, (TariffRecord(tuple(row)) for row in rows), signature)
+        logging.info(f"Instantánea de {db_path} cargada con {len(snapshot)} registros")
+        return snapshot
+
+
+def _file_signature(db_path):
+    try:
+        stat = os.stat(db_path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class SnapshotRegistry:
+    """Instantáneas cargadas, una por archivo de base de datos."""
+
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def get(self, db_path):
+        """
+        Devuelve la instantánea de una base de datos, cargándola si hace falta.
+
+        Solo un hilo carga cada archivo; el resto espera su resultado.
+        """
+        snapshot = self._snapshots.get(db_path)
+        if snapshot is not None:
+            return snapshot
+
+        with self._lock:
+            load_lock = self._loading.setdefault(db_path, threading.Lock())
+        with load_lock:
+            snapshot = self._snapshots.get(db_path)
+            if snapshot is None:
+                snapshot = TariffSnapshot.load(db_path)
+                snapshots = dict(self._snapshots)
+                snapshots[db_path] = snapshot
+                self._snapshots = snapshots
+        return snapshot
+
+    def invalidate(self):
+        """Descarta las instantáneas cuyo archivo cambió o ya no existe."""
+        snapshots = {
+            path: snapshot
+            for path, snapshot in self._snapshots.items()
+            if snapshot.signature is not None and _file_signature(path) == snapshot.signature
+        }
+        dropped = len(self._snapshots) - len(snapshots)
+        # Reemplazo atómico: los lectores ven el diccionario anterior o el nuevo
+        self._snapshots = snapshots
+        if dropped:
+            logging.info(f"Descartadas {dropped} instantáneas de arancel")
+
+
+registry = SnapshotRegistry()
+catalog.on_invalidate(registry.invalidate)
+
+
+def get_snapshot(db_path=None):
+    """
+    Instantánea de la versión seleccionada (o de ``db_path``).
+
+    Returns:
+        TariffSnapshot: Instantánea, o None si la base de datos no se pudo leer
+    """
+    if db_path is None:
+        db_path = resolve_arancel_db_path()
+    try:
+        return registry.get(str(db_path))
+    except sqlite3.Error as e:
+        logging.error(f"No se pudo cargar la instantánea de {db_path}: {str(e)}")
+        return None
@@ -0,0 +1,311 @@
+"""
+Catálogo en memoria de las bases de datos versionadas del arancel.
+
+Reemplaza la resolución de rutas que cada modelo hacía por su cuenta: el
+catálogo escanea ``data/db_versions/arancel_*.sqlite3`` una sola vez, vuelve a
+escanear solo cuando cambia la fecha de modificación del directorio (o cuando
+se llama a ``invalidate`` al publicar una versión) y resuelve la versión
+seleccionada una única vez por solicitud.
+"""
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, session
+
+from .db_utils import DB_VERSIONS_DIR, LATEST_SYMLINK, ORIGINAL_DB_PATH
+
+# Segundos mínimos entre dos comprobaciones del directorio de versiones
+CHECK_INTERVAL = 1.0
+
+_VERSION_FILE_RE = re.compile(r'^arancel_(\w+)\.sqlite3$')
+
+# Abreviaturas de los meses para el selector de versiones
+MONTH_ABBREVIATIONS = {
+    "01": "Ene", "02": "Feb", "03": "Mar", "04": "Abr",
+    "05": "May", "06": "Jun", "07": "Jul", "08": "Ago",
+    "09": "Sep", "10": "Oct", "11": "Nov", "12": "Dic"
+}
+
+
+def format_version(version):
+    """Formato legible de una versión: 202502 -> Feb 2025."""
+    if len(version) == 6 and version.isdigit():  # formato AAAAMM
+        year = version[0:4]
+        month = version[4:6]
+        return f"{MONTH_ABBREVIATIONS.get(month, month)} {year}"
+    return version
+
+
+class VersionCatalog:
+    """Catálogo de versiones disponibles y de sus rutas de base de datos."""
+
+    def __init__(self, versions_dir, latest_symlink, check_interval=CHECK_INTERVAL):
+        self.versions_dir = str(versions_dir)
+        self.latest_symlink = str(latest_symlink)
+        self.check_interval = check_interval
+        # Se incrementa cada vez que cambia el contenido del catálogo
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._versions = []
+        self._dated_versions = []
+        self._latest_path = None
+        self._formatted = ([], "Actual")
+        self._dir_mtime = None
+        self._checked_at = 0.0
+        self._callbacks = []
+
+    def on_invalidate(self, callback):
+        """
+        Registra una función que se ejecuta cada vez que el catálogo cambia.
+
+        Args:
+            callback (callable): Función sin argumentos
+        """
+        self._callbacks.append(callback)
+        return callback
+
+    def _dir_signature(self):
+        try:
+            return os.stat(self.versions_dir).st_mtime_ns
+        except OSError:
+            return None
+
+    def _scan(self):
+        paths = {}
+        if os.path.isdir(self.versions_dir):
+            for filename in os.listdir(self.versions_dir):
+                match = _VERSION_FILE_RE.match(filename)
+                if not match:
+                    continue
+                path = os.path.join(self.versions_dir, filename)
+                # No incluir el enlace simbólico "latest"
+                if filename == os.path.basename(self.latest_symlink) and os.path.islink(path):
+                    continue
+                paths[match.group(1)] = path
+        else:
+            logging.warning(f"El directorio {self.versions_dir} no existe")
+
+        latest_path = None
+        if os.path.exists(self.latest_symlink):
+            latest_path = os.path.realpath(self.latest_symlink)
+
+        versions = sorted(paths, reverse=True)
+        # Datos del selector de versiones, calculados una vez por escaneo
+        versions_data = [
+            {
+                'code': version,
+                'formatted': format_version(version),
+                'is_latest': version == versions[0]  # La primera versión es la más reciente
+            }
+            for version in versions
+        ]
+        latest_formatted = versions_data[0]['formatted'] if versions_data else "Actual"
+
+        self._paths = paths
+        self._versions = versions
+        # Solo versiones con archivo: las que están únicamente en el almacén no se sirven
+        self._dated_versions = sorted(v for v in versions if len(v) == 6 and v.isdigit())
+        self._latest_path = latest_path
+        self._formatted = (versions_data, latest_formatted)
+        self.generation += 1
+        logging.info(f"Catálogo de versiones cargado: {len(paths)} versiones (generación {self.generation})")
+
+    def refresh(self, force=False):
+        """
+        Vuelve a escanear el directorio si cambió su fecha de modificación.
+
+        Args:
+            force (bool): Escanear aunque el directorio no haya cambiado
+
+        Returns:
+            bool: True si el catálogo cambió
+        """
+        now = time.monotonic()
+        if not force and self._dir_mtime is not None and now - self._checked_at < self.check_interval:
+            return False
+
+        with self._lock:
+            self._checked_at = now
+            signature = self._dir_signature()
+            if not force and signature == self._dir_mtime and self.generation:
+                return False
+            self._dir_mtime = signature
+            self._scan()
+
+        for callback in self._callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Error al invalidar caché de versiones: {str(e)}")
+        return True
+
+    def invalidate(self):
+        """Fuerza la recarga del catálogo (gancho para la publicación de versiones)."""
+        return self.refresh(force=True)
+
+    def versions(self):
+        """Lista de versiones disponibles, de la más reciente a la más antigua."""
+        self.refresh()
+        return list(self._versions)
+
+    def formatted_versions(self):
+        """
+        Versiones formateadas para el selector.
+
+        La lista se calcula al escanear el directorio y se comparte entre
+        solicitudes, por lo que no debe modificarse.
+
+        Returns:
+            tuple: (lista de diccionarios con code/formatted/is_latest,
+                    versión más reciente formateada)
+        """
+        self.refresh()
+        return self._formatted
+
+    def get_path(self, version):
+        """Ruta de la base de datos de una versión, o None si no existe."""
+        self.refresh()
+        return self._paths.get(version)
+
+    def version_for_date(self, date):
+        """
+        Versión vigente en una fecha: la más reciente publicada hasta ese mes.
+
+        Args:
+            date (str): Fecha en formato AAAA-MM-DD
+
+        Returns:
+            str: Versión en formato AAAAMM, o None si la fecha es anterior a
+            todas las versiones
+        """
+        self.refresh()
+        # Versiones AAAAMM en orden ascendente (solo las de formato fecha)
+        ascending = self._dated_versions
+        position = bisect.bisect_right(ascending, date[:4] + date[5:7])
+        return ascending[position - 1] if position else None
+
+    @property
+    def latest_path(self):
+        """Ruta real del archivo al que apunta el enlace ``latest``."""
+        self.refresh()
+        return self._latest_path
+
+
+catalog = VersionCatalog(DB_VERSIONS_DIR, LATEST_SYMLINK)
+
+
+class VersionCache:
+    """
+    Valores calculados una vez por archivo de base de datos.
+
+    Se descartan todos cuando cambia el catálogo de versiones.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self._values = {}
+        self._lock = threading.Lock()
+        catalog.on_invalidate(self.clear)
+
+    def get(self, db_path):
+        """Devuelve el valor de una base de datos, calculándolo si hace falta."""
+        db_path = str(db_path)
+        value = self._values.get(db_path)
+        if value is not None:
+            return value
+
+        with self._lock:
+            value = self._values.get(db_path)
+            if value is None:
+                value = self.loader(db_path)
+                values = dict(self._values)
+                values[db_path] = value
+                self._values = values
+        return value
+
+    def clear(self):
+        """Descarta todos los valores calculados."""
+        self._values = {}
+
+
+def _configured_db_path():
+    """Ruta de ARANCEL_DATABASE_URI si está configurada y existe."""
+    if not has_app_context():
+        return None
+    uri = current_app.config.get('ARANCEL_DATABASE_URI')
+    if not uri:
+        return None
+    cache = current_app.extensions.setdefault('arancel_configured_db', {})
+    if uri not in cache:
+        db_path = uri.replace('sqlite:///', '')
+        cache[uri] = db_path if os.path.exists(db_path) else None
+    return cache[uri]
+
+
+def get_selected_version():
+    """Versión seleccionada en la solicitud actual (URL o sesión), o None."""
+    if has_app_context() and getattr(g, 'version', None):
+        return g.version
+    if has_request_context():
+        return session.get('arancel_version')
+    return None
+
+
+def resolve_db_path(version=None):
+    """
+    Resuelve la ruta de base de datos para una versión.
+
+    Orden de búsqueda: versión solicitada, ARANCEL_DATABASE_URI, enlace
+    ``latest`` y finalmente la base de datos clásica.
+
+    Args:
+        version (str): Versión en formato AAAAMM o None para la más reciente
+
+    Returns:
+        str: Ruta al archivo de base de datos
+    """
+    if version:
+        path = catalog.get_path(version)
+        if path:
+            return path
+        logging.warning(f"Base de datos para versión {version} no encontrada")
+
+    configured = _configured_db_path()
+    if configured:
+        return configured
+
+    if catalog.latest_path:
+        return catalog.latest_path
+
+    # Como última opción, usar la ruta clásica
+    return str(ORIGINAL_DB_PATH)
+
+
+def resolve_arancel_db_path():
+    """
+    Ruta de la base de datos de aranceles para la versión seleccionada.
+
+    El resultado se guarda en ``g`` y se reutiliza durante toda la solicitud
+    mientras no cambien la versión seleccionada ni el catálogo.
+
+    Returns:
+        str: Ruta al archivo de base de datos
+    """
+    version = get_selected_version()
+    if not has_app_context():
+        return resolve_db_path(version)
+
+    catalog.refresh()
+    key = (version, catalog.generation)
+    cached = g.get('_arancel_db_path')
+    if cached and cached[0] == key:
+        return cached[1]
+
+    path = resolve_db_path(version)
+    g._arancel_db_path = (key, path)
+    return path
@@ -0,0 +1,168 @@
+"""
+Comparación completa entre dos versiones del arancel.
+
+La comparación se hace con SQL sobre ambas bases de datos (la anterior
+adjunta con ATTACH) en una sola pasada por conjuntos: NCM agregados,
+eliminados y, para los modificados, un registro por cada campo que cambió.
+El resultado se guarda en la tabla version_diff de la versión más nueva al
+publicarla, y la API lo lee desde allí.
+"""
+import datetime
+import logging
+
+from .db_schema import table_exists
+
+# Tabla con las diferencias respecto de versiones anteriores
+DIFF_TABLE = 'version_diff'
+
+# Campos que se comparan entre versiones
+DIFF_FIELDS = ('DESCRIPCION', 'AEC', 'CL', 'E/Z', 'I/Z', 'UVF')
+
+# Alias con el que se adjunta la base de datos de la versión anterior
+PREVIOUS_ALIAS = 'prev'
+
+
+def _metadata_key(from_version):
+    return f'{DIFF_TABLE}:{from_version}'
+
+
+def diff_query():
+    """
+    Consulta que compara main.arancel_nacional con prev.arancel_nacional.
+
+    Returns:
+        str: SQL que devuelve (ncm, change, field, old_value, new_value)
+    """
+    columns = ', '.join(
+        f'p."{field}" AS old_{i}, n."{field}" AS new_{i}' for i, field in enumerate(DIFF_FIELDS)
+    )
+    differs = ' OR '.join(f'n."{field}" IS NOT p."{field}"' for field in DIFF_FIELDS)
+    modified = '\nUNION ALL\n'.join(
+        f"SELECT ncm, 'modified', '{field}', old_{i}, new_{i} FROM cambios WHERE old_{i} IS NOT new_{i}"
+        for i, field in enumerate(DIFF_FIELDS)
+    )
+    return f'''
+        WITH cambios AS MATERIALIZED (
+            SELECT n.NCM AS ncm, {columns}
+            FROM main.arancel_nacional n
+            JOIN {PREVIOUS_ALIAS}.arancel_nacional p ON p.NCM = n.NCM
+            WHERE {differs}
+        )
+        SELECT n.NCM, 'added', NULL, NULL, NULL FROM main.arancel_nacional n
+        WHERE NOT EXISTS (SELECT 1 FROM {PREVIOUS_ALIAS}.arancel_nacional p WHERE p.NCM = n.NCM)
+        UNION ALL
+        SELECT p.NCM, 'removed', NULL, NULL, NULL FROM {PREVIOUS_ALIAS}.arancel_nacional p
+        WHERE NOT EXISTS (SELECT 1 FROM main.arancel_nacional n WHERE n.NCM = p.NCM)
+        UNION ALL
+        {modified}
+    '''
+
+
+def attach_previous(conn, previous_db_path):
+    """Adjunta la base de datos de la versión anterior."""
+    conn.execute(f"ATTACH DATABASE ? AS {PREVIOUS_ALIAS}", (str(previous_db_path),))
+
+
+def compute_diff(conn):
+    """
+    Compara la base de datos de ``conn`` con la versión adjunta.
+
+    Returns:
+        list: Tuplas (ncm, change, field, old_value, new_value)
+    """
+    return [tuple(row) for row in conn.execute(diff_query())]
+
+
+def store_diff(conn, from_version):
+    """
+    Calcula y guarda en version_diff las diferencias con la versión adjunta.
+
+    Args:
+        conn (sqlite3.Connection): Conexión de escritura a la versión nueva,
+            con la versión anterior adjunta
+        from_version (str): Versión anterior en formato AAAAMM
+
+    Returns:
+        int: Cantidad de registros de diferencias guardados
+    """
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {DIFF_TABLE} (
+            from_version TEXT NOT NULL,
+            ncm TEXT NOT NULL,
+            change TEXT NOT NULL,
+            field TEXT,
+            old_value TEXT,
+            new_value TEXT
+        )
+    ''')
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_{DIFF_TABLE}_from ON {DIFF_TABLE}(from_version, ncm)"
+    )
+    conn.execute(f"DELETE FROM {DIFF_TABLE} WHERE from_version = ?", (from_version,))
+    count = conn.execute(f'''
+        INSERT INTO {DIFF_TABLE} (from_version, ncm, change, field, old_value, new_value)
+        SELECT ?, * FROM ({diff_query()})
+    ''', (from_version,)).rowcount
+
+    # Marca de que la comparación existe (aunque no haya diferencias)
+    conn.execute("CREATE TABLE IF NOT EXISTS db_metadata (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute(
+        "INSERT OR REPLACE INTO db_metadata (key, value) VALUES (?, ?)",
+        (_metadata_key(from_version), datetime.datetime.now().isoformat())
+    )
+    logging.info(f"Diferencias con la versión {from_version} guardadas: {count} registros")
+    return count
+
+
+def load_diff(conn, from_version):
+    """
+    Lee las diferencias guardadas respecto de una versión anterior.
+
+    Returns:
+        list: Tuplas (ncm, change, field, old_value, new_value), o None si
+        la comparación no fue calculada
+    """
+    if not table_exists(conn, 'db_metadata') or not table_exists(conn, DIFF_TABLE):
+        return None
+    stored = conn.execute(
+        "SELECT 1 FROM db_metadata WHERE key = ?", (_metadata_key(from_version),)
+    ).fetchone()
+    if not stored:
+        return None
+    rows = conn.execute(
+        f"SELECT ncm, change, field, old_value, new_value FROM {DIFF_TABLE} "
+        f"WHERE from_version = ? ORDER BY ncm, rowid",
+        (from_version,)
+    )
+    return [tuple(row) for row in rows]
+
+
+def summarize_diff(rows):
+    """
+    Agrupa las diferencias por tipo de cambio.
+
+    Returns:
+        dict: Resumen, NCM agregados, eliminados y campos modificados por NCM
+    """
+    agregados = []
+    eliminados = []
+    modificados = {}
+    for ncm, change, field, old_value, new_value in rows:
+        if change == 'added':
+            agregados.append(ncm)
+        elif change == 'removed':
+            eliminados.append(ncm)
+        else:
+            modificados.setdefault(ncm, {})[field] = {'antes': old_value, 'despues': new_value}
+    agregados.sort()
+    eliminados.sort()
+    return {
+        'resumen': {
+            'agregados': len(agregados),
+            'eliminados': len(eliminados),
+            'modificados': len(modificados),
+        },
+        'agregados': agregados,
+        'eliminados': eliminados,
+        'modificados': dict(sorted(modificados.items())),
+    }
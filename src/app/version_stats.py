@@ -0,0 +1,134 @@
+"""
+Totales por versión para la página de inicio y el listado de capítulos.
+
+Los totales se leen de la tabla version_stats que el cargador calcula una
+sola vez por versión, y se guardan en memoria hasta que cambia el catálogo
+de versiones. Si una base de datos todavía no tiene la tabla (versión sin
+migrar), los totales se calculan una vez por versión a partir del texto de
+SECTION/CHAPTER y del NCM, sin depender de las columnas numéricas.
+"""
+import logging
+import sqlite3
+
+from .db_pool import get_connection
+from .db_schema import STATS_TABLE, canonical_ncm, parse_chapter_no, parse_section_no
+from .version_catalog import VersionCache, resolve_arancel_db_path
+
+
+class VersionStats:
+    """Totales de registros de una versión, por sección y por capítulo."""
+
+    def __init__(self, total, sections, chapters):
+        self.total = total
+        # Listas de diccionarios ordenadas por número de sección / capítulo
+        self.sections = sections
+        self.chapters = chapters
+
+    @property
+    def total_secciones(self):
+        return len(self.sections)
+
+    @property
+    def total_capitulos(self):
+        return len(self.chapters)
+
+    def chapters_for_section(self, section_no):
+        """Capítulos que pertenecen a una sección."""
+        return [chapter for chapter in self.chapters if chapter['section_no'] == section_no]
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Arma los totales a partir de filas (scope, number, label, section_no, count)."""
+        total = 0
+        sections = []
+        chapters = []
+        for row in rows:
+            scope, number, label, section_no, count = tuple(row)
+            if scope == 'total':
+                total = count
+            elif scope == 'section':
+                sections.append({'section_no': number, 'SECTION': label, 'count': count})
+            elif scope == 'chapter':
+                chapters.append({'chapter_no': number, 'CHAPTER': label, 'section_no': section_no, 'count': count})
+        sections.sort(key=lambda section: section['section_no'])
+        chapters.sort(key=lambda chapter: chapter['chapter_no'])
+        return cls(total, sections, chapters)
+
+    @classmethod
+    def load(cls, db_path):
+        """Lee los totales de una base de datos."""
+        conn = get_connection(db_path)
+        try:
+            rows = conn.execute(
+                f"SELECT scope, number, label, section_no, count FROM {STATS_TABLE}"
+            ).fetchall()
+            if rows:
+                return cls.from_rows(rows)
+        except sqlite3.OperationalError:
+            pass
+
+        # Versión sin tabla de totales: calcularlos sobre arancel_nacional
+        logging.warning(f"{db_path} no tiene tabla {STATS_TABLE}, calculando totales")
+        return cls.from_rows(_aggregate_rows(
+            conn.execute("SELECT SECTION, CHAPTER, NCM FROM arancel_nacional")
+        ))
+
+
+def _min_label(current, label):
+    if current is None:
+        return label
+    return current if label is None else min(current, label)
+
+
+def _aggregate_rows(rows):
+    """
+    Totales (scope, number, label, section_no, count) a partir del texto.
+
+    Sigue los mismos criterios que ensure_classification_columns: la sección
+    sale del número romano de SECTION y el capítulo de los dos primeros
+    dígitos del NCM (o del texto de CHAPTER si el NCM no los tiene).
+    """
+    total = 0
+    sections = {}
+    chapters = {}
+    for section, chapter, ncm in rows:
+        total += 1
+        section_no = parse_section_no(section)
+        key = canonical_ncm(ncm)
+        chapter_no = int(key[:2]) if len(key) >= 2 else parse_chapter_no(chapter)
+        if section_no is not None:
+            entry = sections.setdefault(section_no, [None, 0])
+            entry[0] = _min_label(entry[0], section)
+            entry[1] += 1
+        if chapter_no is not None:
+            entry = chapters.setdefault(chapter_no, [None, None, 0])
+            entry[0] = _min_label(entry[0], chapter)
+            entry[1] = _min_label(entry[1], section_no)
+            entry[2] += 1
+
+    result = [('total', 0, None, None, total)]
+    result.extend(('section', number, label, number, count) for number, (label, count) in sections.items())
+    result.extend(
+        ('chapter', number, label, section_no, count)
+        for number, (label, section_no, count) in chapters.items()
+    )
+    return result
+
+
+_cache = VersionCache(VersionStats.load)
+
+
+def get_version_stats(db_path=None):
+    """
+    Totales de la versión seleccionada (o de ``db_path``).
+
+    Returns:
+        VersionStats: Totales, o None si la base de datos no se pudo leer
+    """
+    if db_path is None:
+        db_path = resolve_arancel_db_path()
+    try:
+        return _cache.get(db_path)
+    except sqlite3.Error as e:
+        logging.error(f"No se pudieron leer los totales de {db_path}: {str(e)}")
+        return None
@@ -0,0 +1,318 @@
+"""
+Almacén consolidado de todas las versiones del arancel.
+
+La mayoría de las filas y notas no cambian de una versión a otra, así que el
+almacén guarda cada fila de arancel_nacional y cada texto de nota una sola
+vez, identificados por el hash de su contenido, y para cada versión solo la
+lista de hashes que la componen.
+
+El almacén es solo una copia de respaldo: la aplicación sirve siempre las
+versiones desde sus archivos ``arancel_AAAAMM.sqlite3``, que no se eliminan
+al consolidar. Si falta el archivo de una versión, el gestor de versiones
+puede reconstruirlo desde el almacén, y el índice temporal de vigencias y las
+diferencias entre versiones la leen desde una copia temporal.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+from contextlib import closing, contextmanager
+
+from .db_migrations import stamp_schema_version
+from .db_pool import database_uri
+from .db_schema import (ARANCEL_COLUMNS, ensure_classification_columns, ensure_content_hash,
+                        ensure_fts_index, ensure_ncm_key, ensure_version_stats, table_exists)
+
+# Archivo del almacén dentro del directorio de versiones (no debe coincidir
+# con el patrón arancel_*.sqlite3 de las versiones)
+STORE_DB_NAME = 'almacen_versiones.sqlite3'
+
+# Tablas de notas de cada versión: tipo -> (tabla, columna del número)
+NOTE_TABLES = {
+    'section': ('section_notes', 'section_number'),
+    'chapter': ('chapter_notes', 'chapter_number'),
+}
+
+# Claves de db_metadata que se conservan al reconstruir una versión
+_METADATA_KEYS = ('version', 'created_at', 'updated_at', 'source')
+
+_COLUMNS_SQL = ', '.join(f'"{column}"' for column in ARANCEL_COLUMNS)
+
+
+def content_hash(*values):
+    """Hash de una fila o de un texto (128 bits en hexadecimal)."""
+    digest = hashlib.sha256()
+    for value in values:
+        digest.update(b'\x1f' if value is None else b'\x1e' + str(value).encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+def _connect(store_path):
+    conn = sqlite3.connect(store_path)
+    conn.create_function('content_hash', -1, content_hash, deterministic=True)
+    return conn
+
+
+def ensure_store_schema(conn):
+    """Crea las tablas del almacén si no existen."""
+    columns = ', '.join(f'"{column}" TEXT' for column in ARANCEL_COLUMNS)
+    conn.executescript(f'''
+        CREATE TABLE IF NOT EXISTS store_rows (
+            hash TEXT PRIMARY KEY,
+            {columns}
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS store_notes (
+            hash TEXT PRIMARY KEY,
+            note_text TEXT NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS store_versions (
+            version TEXT PRIMARY KEY,
+            metadata TEXT
+        );
+        CREATE TABLE IF NOT EXISTS version_rows (
+            version TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            row_hash TEXT NOT NULL,
+            PRIMARY KEY (version, position)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS version_notes (
+            version TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            number TEXT NOT NULL,
+            note_hash TEXT NOT NULL,
+            PRIMARY KEY (version, kind, number)
+        ) WITHOUT ROWID;
+    ''')
+
+
+def table_exists_in(conn, schema, table):
+    """Indica si una tabla existe en una base de datos adjunta."""
+    row = conn.execute(
+        f"SELECT 1 FROM {schema}.sqlite_master WHERE type='table' AND name=?", (table,)
+    ).fetchone()
+    return row is not None
+
+
+def add_version(store_path, version, db_path):
+    """
+    Agrega (o reemplaza) una versión en el almacén.
+
+    Args:
+        store_path (str): Ruta del almacén
+        version (str): Versión en formato AAAAMM
+        db_path (str): Base de datos de la versión
+
+    Returns:
+        tuple: (filas de la versión, filas nuevas en el almacén)
+    """
+    with closing(_connect(store_path)) as conn:
+        ensure_store_schema(conn)
+        conn.execute("ATTACH DATABASE ? AS origen", (str(db_path),))
+        try:
+            metadata = {}
+            if table_exists_in(conn, 'origen', 'db_metadata'):
+                metadata = dict(conn.execute(
+                    f"SELECT key, value FROM origen.db_metadata "
+                    f"WHERE key IN ({', '.join('?' * len(_METADATA_KEYS))})", _METADATA_KEYS
+                ).fetchall())
+
+            replaced = conn.execute("DELETE FROM version_rows WHERE version = ?", (version,)).rowcount
+            conn.execute("DELETE FROM version_notes WHERE version = ?", (version,))
+            conn.execute(
+                "INSERT OR REPLACE INTO store_versions (version, metadata) VALUES (?, ?)",
+                (version, json.dumps(metadata))
+            )
+
+            # Hash de cada fila, calculado una sola vez
+            conn.execute("DROP TABLE IF EXISTS temp.filas")
+            conn.execute(f'''
+                CREATE TEMP TABLE filas AS
+                SELECT rowid AS position, content_hash({_COLUMNS_SQL}) AS hash, {_COLUMNS_SQL}
+                FROM origen.arancel_nacional
+            ''')
+            added = conn.execute(f'''
+                INSERT OR IGNORE INTO store_rows (hash, {_COLUMNS_SQL})
+                SELECT hash, {_COLUMNS_SQL} FROM temp.filas
+            ''').rowcount
+            rows = conn.execute(
+                "INSERT INTO version_rows (version, position, row_hash) "
+                "SELECT ?, position, hash FROM temp.filas", (version,)
+            ).rowcount
+            conn.execute("DROP TABLE temp.filas")
+
+            for kind, (table, number_column) in NOTE_TABLES.items():
+                if not table_exists_in(conn, 'origen', table):
+                    continue
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO store_notes (hash, note_text)
+                    SELECT content_hash(note_text), note_text FROM origen.{table}
+                ''')
+                conn.execute(f'''
+                    INSERT INTO version_notes (version, kind, number, note_hash)
+                    SELECT ?, ?, {number_column}, content_hash(note_text) FROM origen.{table}
+                ''', (version, kind))
+
+            if replaced:
+                # Descartar filas y notas que solo usaba la versión reemplazada
+                conn.execute(
+                    "DELETE FROM store_rows WHERE hash NOT IN (SELECT row_hash FROM version_rows)"
+                )
+                conn.execute(
+                    "DELETE FROM store_notes WHERE hash NOT IN (SELECT note_hash FROM version_notes)"
+                )
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute("DETACH DATABASE origen")
+
+    logging.info(f"Versión {version} agregada al almacén: {rows} filas, {added} nuevas")
+    return rows, added
+
+
+def stored_versions(store_path):
+    """
+    Versiones guardadas en el almacén.
+
+    Returns:
+        list: Versiones en formato AAAAMM (vacía si el almacén no existe)
+    """
+    if not os.path.exists(store_path):
+        return []
+    try:
+        # Solo lectura: el catálogo de la aplicación también lo consulta
+        with closing(sqlite3.connect(database_uri(store_path, immutable=False), uri=True)) as conn:
+            if not table_exists(conn, 'store_versions'):
+                return []
+            return [row[0] for row in conn.execute("SELECT version FROM store_versions ORDER BY version")]
+    except sqlite3.Error as e:
+        logging.error(f"No se pudo leer el almacén de versiones {store_path}: {str(e)}")
+        return []
+
+
+def materialize_version(store_path, version, target_path):
+    """
+    Reconstruye la base de datos de una versión a partir del almacén.
+
+    El archivo se escribe con otro nombre y se renombra al terminar, así que
+    los lectores nunca ven una versión a medio construir.
+
+    Args:
+        store_path (str): Ruta del almacén
+        version (str): Versión en formato AAAAMM
+        target_path (str): Ruta de la base de datos a crear
+
+    Returns:
+        int: Cantidad de filas de la versión
+
+    Raises:
+        KeyError: Si la versión no está en el almacén
+    """
+    tmp_path = f"{target_path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    with closing(sqlite3.connect(store_path)) as store:
+        row = store.execute("SELECT metadata FROM store_versions WHERE version = ?", (version,)).fetchone()
+        if row is None:
+            raise KeyError(version)
+        metadata = json.loads(row[0] or '{}')
+
+        try:
+            with closing(sqlite3.connect(tmp_path)) as conn:
+                columns = ', '.join(
+                    f'"{column}" TEXT NOT NULL' if column == 'NCM' else f'"{column}" TEXT'
+                    for column in ARANCEL_COLUMNS
+                )
+                conn.executescript(f'''
+                    CREATE TABLE arancel_nacional ({columns});
+                    CREATE INDEX idx_arancel_nacional_ncm ON arancel_nacional(NCM);
+                    CREATE TABLE section_notes (
+                        id INTEGER PRIMARY KEY,
+                        section_number TEXT NOT NULL UNIQUE,
+                        note_text TEXT NOT NULL
+                    );
+                    CREATE TABLE chapter_notes (
+                        id INTEGER PRIMARY KEY,
+                        chapter_number TEXT NOT NULL UNIQUE,
+                        note_text TEXT NOT NULL
+                    );
+                    CREATE TABLE db_metadata (key TEXT PRIMARY KEY, value TEXT);
+                ''')
+
+                rows = store.execute(f'''
+                    SELECT {', '.join(f's."{column}"' for column in ARANCEL_COLUMNS)}
+                    FROM version_rows v JOIN store_rows s ON s.hash = v.row_hash
+                    WHERE v.version = ? ORDER BY v.position
+                ''', (version,))
+                placeholders = ', '.join('?' * len(ARANCEL_COLUMNS))
+                count = conn.executemany(
+                    f"INSERT INTO arancel_nacional ({_COLUMNS_SQL}) VALUES ({placeholders})", rows
+                ).rowcount
+
+                for kind, (table, number_column) in NOTE_TABLES.items():
+                    notes = store.execute('''
+                        SELECT v.number, n.note_text
+                        FROM version_notes v JOIN store_notes n ON n.hash = v.note_hash
+                        WHERE v.version = ? AND v.kind = ? ORDER BY v.number
+                    ''', (version, kind))
+                    conn.executemany(f"INSERT INTO {table} ({number_column}, note_text) VALUES (?, ?)", notes)
+
+                metadata.setdefault('version', version)
+                metadata['restored_at'] = datetime.datetime.now().isoformat()
+                conn.executemany("INSERT INTO db_metadata (key, value) VALUES (?, ?)", metadata.items())
+
+                # Estructuras derivadas, igual que al cargar una versión
+                ensure_fts_index(conn, rebuild=True)
+                ensure_ncm_key(conn)
+                ensure_classification_columns(conn)
+                ensure_version_stats(conn, rebuild=True)
+                ensure_content_hash(conn, rebuild=True)
+                stamp_schema_version(conn)
+                conn.commit()
+            os.replace(tmp_path, target_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    logging.info(f"Versión {version} reconstruida desde el almacén en {target_path} ({count} filas)")
+    return count
+
+
+@contextmanager
+def version_file(version, db_path, store_path):
+    """
+    Archivo de una versión para leerla, aunque solo esté en el almacén.
+
+    Las versiones sin archivo propio se reconstruyen en un directorio
+    temporal que se elimina al terminar; el directorio de versiones no se
+    modifica.
+
+    Args:
+        version (str): Versión AAAAMM
+        db_path (str): Ruta del archivo de la versión
+        store_path (str): Ruta del almacén (opcional)
+
+    Raises:
+        FileNotFoundError: Si la versión no tiene archivo ni está en el almacén
+    """
+    if os.path.exists(db_path):
+        yield db_path
+        return
+    if not store_path or not os.path.exists(store_path):
+        raise FileNotFoundError(f"La versión {version} no tiene archivo ni está en el almacén")
+    with tempfile.TemporaryDirectory(prefix='version-') as tmp_dir:
+        tmp_path = os.path.join(tmp_dir, os.path.basename(db_path))
+        materialize_version(store_path, version, tmp_path)
+        yield tmp_path
+
+
+def get_store_path():
+    """Ruta del almacén dentro del directorio de versiones."""
+    from .db_utils import DB_VERSIONS_DIR
+    return os.path.join(str(DB_VERSIONS_DIR), STORE_DB_NAME)
@@ -0,0 +1,56 @@
+"""
+Precarga de las cachés de la versión más reciente.
+
+Cuando se publica una versión el catálogo cambia y todas las cachés por
+versión se vacían. Para que las primeras solicitudes no tengan que reconstruir
+a la vez la instantánea, los totales, las notas y los validadores, un hilo en
+segundo plano los carga apenas se detecta el cambio.
+"""
+import logging
+import threading
+
+# Evita que dos precargas de la misma versión se ejecuten a la vez
+_lock = threading.Lock()
+
+
+def warm_version(db_path):
+    """
+    Carga en las cachés de proceso los datos derivados de una versión.
+
+    Args:
+        db_path (str): Ruta a la base de datos de la versión
+    """
+    from .http_cache import get_validators
+    from .note_cache import get_version_notes
+    from .tariff_snapshot import get_snapshot
+    from .version_stats import get_version_stats
+
+    with _lock:
+        for loader in (get_snapshot, get_version_stats, get_version_notes, get_validators):
+            try:
+                loader(db_path)
+            except Exception as e:
+                logging.error(f"Error al precargar {loader.__name__} de {db_path}: {str(e)}")
+    logging.info(f"Cachés de {db_path} precargadas")
+
+
+def schedule_warmup():
+    """Precarga en un hilo aparte las cachés de la versión más reciente."""
+    from .version_catalog import resolve_db_path
+
+    try:
+        db_path = resolve_db_path(None)
+    except Exception as e:
+        logging.error(f"No se pudo resolver la versión a precargar: {str(e)}")
+        return None
+    thread = threading.Thread(target=warm_version, args=(db_path,), name='warmup-latest', daemon=True)
+    thread.start()
+    return thread
+
+
+def init_app(app):
+    """Precarga las cachés cada vez que cambia el catálogo de versiones."""
+    if not app.config.get('WARM_CACHES_ON_PUBLISH', False):
+        return
+    from .version_catalog import catalog
+    catalog.on_invalidate(schedule_warmup)
@@ -6,6 +6,7 @@ Permite crear, actualizar y consultar bases de datos específicas para
 diferentes versiones del arancel.
 """
 
+import bisect
 import os
 import re
 import datetime
@@ -28,6 +29,9 @@ DB_VERSIONS_DIR = os.path.join(BASE_DIR, 'data', 'db_versions')
 ORIGINAL_DB_PATH = os.path.join(BASE_DIR, 'data', 'database.sqlite3')
 LATEST_SYMLINK = os.path.join(DB_VERSIONS_DIR, 'arancel_latest.sqlite3')
 
+# Sufijo de los archivos en construcción (no coinciden con arancel_*.sqlite3)
+STAGING_SUFFIX = '.building'
+
 # Para diagnóstico
 logger.info(f"BASE_DIR: {BASE_DIR}")
 logger.info(f"DB_VERSIONS_DIR: {DB_VERSIONS_DIR}")
@@ -37,11 +41,34 @@ logger.info(f"LATEST_SYMLINK: {LATEST_SYMLINK}")
 # Asegurar que el directorio de versiones exista
 os.makedirs(DB_VERSIONS_DIR, exist_ok=True)
 
+# Versiones disponibles en orden ascendente, recalculadas solo cuando cambia
+# el directorio de versiones: (firma del directorio, lista de versiones)
+_versions_index = (None, [])
+
+def _sorted_versions():
+    """
+    Versiones disponibles (YYYYMM) en orden ascendente, con caché en memoria
+    
+    Returns:
+        Lista de versiones de la más antigua a la más reciente
+    """
+    global _versions_index
+    try:
+        signature = os.stat(DB_VERSIONS_DIR).st_mtime_ns
+    except OSError:
+        return []
+    if _versions_index[0] != signature:
+        _versions_index = (signature, sorted(get_available_versions()))
+    return _versions_index[1]
+
 def get_db_path_for_date(date):
     """
     Obtiene la ruta a la base de datos correspondiente a una fecha específica.
     Si date es None, devuelve la base de datos más reciente.
     
+    La versión vigente es la más reciente publicada hasta el mes de la fecha;
+    las fechas anteriores a la primera versión usan la más antigua.
+    
     Args:
         date: Fecha en formato YYYY-MM-DD o YYYYMM o None para la más reciente
         
@@ -63,82 +90,40 @@ def get_db_path_for_date(date):
         
         return LATEST_SYMLINK
     
-    # Convertir la fecha a YYYYMM y YYYYMMDD
-    date_prefix = None
-    
-    # Si es una cadena, intentar convertirla
+    # Convertir la fecha a YYYYMM
     if isinstance(date, str):
-        # Si es formato YYYYMM (6 dígitos)
         if re.match(r'^\d{6}$', date):
-            year = date[:4]
-            month = date[4:6]
-            date_prefix = f"{year}{month}"
-            logger.info(f"Buscando base de datos para YYYYMM: {date_prefix}")
-        # Si es formato YYYY-MM-DD
+            date_prefix = date
         elif re.match(r'^\d{4}-\d{2}-\d{2}$', date):
             try:
                 date_obj = datetime.datetime.strptime(date, '%Y-%m-%d')
-                date_prefix = f"{date_obj.year}{date_obj.month:02d}"
-                logger.info(f"Buscando base de datos para fecha: {date} (YYYYMM: {date_prefix})")
             except ValueError:
                 logger.warning(f"Formato de fecha inválido: {date}")
                 return ORIGINAL_DB_PATH
+            date_prefix = f"{date_obj.year}{date_obj.month:02d}"
         else:
             logger.warning(f"Formato de fecha no reconocido: {date}")
             return ORIGINAL_DB_PATH
-    elif isinstance(date, datetime.datetime):
+    elif isinstance(date, (datetime.date, datetime.datetime)):
         date_prefix = f"{date.year}{date.month:02d}"
-        logger.info(f"Buscando base de datos para fecha datetime: (YYYYMM: {date_prefix})")
     else:
         logger.warning(f"Tipo de fecha no soportado: {type(date)}")
         return ORIGINAL_DB_PATH
     
-    # Buscar todas las bases de datos que empiecen con ese prefijo
-    db_files = []
-    for filename in os.listdir(DB_VERSIONS_DIR):
-        if filename.endswith('.sqlite3') and filename.startswith(date_prefix) and filename != 'latest.sqlite3' and filename != 'arancel_latest.sqlite3':
-            db_files.append(filename)
-    
-    if not db_files:
-        logger.warning(f"No existe base de datos para la fecha {date}")
-        
-        # Intentamos buscar todas las bases de datos disponibles
-        all_dbs = []
-        for filename in os.listdir(DB_VERSIONS_DIR):
-            if filename.endswith('.sqlite3') and filename not in ['latest.sqlite3', 'arancel_latest.sqlite3']:
-                all_dbs.append(filename)
-        
-        if all_dbs:
-            # Ordenar por nombre (que debe ser YYYYMMDD)
-            all_dbs.sort(reverse=True)
-            
-            # Si la fecha buscada es menor que la más antigua, usar la más antigua
-            # Si es mayor que la más reciente, usar la más reciente
-            first_db_date = all_dbs[-1][:8]  # El más antiguo
-            last_db_date = all_dbs[0][:8]    # El más reciente
-            
-            if date_prefix < first_db_date[:6]:
-                logger.info(f"La fecha {date_prefix} es anterior a la base de datos más antigua ({first_db_date}). Usando la más antigua.")
-                return os.path.join(DB_VERSIONS_DIR, all_dbs[-1])
-            elif date_prefix > last_db_date[:6]:
-                logger.info(f"La fecha {date_prefix} es posterior a la base de datos más reciente ({last_db_date}). Usando la más reciente.")
-                return os.path.join(DB_VERSIONS_DIR, all_dbs[0])
-            else:
-                # Buscar la base de datos más cercana anterior a la fecha solicitada
-                for db_file in sorted(all_dbs, reverse=True):
-                    if db_file[:6] <= date_prefix:
-                        logger.info(f"Usando base de datos más cercana anterior: {db_file}")
-                        return os.path.join(DB_VERSIONS_DIR, db_file)
-        
+    versions = _sorted_versions()
+    if not versions:
         logger.warning("No hay bases de datos disponibles, usando la original")
         return ORIGINAL_DB_PATH
     
-    # Ordenar para tomar la versión más reciente dentro del mes
-    db_files.sort(reverse=True)
-    db_path = os.path.join(DB_VERSIONS_DIR, db_files[0])
-    logger.info(f"Base de datos encontrada: {db_path}")
+    # Búsqueda binaria de la versión vigente en ese mes
+    position = bisect.bisect_right(versions, date_prefix)
+    if position == 0:
+        logger.info(f"La fecha {date_prefix} es anterior a la versión más antigua ({versions[0]}). Usando la más antigua.")
+        version = versions[0]
+    else:
+        version = versions[position - 1]
     
-    return db_path
+    return os.path.join(DB_VERSIONS_DIR, f'arancel_{version}.sqlite3')
 
 def get_available_versions():
     """
@@ -157,6 +142,19 @@ def get_available_versions():
     
     return sorted(versions, reverse=True)  # Ordenar de más reciente a más antigua
 
+def get_all_versions():
+    """
+    Versiones con archivo propio o guardadas en el almacén consolidado
+    
+    Returns:
+        Lista de versiones ordenadas de más reciente a más antigua
+    """
+    from app.version_store import STORE_DB_NAME, stored_versions
+    
+    versions = set(get_available_versions())
+    versions.update(stored_versions(os.path.join(DB_VERSIONS_DIR, STORE_DB_NAME)))
+    return sorted(versions, reverse=True)
+
 def get_db_connection(version=None):
     """
     Obtiene una conexión a la base de datos para una versión específica
@@ -183,16 +181,19 @@ def get_db_connection(version=None):
     
     return sqlite3.connect(db_path)
 
-def create_new_version_db(version_date, source_name):
+def create_new_version_db(version_date, source_name, staging=False):
     """
     Crea una nueva base de datos para una versión específica
     
     Args:
         version_date: Fecha en formato YYYY-MM-DD
         source_name: Nombre del archivo fuente (para registro)
+        staging: Crear la base de datos en un archivo temporal que se publica
+            después con publish_version_db (la versión no es visible mientras
+            se carga y una versión existente se reemplaza al publicar)
         
     Returns:
-        Ruta a la nueva base de datos
+        Ruta a la nueva base de datos (o al archivo temporal)
     """
     # Convertir la fecha a YYYYMM
     if isinstance(version_date, str):
@@ -207,8 +208,14 @@ def create_new_version_db(version_date, source_name):
     version_str = date_obj.strftime('%Y%m')
     new_db_path = os.path.join(DB_VERSIONS_DIR, f'arancel_{version_str}.sqlite3')
     
+    if staging:
+        new_db_path = staging_path(new_db_path)
+        # Descartar una carga anterior que no llegó a publicarse
+        if os.path.exists(new_db_path):
+            os.remove(new_db_path)
+    
     # Verificar si ya existe esta versión
-    if os.path.exists(new_db_path):
+    elif os.path.exists(new_db_path):
         logger.warning(f"La versión {version_str} ya existe. Se usará la existente.")
         return new_db_path
     
@@ -217,8 +224,14 @@ def create_new_version_db(version_date, source_name):
     
     # Copiar el esquema desde la base de datos original
     with closing(sqlite3.connect(ORIGINAL_DB_PATH)) as conn:
-        schema = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'").fetchall()
-        indexes = conn.execute("SELECT sql FROM sqlite_master WHERE type='index'").fetchall()
+        # Las tablas derivadas (índice FTS, totales) se reconstruyen al cargar los datos
+        schema = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' "
+            "AND name NOT LIKE 'arancel_fts%' AND name NOT IN ('version_stats', 'version_diff')"
+        ).fetchall()
+        indexes = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type='index' AND tbl_name NOT IN ('version_stats', 'version_diff')"
+        ).fetchall()
         
         with closing(sqlite3.connect(new_db_path)) as new_conn:
             # Crear las tablas
@@ -242,36 +255,95 @@ def create_new_version_db(version_date, source_name):
             
             new_conn.commit()
     
+    if staging:
+        logger.info(f"Base de datos para la versión {version_str} creada en {new_db_path}")
+        return new_db_path
+    
     # Actualizar el enlace simbólico a la versión más reciente
     update_latest_symlink()
     
     logger.info(f"Base de datos para la versión {version_str} creada correctamente")
     return new_db_path
 
+def staging_path(db_path):
+    """Archivo temporal en el que se construye una versión antes de publicarla"""
+    # El sufijo evita que el catálogo lo tome como una versión disponible
+    return f"{db_path}{STAGING_SUFFIX}"
+
+def _fsync_path(path):
+    """Fuerza a disco el contenido de un archivo o de un directorio"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def publish_version_db(staging_db_path, version_str):
+    """
+    Publica atómicamente una versión construida en un archivo temporal
+    
+    Aplica las migraciones de esquema pendientes, optimiza la base de datos
+    (ANALYZE y VACUUM), la fuerza a disco, la
+    renombra a su nombre definitivo (reemplazando la versión anterior si
+    existía) y mueve el enlace 'latest'. Los procesos de la aplicación
+    detectan el cambio del directorio de versiones en la siguiente consulta
+    y recargan sus cachés sin reiniciar.
+    
+    Args:
+        staging_db_path: Archivo temporal con la versión completa
+        version_str: Versión en formato YYYYMM
+        
+    Returns:
+        Ruta definitiva de la versión, o None si falló
+    """
+    from app.db_migrations import migrate
+    
+    final_path = os.path.join(DB_VERSIONS_DIR, f'arancel_{version_str}.sqlite3')
+    try:
+        with closing(sqlite3.connect(staging_db_path)) as conn:
+            # La versión se publica con el esquema al día
+            migrate(conn)
+            # Estadísticas para el planificador y archivo compacto sin journal
+            conn.execute("ANALYZE")
+            conn.commit()
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA journal_mode=DELETE")
+        _fsync_path(staging_db_path)
+        
+        # Nadie ve la versión a medio escribir: el rename es atómico
+        os.replace(staging_db_path, final_path)
+        _fsync_path(DB_VERSIONS_DIR)
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Error al publicar la versión {version_str}: {e}")
+        return None
+    
+    update_latest_symlink()
+    logger.info(f"Versión {version_str} publicada en {final_path}")
+    return final_path
+
 def update_latest_symlink():
     """
     Actualiza el enlace simbólico a la base de datos más reciente
+    
+    El enlace nuevo se crea con otro nombre y reemplaza al anterior con un
+    rename atómico, de modo que 'latest' siempre existe.
     """
     versions = get_available_versions()
     if not versions:
         logger.warning("No hay versiones disponibles para enlazar como latest")
         return False
     
-    latest_version = versions[-1]  # La última en la lista ordenada
+    latest_version = versions[0]  # La lista está ordenada de más reciente a más antigua
     latest_db_path = os.path.join(DB_VERSIONS_DIR, f'arancel_{latest_version}.sqlite3')
+    tmp_link = f"{LATEST_SYMLINK}{STAGING_SUFFIX}"
     
-    # Eliminar enlace simbólico existente si existe
-    if os.path.exists(LATEST_SYMLINK):
-        try:
-            os.remove(LATEST_SYMLINK)
-        except OSError as e:
-            logger.error(f"No se pudo eliminar el enlace simbólico existente: {e}")
-            return False
-    
-    # Crear nuevo enlace simbólico
     try:
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
         # En sistemas Unix
-        os.symlink(latest_db_path, LATEST_SYMLINK)
+        os.symlink(latest_db_path, tmp_link)
+        os.replace(tmp_link, LATEST_SYMLINK)
+        _fsync_path(DB_VERSIONS_DIR)
         logger.info(f"Enlace simbólico actualizado a la versión {latest_version}")
         return True
     except OSError as e:
@@ -279,7 +351,8 @@ def update_latest_symlink():
         logger.error(f"No se pudo crear el enlace simbólico: {e}")
         logger.info("Intentando crear una copia en lugar de un enlace simbólico")
         try:
-            shutil.copy2(latest_db_path, LATEST_SYMLINK)
+            shutil.copy2(latest_db_path, tmp_link)
+            os.replace(tmp_link, LATEST_SYMLINK)
             logger.info(f"Copia creada correctamente para la versión {latest_version}")
             return True
         except OSError as e2:
@@ -290,6 +363,11 @@ def migrate_data_to_new_version(source_version, target_version, tables=None):
     """
     Migra datos selectivos desde una versión a otra
     
+    La versión destino no se modifica en el lugar (los procesos de la
+    aplicación la abren como inmutable): los datos se copian a un archivo
+    temporal, se reconstruyen las tablas derivadas (índice FTS, claves,
+    totales, hash y diferencias) y se publica con publish_version_db.
+    
     Args:
         source_version: Versión fuente en formato YYYYMM
         target_version: Versión destino en formato YYYYMM
@@ -298,6 +376,9 @@ def migrate_data_to_new_version(source_version, target_version, tables=None):
     Returns:
         True si la migración fue exitosa
     """
+    from app.db_schema import (ensure_classification_columns, ensure_content_hash, ensure_fts_index,
+                               ensure_ncm_key, ensure_version_stats)
+    
     source_db = os.path.join(DB_VERSIONS_DIR, f'arancel_{source_version}.sqlite3')
     target_db = os.path.join(DB_VERSIONS_DIR, f'arancel_{target_version}.sqlite3')
     
@@ -311,55 +392,260 @@ def migrate_data_to_new_version(source_version, target_version, tables=None):
     
     logger.info(f"Migrando datos de {source_version} a {target_version}")
     
-    with closing(sqlite3.connect(source_db)) as source_conn, \
-         closing(sqlite3.connect(target_db)) as target_conn:
+    # Las tablas derivadas no se copian: se reconstruyen sobre los datos migrados
+    derived = ('db_metadata', 'version_stats', 'version_diff')
+    db_path = staging_path(target_db)
+    try:
+        shutil.copy2(target_db, db_path)
+        with closing(sqlite3.connect(source_db)) as source_conn, \
+             closing(sqlite3.connect(db_path)) as target_conn:
+            
+            # Determinar qué tablas migrar
+            if tables is None:
+                tables_query = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+                tables = [row[0] for row in source_conn.execute(tables_query).fetchall()]
+            tables = [table for table in tables if table not in derived and not table.startswith('arancel_fts')]
+            
+            for table in tables:
+                try:
+                    # Verificar si la tabla existe en ambas bases de datos
+                    if source_conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table}'").fetchone() and \
+                       target_conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table}'").fetchone():
+                        
+                        # Columnas presentes en ambas (una de las dos puede no estar migrada)
+                        target_columns = {col[1] for col in target_conn.execute(f"PRAGMA table_info({table})").fetchall()}
+                        columns = [col[1] for col in source_conn.execute(f"PRAGMA table_info({table})").fetchall()
+                                   if col[1] in target_columns]
+                        columns_str = ", ".join(f'"{column}"' for column in columns)
+                        
+                        # Obtener datos de la tabla fuente
+                        data = source_conn.execute(f"SELECT {columns_str} FROM {table}").fetchall()
+                        if not data:
+                            logger.info(f"La tabla {table} está vacía en la fuente")
+                            continue
+                        
+                        # Borrar datos existentes en la tabla destino
+                        target_conn.execute(f"DELETE FROM {table}")
+                        
+                        # Preparar consulta de inserción
+                        placeholders = ", ".join(["?" for _ in columns])
+                        insert_query = f"INSERT INTO {table} ({columns_str}) VALUES ({placeholders})"
+                        
+                        # Insertar datos en lotes
+                        batch_size = 1000
+                        for i in range(0, len(data), batch_size):
+                            batch = data[i:i+batch_size]
+                            target_conn.executemany(insert_query, batch)
+                        
+                        logger.info(f"Migrados {len(data)} registros de la tabla {table}")
+                except sqlite3.Error as e:
+                    logger.error(f"Error al migrar la tabla {table}: {e}")
+            
+            # Actualizar metadata
+            target_conn.execute("UPDATE db_metadata SET value = ? WHERE key = 'updated_at'", 
+                              (datetime.datetime.now().isoformat(),))
+            
+            # El contenido cambió: reconstruir las tablas derivadas como al cargar
+            ensure_fts_index(target_conn, rebuild=True)
+            ensure_ncm_key(target_conn)
+            ensure_classification_columns(target_conn)
+            ensure_version_stats(target_conn, rebuild=True)
+            ensure_content_hash(target_conn, rebuild=True)
+            
+            target_conn.commit()
+        
+        diff_with_previous(target_version, db_path)
+        if not publish_version_db(db_path, target_version):
+            raise RuntimeError(f"No se pudo publicar la versión {target_version}")
+    except (OSError, sqlite3.Error, RuntimeError) as e:
+        logger.error(f"Error al migrar de {source_version} a {target_version}: {e}")
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        return False
+    
+    update_history_index()
+    store_version(target_version)
+    logger.info(f"Migración de {source_version} a {target_version} completada")
+    return True
+
+def compute_version_diff(from_version, to_version, to_db=None):
+    """
+    Compara dos versiones completas y guarda el resultado en la versión destino
+    
+    La comparación se hace en SQL por conjuntos (NCM agregados, eliminados y
+    campos modificados) con la versión anterior adjunta, y se guarda en la
+    tabla version_diff de la versión destino para que la API la sirva.
+    
+    Args:
+        from_version: Versión anterior en formato YYYYMM
+        to_version: Versión nueva en formato YYYYMM
+        to_db: Ruta de la versión nueva (por defecto la publicada; al publicar
+            se usa el archivo en construcción)
         
-        # Determinar qué tablas migrar
-        if tables is None:
-            tables_query = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' AND name != 'db_metadata'"
-            tables = [row[0] for row in source_conn.execute(tables_query).fetchall()]
+    Returns:
+        Cantidad de registros de diferencias, o None si falló
+    """
+    from app.version_diff import attach_previous, store_diff
+    from app.version_store import STORE_DB_NAME, version_file
+    
+    from_db = os.path.join(DB_VERSIONS_DIR, f'arancel_{from_version}.sqlite3')
+    to_db = to_db or os.path.join(DB_VERSIONS_DIR, f'arancel_{to_version}.sqlite3')
+    
+    if not os.path.exists(to_db):
+        logger.error(f"La base de datos de la versión {to_version} no existe")
+        return None
+    
+    logger.info(f"Comparando versión {from_version} con {to_version}")
+    try:
+        # La versión anterior sin archivo propio se lee del almacén en una copia temporal
+        with version_file(from_version, from_db, os.path.join(DB_VERSIONS_DIR, STORE_DB_NAME)) as from_path, \
+             closing(sqlite3.connect(to_db)) as conn:
+            attach_previous(conn, from_path)
+            count = store_diff(conn, from_version)
+            conn.commit()
+    except (FileNotFoundError, KeyError) as e:
+        logger.error(f"La base de datos de la versión {from_version} no existe: {e}")
+        return None
+    except sqlite3.Error as e:
+        logger.error(f"Error al comparar las versiones {from_version} y {to_version}: {e}")
+        return None
+    
+    logger.info(f"Comparación de {from_version} a {to_version} completada: {count} diferencias")
+    return count
+
+def diff_with_previous(version, db_path=None):
+    """
+    Compara una versión con la inmediatamente anterior (al publicarla)
+    
+    Args:
+        version: Versión en formato YYYYMM
+        db_path: Ruta de la versión (opcional, por defecto la publicada)
         
-        for table in tables:
-            try:
-                # Verificar si la tabla existe en ambas bases de datos
-                if source_conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table}'").fetchone() and \
-                   target_conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table}'").fetchone():
-                    
-                    # Obtener datos de la tabla fuente
-                    data = source_conn.execute(f"SELECT * FROM {table}").fetchall()
-                    if not data:
-                        logger.info(f"La tabla {table} está vacía en la fuente")
-                        continue
-                    
-                    # Obtener columnas de la tabla
-                    columns = [col[1] for col in source_conn.execute(f"PRAGMA table_info({table})").fetchall()]
-                    
-                    # Borrar datos existentes en la tabla destino
-                    target_conn.execute(f"DELETE FROM {table}")
-                    
-                    # Preparar consulta de inserción
-                    placeholders = ", ".join(["?" for _ in columns])
-                    columns_str = ", ".join(columns)
-                    insert_query = f"INSERT INTO {table} ({columns_str}) VALUES ({placeholders})"
-                    
-                    # Insertar datos en lotes
-                    batch_size = 1000
-                    for i in range(0, len(data), batch_size):
-                        batch = data[i:i+batch_size]
-                        target_conn.executemany(insert_query, batch)
-                    
-                    logger.info(f"Migrados {len(data)} registros de la tabla {table}")
-            except sqlite3.Error as e:
-                logger.error(f"Error al migrar la tabla {table}: {e}")
+    Returns:
+        Cantidad de registros de diferencias, o None si no hay versión anterior
+    """
+    previous = [v for v in get_all_versions() if v < version]
+    if not previous:
+        logger.info(f"La versión {version} no tiene una versión anterior para comparar")
+        return None
+    return compute_version_diff(previous[0], version, db_path)
+
+def update_history_index(rebuild=False):
+    """
+    Actualiza el índice temporal de vigencias con las versiones disponibles
+    
+    Se ejecuta al publicar una versión; las consultas por fecha (as_of) de la
+    API se resuelven sobre este índice.
+    
+    Args:
+        rebuild: Reconstruir el índice completo
+        
+    Returns:
+        Cantidad de versiones incorporadas, o None si falló
+    """
+    from app.tariff_history import HISTORY_DB_NAME, build_history
+    from app.version_store import STORE_DB_NAME
+    
+    versions = {
+        version: os.path.join(DB_VERSIONS_DIR, f'arancel_{version}.sqlite3')
+        for version in get_all_versions()
+    }
+    try:
+        count = build_history(
+            os.path.join(DB_VERSIONS_DIR, HISTORY_DB_NAME), versions, rebuild=rebuild,
+            store_path=os.path.join(DB_VERSIONS_DIR, STORE_DB_NAME)
+        )
+    except (OSError, sqlite3.Error, KeyError) as e:
+        logger.error(f"Error al actualizar el índice temporal de vigencias: {e}")
+        return None
+    logger.info(f"Índice temporal de vigencias actualizado: {count} versiones incorporadas")
+    return count
+
+def migrate_versions():
+    """
+    Aplica las migraciones de esquema pendientes a todas las versiones
+    
+    Returns:
+        Cantidad de versiones migradas
+    """
+    from app.db_migrations import SCHEMA_VERSION, migrate_all
+    
+    migrated = migrate_all(DB_VERSIONS_DIR)
+    for db_path, applied in migrated.items():
+        logger.info(f"{os.path.basename(db_path)}: migraciones {', '.join(map(str, applied))} aplicadas")
+    logger.info(f"{len(migrated)} versiones migradas al esquema {SCHEMA_VERSION}")
+    return len(migrated)
+
+def consolidate_versions():
+    """
+    Agrega todas las versiones al almacén consolidado
+    
+    El almacén guarda cada fila y cada nota una sola vez y es solo una copia
+    de respaldo: los archivos por versión se conservan, porque la aplicación
+    sirve las versiones desde ellos.
+    
+    Returns:
+        Cantidad de versiones consolidadas, o None si falló
+    """
+    from app.version_store import STORE_DB_NAME, add_version
+    
+    store_path = os.path.join(DB_VERSIONS_DIR, STORE_DB_NAME)
+    versions = get_available_versions()
+    try:
+        for version in versions:
+            add_version(store_path, version, os.path.join(DB_VERSIONS_DIR, f'arancel_{version}.sqlite3'))
+    except sqlite3.Error as e:
+        logger.error(f"Error al consolidar las versiones: {e}")
+        return None
+    
+    logger.info(f"{len(versions)} versiones consolidadas en {store_path} ({os.path.getsize(store_path)} bytes)")
+    return len(versions)
+
+def store_version(version):
+    """
+    Agrega o reemplaza una versión en el almacén consolidado (al publicarla)
+    
+    Args:
+        version: Versión en formato YYYYMM
         
-        # Actualizar metadata
-        target_conn.execute("UPDATE db_metadata SET value = ? WHERE key = 'updated_at'", 
-                          (datetime.datetime.now().isoformat(),))
+    Returns:
+        True si se guardó correctamente
+    """
+    from app.version_store import STORE_DB_NAME, add_version
+    
+    db_path = os.path.join(DB_VERSIONS_DIR, f'arancel_{version}.sqlite3')
+    try:
+        add_version(os.path.join(DB_VERSIONS_DIR, STORE_DB_NAME), version, db_path)
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Error al guardar la versión {version} en el almacén: {e}")
+        return False
+
+def restore_version(version):
+    """
+    Reconstruye el archivo de una versión a partir del almacén consolidado
+    
+    Sirve para recuperar un archivo perdido o dañado; la aplicación vuelve a
+    ofrecer la versión en cuanto aparece el archivo.
+    
+    Args:
+        version: Versión en formato YYYYMM
         
-        target_conn.commit()
+    Returns:
+        Ruta a la base de datos reconstruida, o None si falló
+    """
+    from app.version_store import STORE_DB_NAME, materialize_version
     
-    logger.info(f"Migración de {source_version} a {target_version} completada")
-    return True
+    db_path = os.path.join(DB_VERSIONS_DIR, f'arancel_{version}.sqlite3')
+    try:
+        materialize_version(os.path.join(DB_VERSIONS_DIR, STORE_DB_NAME), version, db_path)
+    except KeyError:
+        logger.error(f"La versión {version} no está en el almacén")
+        return None
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Error al reconstruir la versión {version}: {e}")
+        return None
+    return db_path
 
 if __name__ == "__main__":
     # Ejemplo de uso
@@ -369,6 +655,9 @@ if __name__ == "__main__":
     print("2. Crear nueva versión")
     print("3. Migrar datos entre versiones")
     print("4. Actualizar enlace 'latest'")
+    print("5. Consolidar versiones en el almacén")
+    print("6. Reconstruir versión desde el almacén")
+    print("7. Aplicar migraciones de esquema")
     
     choice = input("\nSeleccione una opción: ")
     
@@ -410,5 +699,22 @@ if __name__ == "__main__":
         else:
             print("Error al actualizar el enlace 'latest'")
     
+    elif choice == "5":
+        count = consolidate_versions()
+        if count is not None:
+            print(f"{count} versiones consolidadas")
+        else:
+            print("La consolidación falló")
+    
+    elif choice == "6":
+        version = input("Ingrese versión (YYYYMM): ")
+        db_path = restore_version(version)
+        if db_path:
+            print(f"Versión reconstruida en: {db_path}")
+    
+    elif choice == "7":
+        count = migrate_versions()
+        print(f"{count} versiones migradas")
+    
     else:
         print("Opción no válida")
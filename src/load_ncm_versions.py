@@ -4,9 +4,12 @@
 Script para cargar diferentes versiones de los NCM desde archivos Excel.
 Lee los archivos Excel de diferentes fechas y carga los datos en la tabla ncm_versions.
 """
+import argparse
 import os
 import pandas as pd
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 import logging
 from app import create_app, db
@@ -26,6 +29,9 @@ logger = logging.getLogger('load_ncm_versions')
 # Directorio donde se encuentran los archivos Excel
 data_dir = os.path.join('data')
 
+# Procesos que leen los archivos Excel en paralelo (por defecto, uno por núcleo)
+DEFAULT_WORKERS = int(os.environ.get('NCM_LOAD_WORKERS', 0)) or os.cpu_count() or 1
+
 def extract_date_from_filename(filename):
     """
     Extrae la fecha del nombre del archivo Excel.
@@ -206,54 +212,20 @@ def load_versions_to_db(versions_data):
             logger.warning(f"⚠️ Código importante {codigo} NO se encontró en los datos a cargar")
     
     try:
-        # Procesar los datos en lotes pequeños para evitar problemas de memoria
-        batch_size = 100
-        total_batches = len(versions_data) // batch_size + (1 if len(versions_data) % batch_size > 0 else 0)
-        
-        for batch_idx in range(total_batches):
-            start_idx = batch_idx * batch_size
-            end_idx = min((batch_idx + 1) * batch_size, len(versions_data))
-            batch = versions_data[start_idx:end_idx]
-            
-            logger.info(f"Procesando lote {batch_idx + 1}/{total_batches} ({start_idx}-{end_idx})")
-            
-            for data in batch:
-                try:
-                    # Verificar si esta versión ya existe
-                    existing = NCMVersion.query.filter_by(
-                        ncm_code=data['ncm_code'],
-                        version_date=data['version_date']
-                    ).first()
-                    
-                    if existing:
-                        # Actualizar versión existente
-                        for key, value in data.items():
-                            setattr(existing, key, value)
-                        logger.info(f"Actualizada versión: {data['ncm_code']} {data['version_date']}")
-                    else:
-                        # Crear nueva versión
-                        new_version = NCMVersion(**data)
-                        db.session.add(new_version)
-                        count += 1
-                        logger.info(f"Agregada nueva versión: {data['ncm_code']} {data['version_date']}")
-                    
-                    # Diagnóstico especial para códigos importantes
-                    if data.get('ncm_code') in codigos_importantes:
-                        logger.info(f"✅ Procesado código importante: {data['ncm_code']}")
-                
-                except Exception as e:
-                    logger.error(f"Error al guardar versión {data.get('ncm_code')}: {str(e)}")
-                    # Registrar todos los detalles para diagnóstico
-                    logger.error(f"Detalles completos del registro con error: {data}")
-                    db.session.rollback()
-            
-            # Commit después de cada lote
-            try:
-                db.session.commit()
-                logger.info(f"Commit exitoso del lote {batch_idx + 1}")
-            except Exception as e:
-                logger.error(f"Error en commit del lote {batch_idx + 1}: {str(e)}")
-                db.session.rollback()
+        # Un solo INSERT ... ON CONFLICT por lote sobre (ncm_code, version_date);
+        # el índice único se crea la primera vez y nunca se borran registros
+        NCMVersion.ensure_unique_key()
+        started = time.monotonic()
+        counts = NCMVersion.bulk_upsert(versions_data)
+        count = counts['inserted']
+        logger.info(
+            f"Carga completada en {time.monotonic() - started:.1f}s: {counts['inserted']} insertados, "
+            f"{counts['updated']} actualizados, {counts['unchanged']} sin cambios"
+        )
+    
+    except ValueError as e:
+        logger.error(f"Carga cancelada: {str(e)}")
+        db.session.rollback()
     
     except Exception as e:
         logger.error(f"Error general en load_versions_to_db: {str(e)}")
@@ -271,8 +243,78 @@ def load_versions_to_db(versions_data):
     
     return count
 
+def _parse_file(filepath, filename, date):
+    """Lee un archivo en un proceso del pool y devuelve sus registros con el tiempo empleado."""
+    started = time.monotonic()
+    versions_data = extract_ncm_from_excel(filepath, filename, date)
+    return versions_data, time.monotonic() - started
+
+def ingest_files(excel_files, workers=DEFAULT_WORKERS):
+    """
+    Lee varios archivos Excel en paralelo y los carga en la base de datos.
+    
+    La lectura de cada planilla (CPU intensiva e independiente de las demás)
+    se reparte en un pool de procesos; este proceso es el único que escribe
+    en la base de datos y carga los archivos en el orden recibido (por
+    fecha), a medida que están listos, de modo que el resultado no depende
+    del orden en que terminan los procesos.
+    
+    Args:
+        excel_files: Lista de tuplas (ruta, nombre, fecha) ordenada por fecha
+        workers: Cantidad de procesos de lectura (1 para leer en este proceso)
+        
+    Returns:
+        Número total de registros agregados
+    """
+    total = len(excel_files)
+    total_added = 0
+    
+    def write(position, filename, versions_data):
+        added = load_versions_to_db(versions_data)
+        print(f"[{position + 1}/{total}] {filename}: se agregaron {added} registros")
+        return added
+    
+    if workers <= 1 or total <= 1:
+        for position, (filepath, filename, date) in enumerate(excel_files):
+            versions_data, elapsed = _parse_file(filepath, filename, date)
+            print(f"[{position + 1}/{total}] {filename}: {len(versions_data)} registros leídos en {elapsed:.1f}s")
+            total_added += write(position, filename, versions_data)
+        return total_added
+    
+    workers = min(workers, total)
+    logger.info(f"Leyendo {total} archivos con {workers} procesos")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_parse_file, filepath, filename, date): position
+            for position, (filepath, filename, date) in enumerate(excel_files)
+        }
+        # Archivos leídos que esperan a que se carguen los anteriores
+        parsed = {}
+        next_position = 0
+        for future in as_completed(futures):
+            position = futures[future]
+            filename = excel_files[position][1]
+            try:
+                versions_data, elapsed = future.result()
+            except Exception as e:
+                logger.error(f"Error al procesar el archivo {filename}: {str(e)}")
+                versions_data, elapsed = [], 0.0
+            print(f"[{position + 1}/{total}] {filename}: {len(versions_data)} registros leídos en {elapsed:.1f}s")
+            parsed[position] = versions_data
+            
+            while next_position in parsed:
+                total_added += write(next_position, excel_files[next_position][1], parsed.pop(next_position))
+                next_position += 1
+    
+    return total_added
+
 def main():
     """Función principal que ejecuta la carga de versiones NCM."""
+    parser = argparse.ArgumentParser(description='Carga las versiones de los NCM desde los archivos Excel')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Procesos para leer los archivos en paralelo (por defecto {DEFAULT_WORKERS})')
+    args = parser.parse_args()
+    
     # Crear contexto de aplicación Flask
     app = create_app()
     
@@ -308,14 +350,7 @@ def main():
         
         if opcion == "1":
             # Cargar todas las versiones
-            total_added = 0
-            
-            for filepath, filename, date in excel_files:
-                print(f"\nProcesando {filename}...")
-                versions_data = extract_ncm_from_excel(filepath, filename, date)
-                added = load_versions_to_db(versions_data)
-                total_added += added
-                print(f"Se agregaron {added} registros de {filename}")
+            total_added = ingest_files(excel_files, args.workers)
             
             print(f"\nSe agregaron un total de {total_added} versiones a la base de datos.")
         
@@ -327,15 +362,8 @@ def main():
             seleccion = input("\nSeleccione el número del archivo a cargar (separados por coma): ")
             indices = [int(idx.strip()) - 1 for idx in seleccion.split(",") if idx.strip().isdigit()]
             
-            total_added = 0
-            for idx in indices:
-                if 0 <= idx < len(excel_files):
-                    filepath, filename, date = excel_files[idx]
-                    print(f"\nProcesando {filename}...")
-                    versions_data = extract_ncm_from_excel(filepath, filename, date)
-                    added = load_versions_to_db(versions_data)
-                    total_added += added
-                    print(f"Se agregaron {added} registros de {filename}")
+            selected = [excel_files[idx] for idx in indices if 0 <= idx < len(excel_files)]
+            total_added = ingest_files(selected, args.workers)
             
             print(f"\nSe agregaron un total de {total_added} versiones a la base de datos.")
         
@@ -7,6 +7,7 @@ permitiendo tener un registro histórico separado.
 """
 
 import os
+import re
 import sys
 import argparse
 import datetime
@@ -17,7 +18,11 @@ import logging
 from tqdm import tqdm
 
 # Importar el gestor de versiones
-from db_version_manager import create_new_version_db, get_db_path_for_date
+from db_version_manager import (STAGING_SUFFIX, create_new_version_db, diff_with_previous, publish_version_db,
+                                store_version, update_history_index)
+from app.db_schema import (
+    ensure_classification_columns, ensure_content_hash, ensure_fts_index, ensure_ncm_key, ensure_version_stats
+)
 
 # Configuración de logging
 logging.basicConfig(
@@ -204,9 +209,10 @@ def load_excel_to_version_db(file_path, version_date=None, sheet_name=None):
         logger.error("No se pudieron extraer datos del archivo Excel")
         return None
     
-    # Crear la nueva base de datos para esta versión
+    # Crear la nueva base de datos para esta versión (en un archivo temporal
+    # que se publica recién cuando está completa)
     source_name = os.path.basename(file_path)
-    db_path = create_new_version_db(version_date, source_name)
+    db_path = create_new_version_db(version_date, source_name, staging=True)
     if not db_path:
         logger.error("No se pudo crear la base de datos para la versión")
         return None
@@ -226,6 +232,17 @@ def load_excel_to_version_db(file_path, version_date=None, sheet_name=None):
                     batch.to_sql('arancel_nacional', conn, if_exists='append', index=False)
                     pbar.update(1)
             
+            # Construir el índice de texto completo de descripciones
+            ensure_fts_index(conn, rebuild=True)
+            # Clave NCM canónica (solo dígitos) para las búsquedas por prefijo
+            ensure_ncm_key(conn)
+            # Números de sección, capítulo y partida indexados
+            ensure_classification_columns(conn)
+            # Totales por sección y capítulo, calculados una sola vez por versión
+            ensure_version_stats(conn, rebuild=True)
+            # Hash del contenido publicado (ETag de la API)
+            ensure_content_hash(conn, rebuild=True)
+            
             # Guardar información en ncm_versions
             logger.info("Actualizando tabla de versiones de NCM")
             
@@ -291,10 +308,24 @@ def load_excel_to_version_db(file_path, version_date=None, sheet_name=None):
             conn.commit()
             
         logger.info(f"Datos cargados correctamente en la base de datos para la versión {version_date}")
+        
+        # Diferencias con la versión anterior, servidas por /api/diff
+        version_str = re.match(r'arancel_(\d{6})\.sqlite3', os.path.basename(db_path)).group(1)
+        diff_with_previous(version_str, db_path)
+        
+        # Publicación atómica: rename del archivo completo y cambio de 'latest'
+        db_path = publish_version_db(db_path, version_str)
+        if not db_path:
+            return None
+        
+        update_history_index()
+        store_version(version_str)
         return db_path
     
     except Exception as e:
         logger.error(f"Error al guardar los datos en la base de datos: {e}")
+        if os.path.exists(db_path) and db_path.endswith(STAGING_SUFFIX):
+            os.remove(db_path)
         return None
 
 def main():
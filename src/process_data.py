@@ -41,6 +41,116 @@ def clean_text(text):
         return ""
     return str(text).strip()
 
+# Código NCM completo (ej: 0101.21.00.00)
+NCM_PATTERN = r'^\d{4}\.\d{2}\.\d{2}\.\d{2}$'
+
+# Títulos de sección y capítulo dentro del texto de una fila
+SECTION_TITLE_RE = re.compile(r'(secci[oó]n\s+[ivxlcdm]+)\s+(.*)', re.IGNORECASE)
+CHAPTER_TITLE_RE = re.compile(r'(cap[ií]tulo\s+\d+)\s+(.*)', re.IGNORECASE)
+
+# Filas que pueden contener un título (se analizan completas solo estas)
+TITLE_CANDIDATE_PATTERN = r'secci[oó]n|cap[ií]tulo'
+
+# Columnas que siguen al código NCM en la planilla, en orden
+NCM_FIELDS = ('DESCRIPCION', 'AEC', 'CL', 'E/Z', 'I/Z', 'UVF')
+
+def clean_cells(df):
+    """Texto de cada celda sin espacios al inicio y al final ('' para las vacías)"""
+    cells = pd.DataFrame(
+        {col: df[col].astype(str).str.strip() for col in df.columns},
+        index=df.index
+    )
+    return cells.where(df.notna(), "").astype(object)
+
+def title_context(df, cells):
+    """
+    Sección y capítulo vigentes en cada fila
+    
+    Solo las filas que mencionan "sección" o "capítulo" en alguna celda se
+    analizan como texto completo; el resto hereda el último título con
+    forward-fill.
+    
+    Returns:
+        Tupla (secciones, capítulos) con un valor por fila
+    """
+    candidates = np.zeros(len(df), dtype=bool)
+    for col in cells.columns:
+        candidates |= cells[col].str.contains(TITLE_CANDIDATE_PATTERN, case=False, regex=True).to_numpy(dtype=bool)
+    
+    sections = pd.Series(None, index=df.index, dtype=object)
+    chapters = pd.Series(None, index=df.index, dtype=object)
+    values = df.values
+    for position in np.flatnonzero(candidates):
+        # Mismo texto de fila que se usaba al recorrer la planilla fila por fila
+        row_str = ' '.join([str(cell) for cell in values[position] if not pd.isna(cell)])
+        
+        if is_section(row_str):
+            section_match = SECTION_TITLE_RE.search(row_str)
+            if section_match:
+                section_id = section_match.group(1).upper()
+                section_name = section_match.group(2).strip()
+                sections.iat[position] = f"{section_id} - {section_name}"
+                logger.info(f"Sección encontrada: {sections.iat[position]}")
+        
+        elif is_chapter(row_str):
+            chapter_match = CHAPTER_TITLE_RE.search(row_str)
+            if chapter_match:
+                chapter_id = chapter_match.group(1).title()
+                chapter_name = chapter_match.group(2).strip()
+                chapters.iat[position] = f"{chapter_id} - {chapter_name}"
+                logger.info(f"Capítulo encontrado: {chapters.iat[position]}")
+    
+    return sections.ffill().fillna(""), chapters.ffill().fillna("")
+
+def parse_tariff_rows(df):
+    """
+    Extrae las filas con código NCM de la planilla del arancel
+    
+    El código de cada fila es la primera celda con formato NCM completo y
+    los datos (descripción, AEC, CL, E/Z, I/Z, UVF) son las celdas
+    siguientes. Todo se calcula por columnas con operaciones vectorizadas
+    de pandas en lugar de recorrer la planilla fila por fila.
+    
+    Args:
+        df: DataFrame leído con header=None
+        
+    Returns:
+        DataFrame con las columnas de arancel_nacional
+    """
+    columns = ['NCM', *NCM_FIELDS, 'SECTION', 'CHAPTER']
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+    
+    cells = clean_cells(df)
+    sections, chapters = title_context(df, cells)
+    
+    # Primera columna con un código NCM en cada fila
+    matches = np.column_stack([
+        cells[col].str.match(NCM_PATTERN).to_numpy(dtype=bool) for col in cells.columns
+    ])
+    rows = np.flatnonzero(matches.any(axis=1))
+    if len(rows) == 0:
+        return pd.DataFrame(columns=columns)
+    ncm_cols = matches[rows].argmax(axis=1)
+    logger.info(f"Columnas con códigos NCM: {sorted(set(ncm_cols.tolist()))}")
+    
+    # Celdas vacías a la derecha para las filas cuyo NCM está en las últimas columnas
+    padded = np.hstack([
+        cells.to_numpy(dtype=object),
+        np.full((len(cells), len(NCM_FIELDS)), "", dtype=object)
+    ])
+    data = {'NCM': padded[rows, ncm_cols]}
+    for offset, field in enumerate(NCM_FIELDS, start=1):
+        data[field] = padded[rows, ncm_cols + offset]
+    processed_df = pd.DataFrame(data)
+    
+    # Filas sin descripción: se usa la última descripción válida
+    processed_df['DESCRIPCION'] = processed_df['DESCRIPCION'].replace("", np.nan).ffill().fillna("")
+    processed_df['AEC'] = processed_df['AEC'].replace("", "0")
+    processed_df['SECTION'] = sections.to_numpy()[rows]
+    processed_df['CHAPTER'] = chapters.to_numpy()[rows]
+    return processed_df[columns]
+
 def process_excel_data():
     # Rutas de los archivos
     excel_path = "data/Arancel Nacional_Abril 2024.xlsx"
@@ -57,106 +167,8 @@ def process_excel_data():
         logger.info(f"Leyendo archivo Excel de referencia desde {excel_path}...")
         df = pd.read_excel(excel_path, header=None)
         
-        # Inicializar variables para extraer datos
-        valid_rows = []
-        current_section = ""
-        current_chapter = ""
-        ncm_col = None
-        desc_col = None
-        aec_col = None
-        cl_col = None
-        ez_col = None
-        iz_col = None
-        uvf_col = None
-        
-        # Procesar el archivo línea por línea
-        last_valid_ncm = None
-        last_valid_desc = None
-        
-        for idx, row in df.iterrows():
-            # Convertir fila a texto para análisis
-            row_str = ' '.join([str(cell) for cell in row if not pd.isna(cell)])
-            
-            # Buscar encabezados de secciones y capítulos
-            if is_section(row_str):
-                # Extrae el nombre de la sección
-                section_match = re.search(r'(secci[oó]n\s+[ivxlcdm]+)\s+(.*)', row_str, re.IGNORECASE)
-                if section_match:
-                    section_id = section_match.group(1).upper()
-                    section_name = section_match.group(2).strip()
-                    current_section = f"{section_id} - {section_name}"
-                    logger.info(f"Sección encontrada: {current_section}")
-                
-            elif is_chapter(row_str):
-                # Extrae el nombre del capítulo
-                chapter_match = re.search(r'(cap[ií]tulo\s+\d+)\s+(.*)', row_str, re.IGNORECASE)
-                if chapter_match:
-                    chapter_id = chapter_match.group(1).title()
-                    chapter_name = chapter_match.group(2).strip()
-                    current_chapter = f"{chapter_id} - {chapter_name}"
-                    logger.info(f"Capítulo encontrado: {current_chapter}")
-            
-            # Intentar identificar código NCM y su descripción
-            for col_idx, cell in enumerate(row):
-                cell_str = str(cell).strip() if not pd.isna(cell) else ""
-                
-                # Si encontramos un código NCM
-                if is_valid_ncm(cell_str):
-                    logger.debug(f"NCM encontrado en fila {idx}, columna {col_idx}: {cell_str}")
-                    last_valid_ncm = cell_str
-                    
-                    # Buscar descripción en la misma fila
-                    desc = ""
-                    aec = ""
-                    cl = ""
-                    ez = ""
-                    iz = ""
-                    uvf = ""
-                    
-                    # Intentar extraer datos de la fila actual basado en la posición
-                    if col_idx + 1 < len(row) and not pd.isna(row[col_idx + 1]):
-                        desc = str(row[col_idx + 1]).strip()
-                    
-                    # Intentar obtener otros datos si están disponibles
-                    if col_idx + 2 < len(row) and not pd.isna(row[col_idx + 2]):
-                        aec = str(row[col_idx + 2]).strip()
-                    
-                    if col_idx + 3 < len(row) and not pd.isna(row[col_idx + 3]):
-                        cl = str(row[col_idx + 3]).strip()
-                    
-                    if col_idx + 4 < len(row) and not pd.isna(row[col_idx + 4]):
-                        ez = str(row[col_idx + 4]).strip()
-                    
-                    if col_idx + 5 < len(row) and not pd.isna(row[col_idx + 5]):
-                        iz = str(row[col_idx + 5]).strip()
-                    
-                    if col_idx + 6 < len(row) and not pd.isna(row[col_idx + 6]):
-                        uvf = str(row[col_idx + 6]).strip()
-                    
-                    # Si hay descripción, guardarla como la última válida
-                    if desc:
-                        last_valid_desc = desc
-                    
-                    # Agregar a los datos válidos
-                    valid_rows.append({
-                        'NCM': last_valid_ncm,
-                        'DESCRIPCION': desc or last_valid_desc or "",
-                        'AEC': aec or "0",
-                        'CL': cl or "",
-                        'E/Z': ez or "",
-                        'I/Z': iz or "",
-                        'UVF': uvf or "",
-                        'SECTION': current_section,
-                        'CHAPTER': current_chapter
-                    })
-                    
-                    logger.debug(f"Datos extraídos: NCM={last_valid_ncm}, DESC={desc}, AEC={aec}, SECTION={current_section}, CHAPTER={current_chapter}")
-                    
-                    # Salir del bucle para esta fila
-                    break
-        
         # Crear DataFrame con los datos procesados
-        processed_df = pd.DataFrame(valid_rows)
+        processed_df = parse_tariff_rows(df)
         
         # Verificar que tenemos datos para procesar
         if processed_df.empty:
@@ -191,21 +203,10 @@ def process_excel_data():
         
         # Insertar datos
         logger.info("Guardando datos procesados en la base de datos...")
-        for _, row in processed_df.iterrows():
-            cursor.execute(
-                'INSERT INTO arancel_nacional (NCM, DESCRIPCION, AEC, CL, "E/Z", "I/Z", UVF, SECTION, CHAPTER) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                (
-                    row['NCM'], 
-                    row['DESCRIPCION'], 
-                    row['AEC'], 
-                    row['CL'], 
-                    row['E/Z'], 
-                    row['I/Z'], 
-                    row['UVF'], 
-                    row['SECTION'], 
-                    row['CHAPTER']
-                )
-            )
+        cursor.executemany(
+            'INSERT INTO arancel_nacional (NCM, DESCRIPCION, AEC, CL, "E/Z", "I/Z", UVF, SECTION, CHAPTER) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            processed_df.itertuples(index=False, name=None)
+        )
         
         # Guardar cambios
         conn.commit()